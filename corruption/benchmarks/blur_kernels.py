@@ -0,0 +1,80 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import argparse
+
+# matrix manipulation
+import numpy as np
+
+# image processing
+import cv2
+from skimage.filters import gaussian
+
+# corruption (run from the `corruption` folder, like `corrupt-image-v3.py`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imagenet_c.corruptions import gaussian_blur, defocus_blur, disk
+from glass_blur import synthetic_faces, time_per_image
+
+# ---------------------------------------------- Reference Implementations
+
+def legacy_gaussian_blur(x, severity=1):
+    '''
+    the original `gaussian_blur`, through `skimage.filters.gaussian` (cast to uint8 as `corrupt` returned it)
+    '''
+    c = [1, 2, 3, 4, 6][severity - 1]
+
+    x = gaussian(np.array(x) / 255., sigma=c, channel_axis=2)
+    return np.uint8(np.clip(x, 0, 1) * 255)
+
+def legacy_defocus_blur(x, severity=1):
+    '''
+    the original `defocus_blur`, rebuilding the disk kernel and filtering one channel at a time
+    (cast to uint8 as `corrupt` returned it)
+    '''
+    c = [(3, 0.1), (4, 0.5), (6, 0.5), (8, 0.5), (10, 0.5)][severity - 1]
+
+    x = np.array(x) / 255.
+    kernel = disk(radius=c[0], alias_blur=c[1])
+
+    channels = []
+    for d in range(3):
+        channels.append(cv2.filter2D(x[:, :, d], -1, kernel))
+    channels = np.array(channels).transpose((1, 2, 0))  # 3xHxW -> HxWx3
+
+    return np.uint8(np.clip(channels, 0, 1) * 255)
+
+# pairs of (legacy, current) implementations compared
+implementations = {
+    'gaussian_blur': (legacy_gaussian_blur, gaussian_blur),
+    'defocus_blur': (legacy_defocus_blur, defocus_blur),
+}
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='blur kernel cache speed comparison')
+    parser.add_argument('--num_images', type=int, default=500,
+        help='number of synthetic faces every implementation is timed on, per severity')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[112, 224],
+        help='side lengths of the synthetic faces')
+    args = parser.parse_args()
+
+    # ---------------------------------------------- Benchmark
+
+    print(f'{"corruption":>14} {"size":>5} {"severity":>8} {"legacy ms":>10} {"cached ms":>10} {"speedup":>8} {"max diff":>9}')
+    for size in args.sizes:
+        images = list(synthetic_faces(args.num_images, size))
+
+        for corruption_name, (legacy, current) in implementations.items():
+            for sev in range(1, 6):
+                # the first call builds the kernels, so it is left out of the timings
+                max_diff = np.abs(np.int16(legacy(images[0], sev)) - current(images[0], sev)).max()
+
+                legacy_time = time_per_image(legacy, images, sev)
+                current_time = time_per_image(current, images, sev)
+
+                print(f'{corruption_name:>14} {size:>5} {sev:>8} {legacy_time * 1e3:>10.2f} {current_time * 1e3:>10.2f} '
+                      f'{legacy_time / current_time:>7.1f}x {max_diff:>9.2g}')
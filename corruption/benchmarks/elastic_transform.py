@@ -0,0 +1,111 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import argparse
+import tracemalloc
+
+# matrix manipulation
+import numpy as np
+
+# image processing
+import cv2
+from skimage.filters import gaussian
+from scipy.ndimage import map_coordinates
+
+# corruption (run from the `corruption` folder, like `corrupt-image-v3.py`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imagenet_c.corruptions import elastic_transform
+from glass_blur import synthetic_faces, time_per_image
+
+# ---------------------------------------------- Reference Implementation
+
+def legacy_elastic_transform(image, severity=1, rng=None):
+    '''
+    the original `elastic_transform`: float64 displacement fields and `scipy.ndimage.map_coordinates`
+    over the whole (H, W, C) volume, cast to uint8 as `corrupt` returned it
+    '''
+    c = [(0.05, 0.01, 0.02),
+         (0.065, 0.01, 0.02),
+         (0.085, 0.01, 0.02),
+         (0.1, 0.01, 0.02),
+         (0.12, 0.01, 0.02)][severity - 1]
+
+    rng = np.random.default_rng() if rng is None else rng
+    image = np.array(image, dtype=np.float32) / 255.
+    shape = image.shape
+    shape_size = shape[:2]
+    c = [min(shape_size) * frac for frac in c]
+
+    # random affine
+    center_square = np.float32(shape_size) // 2
+    square_size = min(shape_size) // 3
+    pts1 = np.float32([center_square + square_size,
+                       [center_square[0] + square_size, center_square[1] - square_size],
+                       center_square - square_size])
+    pts2 = pts1 + rng.uniform(-c[2], c[2], size=pts1.shape).astype(np.float32)
+    M = cv2.getAffineTransform(pts1, pts2)
+    image = cv2.warpAffine(image, M, shape_size[::-1], borderMode=cv2.BORDER_REFLECT_101)
+
+    dx = (gaussian(rng.uniform(-1, 1, size=shape[:2]),
+                   c[1], mode='reflect', truncate=3) * c[0]).astype(np.float32)
+    dy = (gaussian(rng.uniform(-1, 1, size=shape[:2]),
+                   c[1], mode='reflect', truncate=3) * c[0]).astype(np.float32)
+    dx, dy = dx[..., np.newaxis], dy[..., np.newaxis]
+
+    x, y, z = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]), np.arange(shape[2]))
+    indices = np.reshape(y + dy, (-1, 1)), np.reshape(x + dx, (-1, 1)), np.reshape(z, (-1, 1))
+    return np.uint8(np.clip(map_coordinates(image, indices, order=1, mode='reflect').reshape(shape), 0, 1) * 255)
+
+# ---------------------------------------------- Helper Utils
+
+def peak_memory(func, image, severity):
+    '''
+    returns the peak memory (bytes) numpy allocates during one call of `func`
+    '''
+    func(image, severity)
+    tracemalloc.start()
+    func(image, severity)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='elastic_transform speed, memory and tolerance comparison')
+    parser.add_argument('--num_images', type=int, default=100,
+        help='number of synthetic faces every implementation is timed on, per severity')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[112, 224, 512],
+        help='side lengths of the synthetic faces')
+    parser.add_argument('--tolerance', type=float, default=2.,
+        help='largest absolute difference (in [0, 255]) allowed with the original implementation')
+    args = parser.parse_args()
+
+    # ---------------------------------------------- Benchmark
+
+    within_tolerance = True
+    print(f'{"size":>5} {"severity":>8} {"legacy ms":>10} {"remap ms":>9} {"speedup":>8} '
+          f'{"legacy MB":>10} {"remap MB":>9} {"max diff":>9} {"mean diff":>10}')
+    for size in args.sizes:
+        images = list(synthetic_faces(args.num_images, size))
+
+        for sev in range(1, 6):
+            # both implementations draw the same displacements from the same generator
+            diffs = np.stack([np.abs(np.int16(legacy_elastic_transform(image, sev, rng=np.random.default_rng(idx)))
+                                     - elastic_transform(image, sev, rng=np.random.default_rng(idx)))
+                              for idx, image in enumerate(images[:10])])
+            within_tolerance &= bool(diffs.max() <= args.tolerance)
+
+            legacy_time = time_per_image(legacy_elastic_transform, images, sev)
+            remap_time = time_per_image(elastic_transform, images, sev)
+            legacy_memory = peak_memory(legacy_elastic_transform, images[0], sev)
+            remap_memory = peak_memory(elastic_transform, images[0], sev)
+
+            print(f'{size:>5} {sev:>8} {legacy_time * 1e3:>10.2f} {remap_time * 1e3:>9.2f} {legacy_time / remap_time:>7.1f}x '
+                  f'{legacy_memory / 2 ** 20:>10.2f} {remap_memory / 2 ** 20:>9.2f} {diffs.max():>9.3f} {diffs.mean():>10.4f}')
+
+    print(f'Within tolerance ({args.tolerance})... {within_tolerance}')
+    sys.exit(0 if within_tolerance else 1)
@@ -0,0 +1,91 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import time
+import argparse
+
+# matrix manipulation
+import numpy as np
+
+# corruption (run from the `corruption` folder, like `corrupt-image-v3.py`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imagenet_c.corruptions import glass_blur, gaussian_kernel1d, separable_blur, to_float, from_float
+
+# ---------------------------------------------- Reference Implementation
+
+def legacy_glass_blur(x, severity=1, rng=None):
+    '''
+    the original per-pixel loop implementation of `glass_blur`, kept as the speed and correctness reference
+    (with the same Gaussian blur as `glass_blur`, so that only the shuffle is compared)
+    '''
+    c = [(0.7, 1, 2), (0.9, 2, 1), (1, 2, 3), (1.1, 3, 2), (1.5, 4, 2)][severity - 1]
+
+    rng = np.random.default_rng() if rng is None else rng
+    kernel = gaussian_kernel1d(c[0])
+    x = from_float(separable_blur(to_float(x), kernel))
+
+    for i in range(c[2]):
+        for h in range(x.shape[0] - c[1], c[1], -1):
+            for w in range(x.shape[1] - c[1], c[1], -1):
+                dx, dy = rng.integers(-c[1], c[1], size=(2,))
+                h_prime, w_prime = h + dy, w + dx
+                x[h, w], x[h_prime, w_prime] = x[h_prime, w_prime], x[h, w]
+
+    return from_float(separable_blur(to_float(x), kernel))
+
+# ---------------------------------------------- Helper Utils
+
+def synthetic_faces(num_images, size, seed=0):
+    '''
+    smooth random images standing in for aligned face crops
+    :num_images: number of images to generate
+    :size: side length of the square images
+    '''
+    rng = np.random.RandomState(seed)
+    for _ in range(num_images):
+        noise = rng.uniform(size=(size // 8, size // 8, 3))
+        yield np.uint8(np.clip(np.kron(noise, np.ones((8, 8, 1))), 0, 1) * 255)
+
+def time_per_image(func, images, severity, **kwargs):
+    '''
+    returns the mean wall time (seconds) of `func` over `images`
+    '''
+    start = time.perf_counter()
+    for image in images:
+        func(image, severity, **kwargs)
+    return (time.perf_counter() - start) / len(images)
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='glass_blur speed comparison')
+    parser.add_argument('--num_images', type=int, default=2000,
+        help='number of synthetic faces the vectorized implementation is timed on')
+    parser.add_argument('--num_legacy_images', type=int, default=20,
+        help='number of faces the (slow) legacy loop is timed and cross-checked on')
+    parser.add_argument('--size', type=int, default=224,
+        help='side length of the synthetic faces')
+    args = parser.parse_args()
+
+    images = list(synthetic_faces(args.num_images, args.size))
+    legacy_images = images[:args.num_legacy_images]
+
+    # ---------------------------------------------- Benchmark
+
+    print(f'{"severity":>8} {"legacy ms":>10} {"faithful ms":>12} {"fast ms":>8} {"speedup":>8} {"identical":>10}')
+    for sev in range(1, 6):
+
+        # the faithful kernel must reproduce the legacy loop exactly for the same random stream
+        identical = True
+        for image in legacy_images:
+            expected = legacy_glass_blur(image, sev, rng=np.random.default_rng(sev))
+            identical &= np.array_equal(expected, glass_blur(image, sev, rng=np.random.default_rng(sev)))
+
+        legacy = time_per_image(legacy_glass_blur, legacy_images, sev)
+        faithful = time_per_image(glass_blur, images, sev)
+        fast = time_per_image(glass_blur, images, sev, faithful=False)
+
+        print(f'{sev:>8} {legacy * 1e3:>10.1f} {faithful * 1e3:>12.2f} {fast * 1e3:>8.2f} {legacy / faithful:>7.0f}x {str(identical):>10}')
@@ -0,0 +1,103 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# the `corruption` folder, where `imagenet_c` is imported from (like `corrupt-image-v3.py` does)
+corruption_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the backends reported as imported (or not) after a corruption ran
+backends = ('cv2', 'skimage', 'scipy.ndimage', 'PIL.Image', 'torch', 'wand')
+
+# run in a fresh interpreter: corrupts one image and reports the first call's time and the backends imported
+first_call_script = '''
+import sys, json, time
+import numpy as np
+start = time.perf_counter()
+from imagenet_c import corrupt
+imported = time.perf_counter()
+corrupt(np.full((224, 224, 3), 128, dtype=np.uint8), severity=3, corruption_name=sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_call": done - imported,
+                  "backends": [name for name in json.loads(sys.argv[2]) if name in sys.modules]}))
+'''
+
+# ---------------------------------------------- Helper Utils
+
+def import_times(module, python=sys.executable):
+    '''
+    returns the `python -X importtime` report of importing `module` in a fresh interpreter,
+    as a list of (module name, self us, cumulative us) in import order
+    '''
+    result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'], cwd=corruption_dir,
+                            capture_output=True, text=True, check=True)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+def first_call(corruption_name, python=sys.executable):
+    '''
+    returns the import time, first call time (s) and backends imported when corrupting one image
+    with `corruption_name` in a fresh interpreter
+    '''
+    result = subprocess.run([python, '-c', first_call_script, corruption_name, json.dumps(backends)],
+                            cwd=corruption_dir, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='startup time of the imagenet_c package')
+    parser.add_argument('--module', type=str, default='imagenet_c',
+        help='module whose import is timed')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='number of fresh interpreters the import is timed in (the fastest is kept)')
+    parser.add_argument('--top', type=int, default=15,
+        help='number of modules with the largest cumulative import time to list')
+    parser.add_argument('--corruptions', type=str, nargs='*', default=None,
+        help='corruptions whose first call (backend imports and kernel building) is timed; default: all')
+    parser.add_argument('--max_import_ms', type=float, default=None,
+        help='exit with an error if importing --module takes longer than this (ms), to catch regressions')
+    args = parser.parse_args()
+
+    # ---------------------------------------------- Import Time
+
+    reports = [import_times(args.module) for _ in range(args.repeats)]
+    report = min(reports, key=lambda times: times[-1][2])
+    total_ms = report[-1][2] / 1e3
+
+    print(f'import {args.module}... {total_ms:.1f} ms (fastest of {args.repeats})')
+    print(f'{"module":>40} {"self ms":>8} {"cumulative ms":>14}')
+    for name, self_us, cumulative_us in sorted(report, key=lambda times: -times[2])[:args.top]:
+        print(f'{name:>40} {self_us / 1e3:>8.1f} {cumulative_us / 1e3:>14.1f}')
+
+    # ---------------------------------------------- First Call per Corruption
+
+    if args.corruptions is None:
+        sys.path.insert(0, corruption_dir)
+        from imagenet_c import corruption_dict
+        args.corruptions = list(corruption_dict)
+
+    print(f'\n{"corruption":>18} {"import ms":>10} {"first call ms":>14}  backends imported')
+    for corruption_name in args.corruptions:
+        try:
+            timing = first_call(corruption_name)
+        except subprocess.CalledProcessError as e:
+            print(f'{corruption_name:>18} failed: {e.stderr.strip().splitlines()[-1]}')
+            continue
+        print(f'{corruption_name:>18} {timing["import"] * 1e3:>10.1f} {timing["first_call"] * 1e3:>14.1f}  '
+              f'{", ".join(timing["backends"]) or "-"}')
+
+    if args.max_import_ms is not None and total_ms > args.max_import_ms:
+        print(f'Import of {args.module} took {total_ms:.1f} ms, more than {args.max_import_ms} ms')
+        sys.exit(1)
@@ -0,0 +1,262 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+# matrix manipulation
+import numpy as np
+
+# corruption (run from the `corruption` folder, like `corrupt-image-v3.py`)
+corruption_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, corruption_dir)
+from glass_blur import synthetic_faces
+
+# version of the results file layout
+results_version = 1
+
+# ---------------------------------------------- Helper Utils
+
+def peak_rss_mb():
+    '''
+    returns the peak resident set size (MB) of this process so far
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def load_images(size, num_images, indir_path=None, original_size=250):
+    '''
+    returns the images a corruption is benchmarked on: `num_images` synthetic faces of `size` x `size`, or for
+    `size` 'original', the first images of `indir_path` at their own resolution (synthetic faces of
+    `original_size` x `original_size` without `indir_path`)
+    '''
+    if size != 'original':
+        return list(synthetic_faces(num_images, int(size)))
+    if indir_path is None:
+        return list(synthetic_faces(num_images, original_size))
+
+    from data_handling.dataset import FRDataset
+    dataset = FRDataset(indir_path, enable_rebase=True)
+    return [dataset[idx][0] for idx in range(min(num_images, len(dataset)))]
+
+def best_time(func, repeats):
+    '''
+    returns the fastest wall time (seconds) of `repeats` calls of `func`
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def environment():
+    '''
+    returns what the results depend on besides the code: versions, CPU and commit
+    '''
+    import cv2
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=corruption_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+    }
+
+# ---------------------------------------------- Benchmark
+
+def benchmark_corruption(corruption_name, size, runs, args, results):
+    '''
+    benchmarks one corruption on the images of one size for every (severity, mode) of `runs`, putting
+    a result row per run on the `results` queue and None once done. Runs in a process of its own, so that
+    its peak RSS only covers this corruption: `peak_rss_mb` is the peak reached by the end of the run,
+    `rss_increase_mb` its increase over the process once the backends are imported and the images loaded.
+    Both are running peaks over the runs of the process, exact per run with `--isolate`.
+    '''
+    try:
+        _benchmark_corruption(corruption_name, size, runs, args, results)
+    except Exception as e:
+        results.put({'corruption': corruption_name, 'severity': None, 'size': size, 'mode': None,
+                     'error': f'{type(e).__name__}: {e}'})
+    finally:
+        results.put(None)
+
+def _benchmark_corruption(corruption_name, size, runs, args, results):
+    # the backends every corruption may import, so that their memory is not counted as the corruption's
+    import cv2, PIL.Image, skimage.color, scipy.ndimage
+    from imagenet_c import corrupt, corrupt_batch
+    cv2.setNumThreads(args.threads)
+
+    images = load_images(size, args.num_images, args.indir_path, args.original_size)
+    same_shape = len({image.shape for image in images}) == 1
+    batch = np.stack(images) if same_shape else None
+    rss_loaded = peak_rss_mb()
+
+    for sev, mode in runs:
+        row = {'corruption': corruption_name, 'severity': sev, 'size': size, 'mode': mode,
+               'num_images': len(images)}
+        if mode == 'batch' and batch is None:
+            results.put(dict(row, error='the images have different shapes'))
+            continue
+
+        if mode == 'single':
+            out = [np.empty_like(image) for image in images]
+            def run():
+                for idx, image in enumerate(images):
+                    corrupt(image, sev, corruption_name, rng=np.random.default_rng(idx), out=out[idx])
+        else:
+            out = np.empty_like(batch)
+            def run():
+                corrupt_batch(batch, corruption_name, sev, rng=np.random.default_rng(0), out=out)
+
+        try:
+            # the first call builds the kernels
+            run()
+            seconds = best_time(run, args.repeats)
+        except Exception as e:
+            results.put(dict(row, error=f'{type(e).__name__}: {e}'))
+            continue
+
+        results.put(dict(row,
+                         images_per_s=len(images) / seconds,
+                         ms_per_image=1e3 * seconds / len(images),
+                         peak_rss_mb=peak_rss_mb(),
+                         rss_increase_mb=peak_rss_mb() - rss_loaded))
+
+def run_benchmarks(args):
+    '''
+    returns the result rows of every (corruption, size), each benchmarked in a fresh process
+    (every (corruption, severity, size, mode) with `args.isolate`)
+    '''
+    runs = [(sev, mode) for sev in args.severities for mode in args.modes]
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for size in args.sizes:
+        for corruption_name in args.corruptions:
+            for process_runs in ([[run] for run in runs] if args.isolate else [runs]):
+                results = context.Queue()
+                process = context.Process(target=benchmark_corruption,
+                                          args=(corruption_name, size, process_runs, args, results))
+                process.start()
+                while (row := results.get()) is not None:
+                    rows.append(row)
+                    print_row(row)
+                process.join()
+    return rows
+
+# ---------------------------------------------- Baseline Comparison
+
+def row_key(row):
+    return row['corruption'], row['severity'], str(row['size']), row['mode']
+
+def compare(rows, baseline_rows, tolerance):
+    '''
+    returns the rows at least `tolerance` (a fraction) slower or heavier in memory than their baseline,
+    as (row, baseline row, List[str] of what regressed)
+    '''
+    baseline = {row_key(row): row for row in baseline_rows if 'error' not in row}
+    regressions = []
+    for row in rows:
+        reference = baseline.get(row_key(row))
+        if reference is None or 'error' in row:
+            continue
+        regressed = []
+        if row['images_per_s'] < reference['images_per_s'] * (1 - tolerance):
+            regressed.append(f'images/s {reference["images_per_s"]:.1f} -> {row["images_per_s"]:.1f}')
+        # a few MB of allocator noise aside
+        if row['rss_increase_mb'] > reference['rss_increase_mb'] * (1 + tolerance) + 4:
+            regressed.append(f'RSS increase {reference["rss_increase_mb"]:.1f} -> {row["rss_increase_mb"]:.1f} MB')
+        if regressed:
+            regressions.append((row, reference, regressed))
+    return regressions
+
+# ---------------------------------------------- Printing
+
+def print_row(row):
+    name = f'{row["corruption"]}/{row["severity"]}'
+    if 'error' in row:
+        print(f'{name:>22} {str(row["size"]):>8} {row["mode"]:>6}  skipped: {row["error"]}')
+        return
+    print(f'{name:>22} {str(row["size"]):>8} {row["mode"]:>6} {row["images_per_s"]:>9.1f} {row["ms_per_image"]:>9.2f} '
+          f'{row["peak_rss_mb"]:>9.1f} {row["rss_increase_mb"]:>9.1f}')
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    from imagenet_c import corruption_dict
+
+    parser = argparse.ArgumentParser(description='speed and memory of every imagenet_c corruption and severity')
+    parser.add_argument('--corruptions', type=str, nargs='+', default=list(corruption_dict),
+        help='corruptions to benchmark; default: all of `corruption_dict`')
+    parser.add_argument('--severities', type=int, nargs='+', default=[1, 2, 3, 4, 5],
+        help='severities to benchmark')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['112', '224', 'original'],
+        help='side lengths of the synthetic faces, `original` for the images of --indir_path at their own resolution')
+    parser.add_argument('--indir_path', type=str, default=None,
+        help='images benchmarked as the `original` size; synthetic faces of --original_size without it')
+    parser.add_argument('--original_size', type=int, default=250,
+        help='side length of the synthetic `original` faces when --indir_path is not given')
+    parser.add_argument('--modes', type=str, nargs='+', default=['single', 'batch'], choices=['single', 'batch'],
+        help='`single` times `corrupt` on every image, `batch` one `corrupt_batch` call on all of them')
+    parser.add_argument('--num_images', type=int, default=16,
+        help='number of images per call of a (corruption, severity, size), also the batch size')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='number of timed calls, the fastest is kept')
+    parser.add_argument('--threads', type=int, default=1,
+        help='threads OpenCV and the BLAS may use; 1 makes the numbers comparable across machines')
+    parser.add_argument('--isolate', action='store_true',
+        help='benchmark every (corruption, severity, size, mode) in a process of its own, for exact peak RSS')
+    parser.add_argument('--output', type=str, default='benchmark-results.json',
+        help='JSON file the results are written to')
+    parser.add_argument('--baseline', type=str, default=None,
+        help='results file of a previous run (e.g. of the main branch) to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='fraction by which a row may be slower (or use more memory) than its baseline before it is flagged')
+    args = parser.parse_args()
+
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENCV_FOR_THREADS_NUM'):
+        os.environ[name] = str(args.threads)
+
+    # ---------------------------------------------- Benchmark
+
+    print(f'{"corruption/severity":>22} {"size":>8} {"mode":>6} {"images/s":>9} {"ms/image":>9} {"peak MB":>9} {"+MB":>9}')
+    rows = run_benchmarks(args)
+
+    results = {'version': results_version, 'environment': environment(),
+               'settings': {name: getattr(args, name) for name in ('num_images', 'repeats', 'threads', 'original_size')},
+               'results': rows}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Results saved at... {args.output}')
+
+    # ---------------------------------------------- Baseline Comparison
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != results['settings']:
+            print(f'Warning: the baseline was run with other settings {baseline["settings"]}')
+
+        regressions = compare(rows, baseline['results'], args.tolerance)
+        num_compared = len({row_key(row) for row in rows} & {row_key(row) for row in baseline['results']})
+        print(f'Regressions over {100 * args.tolerance:.0f} % against {args.baseline}... '
+              f'{len(regressions)} of {num_compared} rows compared')
+        for row, _, regressed in regressions:
+            print(f'  {row["corruption"]}/{row["severity"]} {row["size"]} {row["mode"]}: {", ".join(regressed)}')
+        sys.exit(1 if regressions else 0)
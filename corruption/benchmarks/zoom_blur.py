@@ -0,0 +1,77 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import argparse
+
+# matrix manipulation
+import numpy as np
+
+# corruption (run from the `corruption` folder, like `corrupt-image-v3.py`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imagenet_c import corrupt_batch
+from imagenet_c.corruptions import zoom_blur, clipped_zoom
+from glass_blur import synthetic_faces, time_per_image
+
+# ---------------------------------------------- Reference Implementation
+
+def legacy_zoom_blur(x, severity=1):
+    '''
+    the original `zoom_blur`, one `scipy.ndimage.zoom` of the whole image per zoom factor,
+    cast to uint8 as `corrupt` returned it
+    '''
+    c = [np.arange(1, 1.11, 0.01),
+         np.arange(1, 1.16, 0.01),
+         np.arange(1, 1.21, 0.02),
+         np.arange(1, 1.26, 0.02),
+         np.arange(1, 1.31, 0.03)][severity - 1]
+
+    x = (np.array(x) / 255.).astype(np.float32)
+    out = np.zeros_like(x)
+    for zoom_factor in c:
+        out += clipped_zoom(x, zoom_factor)
+
+    x = (x + out) / (len(c) + 1)
+    return np.uint8(np.clip(x, 0, 1) * 255)
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='zoom_blur speed comparison and tolerance check')
+    parser.add_argument('--num_images', type=int, default=100,
+        help='number of synthetic faces every implementation is timed on, per severity')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[112, 224],
+        help='side lengths of the synthetic faces')
+    parser.add_argument('--tolerance', type=float, default=1.,
+        help='''largest absolute difference (in [0, 255]) allowed with the original implementation: both truncate
+    to uint8, so float rounding differences just below a gray level make them differ by 1''')
+    args = parser.parse_args()
+
+    # ---------------------------------------------- Benchmark
+
+    within_tolerance = True
+    print(f'{"size":>5} {"severity":>8} {"legacy ms":>10} {"remap ms":>9} {"batch ms":>9} {"speedup":>8} {"max diff":>9} {"mean diff":>10}')
+    for size in args.sizes:
+        images = list(synthetic_faces(args.num_images, size))
+
+        # pixel-level noise is the worst case for the interpolation, on top of the smooth faces
+        noise = np.random.RandomState(0).randint(0, 256, size=(size, size, 3), dtype=np.uint8)
+
+        for sev in range(1, 6):
+            # the first call builds the remap grids, so it is left out of the timings
+            diffs = np.stack([np.abs(np.int16(legacy_zoom_blur(image, sev)) - zoom_blur(image, sev))
+                              for image in images[:10] + [noise]])
+            within_tolerance &= bool(diffs.max() <= args.tolerance)
+
+            legacy_time = time_per_image(legacy_zoom_blur, images, sev)
+            remap_time = time_per_image(zoom_blur, images, sev)
+            batch_time = time_per_image(lambda batch, sev: corrupt_batch(batch, 'zoom_blur', sev), [np.stack(images)], sev)
+            batch_time /= len(images)
+
+            print(f'{size:>5} {sev:>8} {legacy_time * 1e3:>10.1f} {remap_time * 1e3:>9.2f} {batch_time * 1e3:>9.2f} '
+                  f'{legacy_time / remap_time:>7.0f}x {diffs.max():>9.3f} {diffs.mean():>10.4f}')
+
+    print(f'Within tolerance ({args.tolerance})... {within_tolerance}')
+    sys.exit(0 if within_tolerance else 1)
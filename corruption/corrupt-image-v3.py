@@ -4,79 +4,21 @@
 import os
 import argparse
 import enlighten
-from functools import partial
 
 # multiprocessing
 import multiprocessing
 
 # data handling
 from data_handling.dataset import FRDataset
-from torch.utils.data import DataLoader
 
-# image processing
-import skimage.io as io
-from skimage.util import img_as_ubyte
-from skimage.transform import resize
+# scheduling
+from pipeline.scheduler import build_tasks, shard_tasks, run_tasks
+from pipeline.manifest import Manifest, shard_manifest_path, recorded_shards
+from pipeline.writers import output_formats, image_codecs, ImageEncoder, format_writer_stats
+from pipeline.profiling import RunProfile
 
-# corruption
-from imagenet_c import corrupt
-from imagenet_c import corruption_dict
-
-# corruption names
-corruption_names = list(corruption_dict.keys())
-
-# we do not consider the weather related corruptions so remove
-corruption_names.remove('snow')
-corruption_names.remove('frost')
-corruption_names.remove('fog')
-
-# ---------------------------------------------- Helper Utils
-
-def corruption(batch, outdir_path, verbose):
-  '''
-  corrupts the batch of images passed. To be used as `collate_fn` in DataLoader
-  :batch: List[Tuple(image, target_path)]
-  :outdir_path: what path to append in front of the corrupted image's save target paths
-  :verbose: print saving details
-  '''
-
-  # corrupting the image in the current batch
-  for image, save_target_path in batch:
-
-    # keeping track of original image shape
-    ori_image_shape = image.shape[:-1]
-
-    # TODO: FIX
-    # resizing image to 224 x 224 since the `corrupt` function expects that size
-    image = img_as_ubyte(resize(image, (224, 224), anti_aliasing=True))
-
-    # iterating over severity level
-    for sev in range(1,6):
-
-      # iterating over the corruption type
-      for corruption_name in corruption_names:
-        
-        # corrupt image
-        corrupt_image = corrupt(
-          image, 
-          corruption_name=corruption_name, 
-          severity=sev
-        )
-
-        # creating appropriate save target path
-        corr_save_target_path = os.path.join(
-          os.path.join(outdir_path, f'{sev}/{corruption_name}'), 
-          save_target_path
-        )
-
-        # resizing `corrupt_image` to original size since the `corrupt` function expects that size
-        corrupt_image = img_as_ubyte(resize(corrupt_image, ori_image_shape, anti_aliasing=True))
-        
-        # save the corrupted image
-        io.imsave(corr_save_target_path, corrupt_image)
-
-        if verbose:
-          print('Saved Image at...', corr_save_target_path)
+# corruption names (we do not consider the weather related corruptions)
+from pipeline.task import benchmark_corruption_names as corruption_names
 
 if __name__ == '__main__':
 
@@ -91,14 +33,59 @@ if __name__ == '__main__':
     help='The directory that will contain the corrupted images')
   parser.add_argument('--num_workers', default=multiprocessing.cpu_count(), type=int,
     help='''The number of processes to run in parallel for faster corruption completion,
-    one additional process might run if the split is not perfect.
+    0 runs everything in the main process.
     Tip: Set it to be the number of cores in your processor - i.e. default setting''')
-  parser.add_argument('--batch_size', type=int, default=1,
-    help='batch size for dataloader of images from the `indir_path`: 1 works the best i.e. default')
+  parser.add_argument('--native-resolution', action='store_true',
+    help='''corrupt the images at their own resolution (e.g. 112 x 112 aligned faces) instead of
+    resizing them to 224 x 224 and back, which is the setting the released benchmark was created with''')
+  parser.add_argument('--seed', default=0, type=int,
+    help='''seed of the run: every (image, corruption, severity) is seeded from it and the image path,
+    so the output doesn't depend on the number of workers or on the scheduling''')
+  parser.add_argument('--output_format', default='files', choices=output_formats,
+    help='''how the corrupted images are stored: `files` saves every image at `{severity}/{corruption name}/{path}`,
+    `tar` writes WebDataset-style tar shards and `lmdb` a single LMDB database (requires `lmdb`),
+    both keyed by that same path; the manifest records the shard of every image, and a run without `--resume`
+    removes the shards of the previous one''')
+  parser.add_argument('--image_codec', default='source', choices=image_codecs,
+    help='''how the corrupted images are encoded: `source` keeps the format of every source image,
+    `png` and `webp` (lossless) re-encode them all and change their extension accordingly''')
+  parser.add_argument('--png_compression', default=None, type=int, choices=range(10),
+    help='zlib compression level of the PNG images, from 0 (fastest) to 9 (smallest); PIL uses 6 by default')
+  parser.add_argument('--writer_threads', default=1, type=int,
+    help='''number of threads per worker encoding and saving the corrupted images while the next ones are
+    corrupted, 0 saves them synchronously; the writer backpressure reported at the end tells how to size it''')
+  parser.add_argument('--writer_queue', default=None, type=int,
+    help='number of corrupted images per worker waiting to be saved at most (default: 4 per writer thread)')
+  parser.add_argument('--index_path', default=None,
+    help='''where the index of `indir_path` is cached; it is reused while none of the directories change
+    (default: under `~/.cache/decordface`)''')
+  parser.add_argument('--resume', action='store_true',
+    help='''skip the tasks the manifest of a previous run lists as finished; also corrupts the images
+    newly added to `indir_path` without touching the existing outputs''')
+  parser.add_argument('--manifest_path', default=None,
+    help='''the file recording the finished tasks (default: `manifest.jsonl` in `outdir_path`,
+    `manifest-{shard index}-of-{number of shards}.jsonl` when sharded)''')
+  parser.add_argument('--num-shards', default=1, type=int,
+    help='''number of nodes sharing the run: the images are split into this many shards by a hash of their
+    path, the same way on every node (no coordination needed besides a shared `outdir_path`) and whatever images
+    are added or removed between runs; `merge-shards.py` then checks that the shards together completed the run''')
+  parser.add_argument('--shard-index', default=0, type=int,
+    help='the shard this node runs, in [0, num-shards)')
+  parser.add_argument('--profile_path', default=None,
+    help='''JSON lines file the throughput, per (corruption, severity) timings and bytes, worker utilisation
+    and queue depths are appended to every `--profile_interval` seconds, and their totals at the end
+    (default: `profile.jsonl` in `outdir_path`, `profile-{shard index}-of-{number of shards}.jsonl` when sharded)''')
+  parser.add_argument('--profile_interval', default=30., type=float,
+    help='seconds between two lines of the profile')
   parser.add_argument('--verbose', action='store_true',
     help='weather to print details of what is going on')
   args = parser.parse_args()
 
+  if not 0 <= args.shard_index < args.num_shards:
+    parser.error(f'--shard-index must be in [0, {args.num_shards})')
+  if args.num_shards > 1 and args.output_format == 'lmdb':
+    parser.error('an LMDB database can\'t be shared by several nodes, use `--output_format tar` or `files`')
+
   # ---------------------------------------------- Create Corrupted Data Directory Structure
 
   # create the output data folder hosting all the corrupted data 
@@ -108,57 +95,111 @@ if __name__ == '__main__':
 
   # handles the image loading from `indir_path` and provides a save target path, which needs to be rebased
   # i.e. the {severity}/{corruption type} needs to be appended before the save target path
-  corrupt_dataset = FRDataset(args.indir_path, verbose=args.verbose, enable_rebase=True)
+  corrupt_dataset = FRDataset(args.indir_path, verbose=args.verbose, enable_rebase=True, index_path=args.index_path)
 
-  # if `outdir_path` folder doesn't exist then create one
-  if not os.path.exists(args.outdir_path):
-    os.mkdir(args.outdir_path)
+  # existing folders are kept so that an interrupted run can be resumed
+  os.makedirs(args.outdir_path, exist_ok=True)
 
-  # creating corruption name as the second level of hierarchy
-  for sev in range(1,6):
-    for corruption_name in corruption_names:
+  # the containers (`tar`, `lmdb`) only need the output folder
+  if args.output_format == 'files':
 
-      # creating severity as the first level of hierarchy
-      sev_target_path = os.path.join(args.outdir_path, f'{sev}')
-
-      if not os.path.exists(sev_target_path):
-        os.mkdir(sev_target_path)
+    # creating severity as the first and corruption name as the second level of hierarchy
+    sev_corr_target_paths = []
+    for sev in range(1,6):
+      for corruption_name in corruption_names:
 
-      # target path for current (severity, corruption name) combo
-      sev_corr_target_path = os.path.join(sev_target_path, f'{corruption_name}')
+        # target path for current (severity, corruption name) combo
+        sev_corr_target_path = os.path.join(args.outdir_path, f'{sev}', f'{corruption_name}')
 
-      # creating the dataset for hosting the corrupted images for current (severity, corruption name) combo
-      os.mkdir(sev_corr_target_path)
+        # creating the dataset for hosting the corrupted images for current (severity, corruption name) combo
+        os.makedirs(sev_corr_target_path, exist_ok=True)
+        sev_corr_target_paths.append(sev_corr_target_path)
 
-      # create the empty directory structure for current (severity, corruption name) combo
-      corrupt_dataset.create_directory_structure(sev_corr_target_path)
+    # create the empty directory structure for all (severity, corruption name) combos in one pass over the index
+    corrupt_dataset.create_directory_structure(sev_corr_target_paths)
 
   # ---------------------------------------------- Corruption
 
+  # one task per (image, corruption, severity), grouped per image into cost balanced chunks
+  tasks = build_tasks(len(corrupt_dataset), corruption_names)
+
+  # this node's share of the tasks, cut from the whole run so that it's the same when resuming
+  if args.num_shards > 1:
+    tasks = shard_tasks(tasks, args.shard_index, args.num_shards, corrupt_dataset.save_image_paths)
+    print(f'Shard {args.shard_index} of {args.num_shards}... {len(tasks)} corruptions')
+
+  # record of the finished tasks, skipping the ones finished by a previous run when resuming
+  if args.manifest_path:
+    manifest_path = args.manifest_path
+  elif args.num_shards > 1:
+    manifest_path = shard_manifest_path(args.outdir_path, args.shard_index, args.num_shards)
+  else:
+    manifest_path = os.path.join(args.outdir_path, 'manifest.jsonl')
+
+  # a new run replaces the shards of the previous one, which the reset manifest would no longer tell apart
+  if not args.resume and args.output_format == 'tar':
+    stale_shards = [os.path.join(args.outdir_path, shard) for shard in recorded_shards(manifest_path)]
+    stale_shards = [path for path in stale_shards if os.path.exists(path)]
+    for path in stale_shards:
+      os.remove(path)
+    if stale_shards:
+      print(f'Removed the {len(stale_shards)} shards of the previous run at... {args.outdir_path}')
+
+  manifest = Manifest(manifest_path, resume=args.resume)
+  if args.resume:
+    num_tasks = len(tasks)
+    tasks = manifest.pending_tasks(tasks, corrupt_dataset)
+    print(f'Resuming... {num_tasks - len(tasks)} of {num_tasks} corruptions already finished')
+
   # deals with progress bars
   manager = enlighten.get_manager()
 
-  # dataloader for loading the images in batches and corrupts them also within `collate_fn`
-  corruption_dataloader = DataLoader(
-    corrupt_dataset, 
-    collate_fn= partial(
-      corruption, 
-      outdir_path = args.outdir_path,
-      verbose = args.verbose
-    ),
-    batch_size = args.batch_size,
-    num_workers = args.num_workers
-  )
-
-  # progress bar for batches
-  batch_ticks = manager.counter(total=len(corruption_dataloader), desc="Batches", unit="batch", color="yellow", leave=False)
-
-  for _ in corruption_dataloader:
-    
-    # update batch progress bar
-    batch_ticks.update()
+  # encoding and saving of the corrupted images, overlapped with the corruption by the writer threads
+  writer_options = {
+    'encoder': ImageEncoder(args.image_codec, args.png_compression),
+    'num_threads': args.writer_threads,
+    'queue_size': args.writer_queue
+  }
+
+  # timings of the run, logged periodically and summarised at the end
+  if args.profile_path:
+    profile_path = args.profile_path
+  elif args.num_shards > 1:
+    profile_path = os.path.join(args.outdir_path, f'profile-{args.shard_index:05d}-of-{args.num_shards:05d}.jsonl')
+  else:
+    profile_path = os.path.join(args.outdir_path, 'profile.jsonl')
+  profile = RunProfile(args.num_workers, profile_path, args.profile_interval)
+
+  # progress bar for corrupted images
+  task_ticks = manager.counter(total=len(tasks), desc="Corruptions", unit="image", color="yellow", leave=False)
+
+  for record in run_tasks(
+    corrupt_dataset,
+    tasks,
+    outdir_path = args.outdir_path,
+    num_workers = args.num_workers,
+    native_resolution = args.native_resolution,
+    verbose = args.verbose,
+    output_format = args.output_format,
+    seed = args.seed,
+    writer_options = writer_options,
+    profile = profile
+  ):
+
+    # every image's corrupted versions are saved by now
+    manifest.record(record)
+
+    # update progress bar
+    task_ticks.update(len(record['tasks']))
 
   # done with progress bars
   manager.stop()
+  manifest.close()
 
+  profile.close()
 
+  # which corruptions dominate, and how much the compute workers waited on the writers to size `--writer_threads`
+  if profile.totals:
+    print(profile.summary())
+    print(format_writer_stats(profile.totals['writer'], profile.totals['compute_s']))
+    print(f'Profile saved at... {profile_path}')
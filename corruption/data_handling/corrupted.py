@@ -0,0 +1,99 @@
+# ---------------------------------------------- import necessary libraries
+
+# data handling
+from data_handling.dataset import FRDataset
+from data_handling.sharded import decode_image
+
+# corruption
+from pipeline.task import (benchmark_corruption_names, benchmark_severities,
+                           to_corruption_size, from_corruption_size, corrupt_task)
+from imagenet_c import use_plasma_bank
+
+# ---------------------------------------------- Dataset Handling
+
+# the corruption name of the clean samples (severity 0), a string so that torch's `default_collate`
+# can batch them along with the corrupted samples
+clean_corruption_name = 'clean'
+
+# the dataset class
+class CorruptedFRDataset(FRDataset):
+    """
+    Corrupts the images of an FR dataset on the fly, e.g. to compute the embeddings of the benchmark
+    without writing it to disk first. Every (image, corruption, severity) sample is seeded like in
+    `corrupt-image-v3.py`, so with the same `seed` and `native_resolution` the samples are identical
+    to the materialized benchmark, whatever the number of `DataLoader` workers, as long as it was saved
+    losslessly (`--image_codec png` or `webp`, or PNG sources). Pass the `encoder` of the run to reproduce
+    a lossy one (e.g. JPEG sources with the default `--image_codec source`).
+
+    Samples are ordered image by image, so a sequential sampler loads every image only once.
+    """
+    def __init__(self, indir_path, corruption_names=None, severities=benchmark_severities, native_resolution=False,
+                 seed=0, verbose=False, index_path=None, plasma_bank_path=None, encoder=None):
+        """
+        :indir_path: the path to the input data folder, can be in any format. Make sure your path don't end with `/`
+        :corruption_names: the corruptions to apply (default: None, the 16 corruptions of the benchmark)
+        :severities: the severities to apply every corruption at; severity 0 yields the clean image, once per image,
+            named `clean_corruption_name` ('clean')
+        :native_resolution: corrupt the images at their own resolution instead of the 224 x 224 round-trip
+        :seed: seed of the materialized benchmark to reproduce, see `corrupt-image-v3.py --seed`
+        :verbose: if True, prints all the details in each function call
+        :index_path: see `FRDataset`
+        :plasma_bank_path: where the plasma fractal bank of `fog` is read from, built here first if missing
+            (default: under `~/.cache/decordface`); unused without fog
+        :encoder: the `pipeline.writers.ImageEncoder` the materialized benchmark was saved with: the corrupted
+            images are encoded and decoded through it, as read back from disk (default: None, not encoded)
+        """
+        super().__init__(indir_path, verbose=verbose, enable_rebase=True, index_path=index_path)
+
+        self.corruption_names = list(benchmark_corruption_names if corruption_names is None else corruption_names)
+        self.severities = list(severities)
+        self.native_resolution = native_resolution
+        self.seed = seed
+        self.encoder = encoder
+
+        # the bank is built once here, rather than by the first `DataLoader` worker corrupting with fog
+        self.plasma_bank_path = use_plasma_bank(plasma_bank_path) if 'fog' in self.corruption_names else None
+
+        # the (corruption name, severity) tasks applied to every image
+        self.tasks = [(corruption_name, sev) for sev in self.severities for corruption_name in self.corruption_names
+                      if sev != 0] + [(clean_corruption_name, 0)] * (0 in self.severities)
+
+        # the last image loaded (per worker), shared by its consecutive samples
+        self.cached_idx = None
+
+    def load(self, image_idx):
+        """
+        returns the clean image, its size to corrupt at, and its save target path, reusing the last image loaded
+        """
+        if self.cached_idx != image_idx:
+            image, save_target_path = super().__getitem__(image_idx)
+            self.cached_image = (image, to_corruption_size(image, self.native_resolution), save_target_path)
+            self.cached_idx = image_idx
+        return self.cached_image
+
+    def __getitem__(self, idx):
+        """
+        returns (corrupted image, save target path, corruption name, severity); for severity 0, the clean image
+        with the corruption name `clean_corruption_name` ('clean')
+        """
+        image_idx, task_idx = divmod(idx, len(self.tasks))
+        corruption_name, sev = self.tasks[task_idx]
+        image, resized_image, save_target_path = self.load(image_idx)
+
+        if sev == 0:
+            return image, save_target_path, corruption_name, sev
+
+        if corruption_name == 'fog':
+            use_plasma_bank(self.plasma_bank_path)
+        corrupt_image = corrupt_task(resized_image, save_target_path, corruption_name, sev, self.seed)
+        corrupt_image = from_corruption_size(corrupt_image, image.shape[:-1], self.native_resolution)
+        if self.encoder is not None:
+            corrupt_image = decode_image(self.encoder.encode(corrupt_image, save_target_path))
+
+        return corrupt_image, save_target_path, corruption_name, sev
+
+    def __len__(self):
+        """
+        returns the number of (image, corruption, severity) samples
+        """
+        return len(self.image_paths) * len(self.tasks)
@@ -2,34 +2,55 @@
 
 # general
 import os
-from tqdm import tqdm
 
 # matrix manipulation
 import numpy as np
 
-# data handling
-from torch.utils.data import Dataset
+# data handling (torch is only needed to wrap the dataset in a `DataLoader`)
+try:
+    from torch.utils.data import Dataset
+except ImportError:
+    Dataset = object
 
 # image processing
 import skimage.io as io
 
+# indexing
+from data_handling.index import load_or_build_index
+
 # ---------------------------------------------- Dataset Handling
 
 # image extensions supported
 img_extensions = ('bmp', 'jpe', 'jp2', 'tiff', 'tif', 'sr', 'ras', 'pbm', 'pgm', 'ppm', 'png', 'jpeg', 'jpg')
 
+def as_three_channels(image):
+    '''
+    returns the image with 3 color channels, repeating the single channel of grayscale images
+    '''
+    # dealing with image which has the color channel missing
+    if len(image.shape) == 2:
+        image = np.repeat(image[:,:,np.newaxis], 3, axis=-1)
+
+    # dealing with single color channel image
+    if image.shape[-1] == 1:
+        image = np.repeat(image, 3, axis=-1)
+
+    return image
+
 # the dataset class
 class FRDataset(Dataset):
     """
     Handles the popular FR Datasets.
     """
-    def __init__(self, indir_path, outdir_path=None, verbose=False, enable_rebase=False):
+    def __init__(self, indir_path, outdir_path=None, verbose=False, enable_rebase=False, index_path=None):
         """
         :indir_path: the path to the input data folder, can be in any format. Make sure your path don't end with `/`
         :outdir_path: the path to the output data folder (can be `None` only if `enable_rebase` is set `True`). Make sure your path don't end with `/`
         :verbose: if True, prints all the details in each function call 
         :enable_rebase: if True, doesn't appends `outdir_path` to the save target paths to allow 
             appending own path at the starting of the save target paths
+        :index_path: where the index of `indir_path` is cached and reused from while none of its directories change
+            (default: None, under `~/.cache/decordface`; False disables the cache)
         """
         self.indir_path = indir_path
         
@@ -47,33 +68,15 @@ class FRDataset(Dataset):
         if self.verbose:
             print(f'Indexing... {self.indir_path}')
 
-        # list of all image paths in the `indir_path`: retrive location
-        self.image_paths = list()
-
-        # list of all image paths in the `outdir_path`: target location for saving
-        self.save_image_paths = list()
-
-         # walk through the `indir_path`
-        for dirpath, _, filenames in tqdm(os.walk(self.indir_path)):
+        # image files and directories of the `indir_path`, relative to it
+        self.index = load_or_build_index(self.indir_path, img_extensions, index_path=index_path, verbose=self.verbose)
 
-            # iterate through all the image files in the current directory
-            for filename in filenames:
-                
-                # if the file is an image
-                if filename.endswith(img_extensions):
-
-                    # append the image path to the list of all image paths
-                    self.image_paths.append(os.path.join(dirpath, filename))
-                    
-                    # create the save target path
-                    save_target_path = os.path.join(dirpath[(len(self.indir_path)+1):], filename)
-                    
-                    # if rebase is enabled then append as it is otherwise add the `outdir_path` at the starting
-                    if self.enable_rebase:
-                        self.save_image_paths.append(save_target_path)
-                    else:
-                        self.save_image_paths.append(os.path.join(self.outdir_path, save_target_path))
+        # all image paths in the `indir_path`: retrive location
+        self.image_paths = self.index.files.with_prefix(self.indir_path)
 
+        # all image paths in the `outdir_path`: target location for saving
+        # if rebase is enabled then these are relative paths otherwise `outdir_path` is added at the starting
+        self.save_image_paths = self.index.files.with_prefix(None if self.enable_rebase else self.outdir_path)
 
         if self.verbose:
             print('Indexed!')
@@ -83,7 +86,8 @@ class FRDataset(Dataset):
         """
         creates the same directory structure as `indir_path` at the `outdir_path`
         :outdir_path: (deafult: None, uses `self.outdir_path`) 
-            if passed indicates where the directory structure should be created
+            if passed indicates where the directory structure should be created;
+            can also be a list of paths to replicate the structure under all of them in one pass
         """ 
         inputpath = self.indir_path
         outputpath = self.outdir_path
@@ -99,17 +103,20 @@ class FRDataset(Dataset):
         
         if self.enable_rebase:
             outputpath = outdir_path
-        
+
+        outputpaths = [outputpath] if isinstance(outputpath, str) else list(outputpath)
+
         if self.verbose:
-            print(f'Creating same directory structure as {inputpath} at... {outputpath}')
-
-        # create the empty directory structure same as that in `inputpath`
-        for dirpath, _, _ in os.walk(inputpath):
-            structure = os.path.join(outputpath, dirpath[(len(inputpath)+1):])
-            if not os.path.isdir(structure):
-                os.mkdir(structure)
-            else:
-                print("Folder does already exits!")
+            print(f'Creating same directory structure as {inputpath} at... {", ".join(outputpaths)}')
+
+        # create the empty directory structure same as that in `inputpath` (from the index: parents come first)
+        for rel_dir in self.index.dirs:
+            for outputpath in outputpaths:
+                try:
+                    os.mkdir(os.path.join(outputpath, rel_dir))
+                except FileExistsError:
+                    if self.verbose:
+                        print("Folder does already exits!")
         
         if self.verbose:
             print('Created!')
@@ -119,15 +126,7 @@ class FRDataset(Dataset):
         returns an image (every image is converted to 3 color channels) from the dataset
         """
         # read the image in RGB format
-        image = io.imread(self.image_paths[idx])
-
-        # dealing with image which has the color channel missing
-        if len(image.shape) == 2:
-            image = np.repeat(image[:,:,np.newaxis], 3, axis=-1)
-        
-        # dealing with single color channel image
-        if image.shape[-1] == 1:
-            image = np.repeat(image, 3, axis=-1)
+        image = as_three_channels(io.imread(self.image_paths[idx]))
 
         if self.verbose:
             print(f'Retrived Image from... {self.image_paths[idx]}')
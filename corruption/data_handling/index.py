@@ -0,0 +1,201 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import hashlib
+import tempfile
+
+# matrix manipulation
+import numpy as np
+
+# ---------------------------------------------- Compact Path Storage
+
+# bump whenever the layout of the index file changes
+index_version = 1
+
+def pack_paths(paths):
+    '''
+    packs a list of strings into an (offsets, blob) pair of numpy arrays: the utf-8 bytes of all the
+    strings back to back, and the position where every string starts (plus the end of the last one)
+    '''
+    encoded = [path.encode('utf-8') for path in paths]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(path) for path in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+class PathList:
+    """
+    Read-only sequence of paths stored as (offsets, blob), optionally joined to a common prefix.
+    Costs a few bytes per path instead of a Python string object and pickles as two numpy arrays.
+    """
+    def __init__(self, offsets, blob, prefix=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.prefix = prefix
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('path index out of range')
+
+        path = self.blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+        return path if self.prefix is None else os.path.join(self.prefix, path)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def with_prefix(self, prefix):
+        '''
+        returns the same paths joined to `prefix`, sharing the storage
+        '''
+        return PathList(self.offsets, self.blob, prefix)
+
+# ---------------------------------------------- Directory Index
+
+class DirectoryIndex:
+    """
+    The image files and directories under a root folder, as paths relative to the root, along with the
+    modification times of the directories. Adding, removing or renaming an entry changes the modification
+    time of the directory containing it, so comparing them tells whether the index is still up to date.
+    """
+    def __init__(self, root, files, dirs, dir_mtimes):
+        '''
+        :root: the indexed folder
+        :files: `PathList` of the image files, relative to `root`
+        :dirs: `PathList` of the directories (parents before children, '' is `root` itself), relative to `root`
+        :dir_mtimes: modification times (ns) of `dirs`
+        '''
+        self.root = root
+        self.files = files
+        self.dirs = dirs
+        self.dir_mtimes = dir_mtimes
+
+    @classmethod
+    def scan(cls, root, extensions):
+        '''
+        indexes the files ending in one of `extensions` under `root` with `os.scandir`, in sorted order
+        (symbolic links to directories are listed but not followed, as `os.walk` does)
+        '''
+        files, dirs, dir_mtimes = [], [''], [os.stat(root).st_mtime_ns]
+
+        # depth-first, so that the files of a folder and its sub-folders stay together
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            with os.scandir(os.path.join(root, rel_dir)) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+
+            prefix = rel_dir + os.sep if rel_dir else ''
+            sub_dirs = []
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        sub_dirs.append((prefix + entry.name, entry.stat().st_mtime_ns))
+                elif entry.name.endswith(extensions):
+                    files.append(prefix + entry.name)
+
+            for rel_path, mtime in sub_dirs:
+                dirs.append(rel_path)
+                dir_mtimes.append(mtime)
+            stack.extend(rel_path for rel_path, _ in reversed(sub_dirs))
+
+        return cls(root, PathList(*pack_paths(files)), PathList(*pack_paths(dirs)), np.array(dir_mtimes, dtype=np.int64))
+
+    def is_up_to_date(self):
+        '''
+        returns True if none of the indexed directories was modified (or removed) since indexing
+        '''
+        for rel_dir, mtime in zip(self.dirs, self.dir_mtimes):
+            try:
+                if os.stat(os.path.join(self.root, rel_dir)).st_mtime_ns != mtime:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def save(self, index_path, extensions):
+        '''
+        writes the index to `index_path` atomically (through a temporary file in the same folder)
+        '''
+        index_dir = os.path.dirname(os.path.abspath(index_path))
+        os.makedirs(index_dir, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    version=index_version,
+                    root=os.path.abspath(self.root),
+                    extensions=np.array(extensions),
+                    file_offsets=self.files.offsets,
+                    file_blob=self.files.blob,
+                    dir_offsets=self.dirs.offsets,
+                    dir_blob=self.dirs.blob,
+                    dir_mtimes=self.dir_mtimes
+                )
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, root, index_path, extensions):
+        '''
+        returns the index stored at `index_path`, or None if it is missing, unreadable,
+        or was built for another folder, other extensions or an older layout
+        '''
+        try:
+            with np.load(index_path) as stored:
+                if (int(stored['version']) != index_version
+                        or str(stored['root']) != os.path.abspath(root)
+                        or tuple(stored['extensions']) != tuple(extensions)):
+                    return None
+                return cls(
+                    root,
+                    PathList(stored['file_offsets'], stored['file_blob']),
+                    PathList(stored['dir_offsets'], stored['dir_blob']),
+                    stored['dir_mtimes']
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+
+def default_index_path(root):
+    '''
+    returns where the index of `root` is cached by default: under `~/.cache/decordface`
+    (not inside `root`, since writing there would change its modification time)
+    '''
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'decordface', f'index-{key}.npz')
+
+def load_or_build_index(root, extensions, index_path=None, verbose=False):
+    '''
+    returns the `DirectoryIndex` of `root`, reusing the cached index at `index_path` when none of
+    the directories changed since, and (re)building and caching it otherwise
+    :index_path: where the index is cached (default: `default_index_path(root)`); False disables caching
+    '''
+    if index_path is False:
+        return DirectoryIndex.scan(root, extensions)
+
+    index_path = index_path or default_index_path(root)
+    index = DirectoryIndex.load(root, index_path, extensions)
+    if index is not None and index.is_up_to_date():
+        if verbose:
+            print(f'Using cached index... {index_path}')
+        return index
+
+    index = DirectoryIndex.scan(root, extensions)
+    try:
+        index.save(index_path, extensions)
+    except OSError as e:
+        if verbose:
+            print(f'Could not cache the index at {index_path}: {e}')
+    return index
@@ -0,0 +1,144 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import io as pyio
+import glob
+import tarfile
+
+# matrix manipulation
+import numpy as np
+
+# data handling (torch is only needed to wrap the dataset in a `DataLoader`)
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    IterableDataset = object
+    get_worker_info = lambda: None
+
+# image processing
+from PIL import Image
+
+from data_handling.dataset import as_three_channels
+from pipeline.manifest import SampleShards
+
+# ---------------------------------------------- Sample Keys
+
+def sample_key(save_target_path, corruption_name, severity):
+    '''
+    returns the key of a corrupted image inside a container, i.e. its path in the `files` layout:
+    `{severity}/{corruption name}/{save target path}`
+    '''
+    return f'{severity}/{corruption_name}/{save_target_path}'
+
+def parse_sample_key(key):
+    '''
+    returns the (save target path, corruption name, severity) of a key created by `sample_key`
+    '''
+    severity, corruption_name, save_target_path = key.split('/', 2)
+    return save_target_path, corruption_name, int(severity)
+
+def decode_image(data):
+    '''
+    returns the image encoded in the bytes `data`, with 3 color channels
+    '''
+    return as_three_channels(np.asarray(Image.open(pyio.BytesIO(data))))
+
+# ---------------------------------------------- Dataset Handling
+
+# the dataset class
+class ShardedFRDataset(IterableDataset):
+    """
+    Streams the corrupted images written by `corrupt-image-v3.py` with `--output_format tar` or `lmdb`,
+    sequentially through the shards (or the database) instead of opening every image file.
+    Yields (image, save target path, corruption name, severity) samples.
+
+    Tar shards may hold several versions of a sample (e.g. of a source changed before `--resume`): only the one
+    the manifests of the run record as current is yielded, see `pipeline.manifest.SampleShards`.
+
+    When used with a multi-worker `DataLoader`, every worker streams a disjoint part of the data.
+    """
+    def __init__(self, indir_path, corruption_names=None, severities=None, verbose=False, manifest_paths=None):
+        """
+        :indir_path: the output folder of the corruption run: holding the `shard-*.tar` files, or the LMDB environment
+        :corruption_names: only yield these corruptions (default: None, all)
+        :severities: only yield these severities (default: None, all)
+        :verbose: if True, prints all the details in each function call
+        :manifest_paths: the manifests of a tar run (default: None, its `manifest.jsonl`, written by `merge-shards.py`
+            for a sharded run, else the manifests of its shards). Without any, every sample of every shard is yielded.
+        """
+        self.indir_path = indir_path
+        self.corruption_names = None if corruption_names is None else set(corruption_names)
+        self.severities = None if severities is None else set(severities)
+        self.verbose = verbose
+
+        if os.path.exists(os.path.join(indir_path, 'data.mdb')):
+            self.output_format = 'lmdb'
+            self.shard_paths = []
+        else:
+            self.output_format = 'tar'
+            self.shard_paths = sorted(glob.glob(os.path.join(indir_path, 'shard-*.tar')))
+
+            if manifest_paths is None:
+                manifest_paths = [os.path.join(indir_path, 'manifest.jsonl')]
+                if not os.path.exists(manifest_paths[0]):
+                    manifest_paths = sorted(glob.glob(os.path.join(indir_path, 'manifest-*-of-*.jsonl')))
+            self.sample_shards = SampleShards(manifest_paths) if manifest_paths else None
+
+            # the shards holding no current sample are skipped altogether
+            if self.sample_shards is not None and None not in self.sample_shards.shards():
+                current = self.sample_shards.shards()
+                self.shard_paths = [path for path in self.shard_paths if os.path.basename(path) in current]
+
+        if self.verbose:
+            print(f'Found {self.output_format} data at... {indir_path} ({len(self.shard_paths)} shards)')
+
+    def _keep(self, key):
+        _, corruption_name, severity = parse_sample_key(key)
+        return ((self.corruption_names is None or corruption_name in self.corruption_names)
+                and (self.severities is None or severity in self.severities))
+
+    def _current(self, shard, key):
+        return self.sample_shards is None or self.sample_shards.is_current(shard, *parse_sample_key(key))
+
+    def _sample(self, key, data):
+        return (decode_image(data),) + parse_sample_key(key)
+
+    def _iter_tar(self, worker_id, num_workers):
+        # whole shards are split between the workers
+        for shard_path in self.shard_paths[worker_id::num_workers]:
+            if self.verbose:
+                print(f'Streaming shard... {shard_path}')
+
+            shard = os.path.basename(shard_path)
+            with tarfile.open(shard_path, 'r|') as tar:
+                for member in tar:
+                    if member.isfile() and self._keep(member.name) and self._current(shard, member.name):
+                        yield self._sample(member.name, tar.extractfile(member).read())
+
+    def _iter_lmdb(self, worker_id, num_workers):
+        import lmdb
+
+        env = lmdb.open(self.indir_path, readonly=True, lock=False, readahead=True)
+        try:
+            with env.begin() as txn:
+                # every worker takes every `num_workers`-th key, in key order
+                for position, (key, data) in enumerate(txn.cursor()):
+                    if position % num_workers != worker_id:
+                        continue
+                    key = key.decode('utf-8')
+                    if self._keep(key):
+                        yield self._sample(key, data)
+        finally:
+            env.close()
+
+    def __iter__(self):
+        """
+        yields (image, save target path, corruption name, severity) samples, every image with 3 color channels
+        """
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        if self.output_format == 'lmdb':
+            return self._iter_lmdb(worker_id, num_workers)
+        return self._iter_tar(worker_id, num_workers)
@@ -1,6 +1,6 @@
 import numpy as np
-from PIL import Image
 from .corruptions import *
+from .batch_corruptions import batch_corruption_dict
 
 corruption_tuple = (gaussian_noise, shot_noise, impulse_noise, defocus_blur,
                     glass_blur, motion_blur, zoom_blur, snow, frost, fog,
@@ -10,9 +10,51 @@ corruption_tuple = (gaussian_noise, shot_noise, impulse_noise, defocus_blur,
 corruption_dict = {corr_func.__name__: corr_func for corr_func in corruption_tuple}
 
 
-def corrupt(x, severity=1, corruption_name=None, corruption_number=-1):
+def corrupt_batch(images, corruption_name=None, severity=1, rng=None, corruption_number=-1, out=None):
     """
-    :param x: image to corrupt; a 224x224x3 numpy array in [0, 255]
+    :param images: batch of images to corrupt; a NxHxWx3 uint8 numpy array (other dtypes are cast to uint8)
+    :param corruption_name: specifies which corruption function to call; see `corrupt`
+    :param severity: strength with which to corrupt the images; an integer in [1, 5]
+    :param rng: `numpy.random.Generator` drawing the randomness of the corruption; the images
+    are corrupted in order from this one generator, so the same seed gives the same output.
+    A generator seeded from fresh OS entropy is used when None (the global numpy state never is)
+    :param corruption_number: the position of the corruption_name in `corruption_tuple`; see `corrupt`
+    :param out: NxHxWx3 uint8 array the corrupted images are written into, e.g. a reused buffer
+    (may be `images` itself); a new array is allocated when None
+    :return: the corrupted images as a NxHxWx3 uint8 array (`out` when given)
+
+    The noise, blur (but glass), contrast, brightness and saturate corruptions process
+    the whole batch in one call; the others fall back to corrupting the images one at a time.
+    """
+
+    if corruption_name:
+        corr_func = corruption_dict[corruption_name]
+    elif corruption_number != -1:
+        corr_func = corruption_tuple[corruption_number]
+    else:
+        raise ValueError("Either corruption_name or corruption_number must be passed")
+
+    images = np.asarray(images)
+    if images.ndim != 4:
+        raise ValueError(f"Expected a NxHxWxC batch of images, got shape {images.shape}")
+    if images.dtype != np.uint8:
+        images = np.uint8(images)
+
+    if corr_func.__name__ in batch_corruption_dict:
+        return batch_corruption_dict[corr_func.__name__](images, severity, rng=rng, out=out)
+
+    rng = default_rng(rng)
+    if out is None:
+        out = np.empty_like(images)
+    for x, x_out in zip(images, out):
+        corr_func(x, severity, rng=rng, out=x_out)
+
+    return out
+
+
+def corrupt(x, severity=1, corruption_name=None, corruption_number=-1, rng=None, out=None):
+    """
+    :param x: image to corrupt; a HxWx3 uint8 numpy array (the severities were tuned for 224x224)
     :param severity: strength with which to corrupt x; an integer in [0, 5]
     :param corruption_name: specifies which corruption function to call;
     must be one of 'gaussian_noise', 'shot_noise', 'impulse_noise', 'defocus_blur',
@@ -22,14 +64,11 @@ def corrupt(x, severity=1, corruption_name=None, corruption_number=-1):
                     the last four are validation functions
     :param corruption_number: the position of the corruption_name in the above list;
     an integer in [0, 18]; useful for easy looping; 15, 16, 17, 18 are validation corruption numbers
+    :param rng: `numpy.random.Generator` drawing the randomness of the corruption; see `corrupt_batch`
+    :param out: HxWx3 uint8 array the corrupted image is written into; see `corrupt_batch`
     :return: the image x corrupted by a corruption function at the given severity; same shape as input
     """
 
-    if corruption_name:
-        x_corrupted = corruption_dict[corruption_name](Image.fromarray(x), severity)
-    elif corruption_number != -1:
-        x_corrupted = corruption_tuple[corruption_number](Image.fromarray(x), severity)
-    else:
-        raise ValueError("Either corruption_name or corruption_number must be passed")
-
-    return np.uint8(x_corrupted)
+    return corrupt_batch(np.asarray(x)[np.newaxis], corruption_name=corruption_name, severity=severity,
+                         rng=rng, corruption_number=corruption_number,
+                         out=None if out is None else out[np.newaxis])[0]
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# batched counterparts of the corruptions in `corruptions.py`, operating on N x H x W x C uint8 arrays
+
+import numpy as np
+
+from .lazy import LazyModule
+sk = LazyModule('skimage')
+cv2 = LazyModule('cv2')
+
+from .corruptions import (disk, default_rng, pixel_scale, registered_kernel, gaussian_kernel1d, separable_blur,
+                          motion_blur_offsets, motion_blur_kernel, clipped_zoom_maps,
+                          to_float, to_uint8, from_float, salt_and_pepper)
+
+# cv2 filters handle at most this many channels per call
+max_cv2_channels = 128
+
+
+# /////////////// Batch Helpers ///////////////
+
+def _filter_batch(x, filter_planes):
+    """Applies `filter_planes` (a HxWxC -> HxWxC cv2 filter) to every channel of every image,
+    stacking the channels of the whole batch to make as few cv2 calls as possible."""
+    n, h, w, ch = x.shape
+    planes = np.ascontiguousarray(x.transpose((1, 2, 0, 3)).reshape(h, w, n * ch))
+
+    out = np.empty_like(planes)
+    for start in range(0, n * ch, max_cv2_channels):
+        chunk = planes[:, :, start:start + max_cv2_channels]
+        out[:, :, start:start + max_cv2_channels] = filter_planes(chunk).reshape(chunk.shape)
+
+    return out.reshape(h, w, n, ch).transpose((2, 0, 1, 3))
+
+
+def _filter2d_batch(x, kernel, **kwargs):
+    """Applies `kernel` to every channel of every image; `kwargs` are passed on to `cv2.filter2D`."""
+    return _filter_batch(x, lambda planes: cv2.filter2D(planes, -1, kernel, **kwargs))
+
+
+# /////////////// End Batch Helpers ///////////////
+
+
+# /////////////// Batch Corruptions ///////////////
+
+def gaussian_noise(x, severity=1, rng=None, out=None):
+    c = [.08, .12, 0.18, 0.26, 0.38][severity - 1]
+
+    x = to_float(x)
+    noise = default_rng(rng).standard_normal(size=x.shape, dtype=np.float32)
+    noise *= c
+    x += noise
+    return from_float(x, out)
+
+
+def shot_noise(x, severity=1, rng=None, out=None):
+    c = [60, 25, 12, 5, 3][severity - 1]
+
+    x = to_float(x)
+    x *= c
+    return from_float(np.divide(default_rng(rng).poisson(x), np.float32(c), dtype=np.float32), out)
+
+
+def impulse_noise(x, severity=1, rng=None, out=None):
+    c = [.03, .06, .09, 0.17, 0.27][severity - 1]
+
+    # image by image, so that the draws match corrupting the images one at a time
+    rng = default_rng(rng)
+    x = to_float(x)
+    for image in x:
+        salt_and_pepper(image, c, rng)
+    return from_float(x, out)
+
+
+def speckle_noise(x, severity=1, rng=None, out=None):
+    c = [.15, .2, 0.35, 0.45, 0.6][severity - 1]
+
+    x = to_float(x)
+    noise = default_rng(rng).standard_normal(size=x.shape, dtype=np.float32)
+    noise *= c
+    noise *= x
+    x += noise
+    return from_float(x, out)
+
+
+def gaussian_blur(x, severity=1, rng=None, out=None):
+    c = [1, 2, 3, 4, 6][severity - 1]
+
+    x = to_float(x)
+    sigma = c * pixel_scale(x.shape[1:3])
+    kernel = registered_kernel('gaussian_blur', severity, x.shape[1:3], lambda: gaussian_kernel1d(sigma))
+    x = _filter_batch(x, lambda planes: separable_blur(planes, kernel))
+    return from_float(x, out)
+
+
+def defocus_blur(x, severity=1, rng=None, out=None):
+    c = [(3, 0.1), (4, 0.5), (6, 0.5), (8, 0.5), (10, 0.5)][severity - 1]
+
+    scale = pixel_scale(x.shape[1:3])
+    kernel = registered_kernel('defocus_blur', severity, x.shape[1:3],
+                               lambda: disk(radius=c[0] * scale, alias_blur=c[1] * scale))
+
+    return from_float(_filter2d_batch(to_float(x), kernel), out)
+
+
+def motion_blur(x, severity=1, rng=None, out=None):
+    c = [(10, 3), (15, 5), (15, 8), (15, 12), (20, 15)][severity - 1]
+
+    x = np.asarray(x, dtype=np.float32)
+    angles = default_rng(rng).uniform(-45, 45, size=len(x))
+    radius, sigma = c[0] * pixel_scale(x.shape[1:3]), c[1] * pixel_scale(x.shape[1:3])
+
+    # the images whose angles round to the same kernel are filtered together
+    groups = {}
+    for idx, angle in enumerate(angles):
+        groups.setdefault(motion_blur_offsets(radius, angle), []).append(idx)
+
+    blurred = np.empty_like(x)
+    for offsets, idx in groups.items():
+        kernel, anchor = motion_blur_kernel(sigma, *offsets)
+        blurred[idx] = _filter2d_batch(x[idx], kernel, anchor=anchor, borderType=cv2.BORDER_REPLICATE)
+
+    return to_uint8(np.rint(blurred, out=blurred), out)
+
+
+def zoom_blur(x, severity=1, rng=None, out=None):
+    c = [np.arange(1, 1.11, 0.01),
+         np.arange(1, 1.16, 0.01),
+         np.arange(1, 1.21, 0.02),
+         np.arange(1, 1.26, 0.02),
+         np.arange(1, 1.31, 0.03)][severity - 1]
+
+    x = to_float(x)
+    maps = registered_kernel('zoom_blur', severity, x.shape[1:3], lambda: clipped_zoom_maps(x.shape[1:3], c))
+
+    def zoom_planes(planes):
+        blurred = planes.copy()
+        for map_x, map_y in maps:
+            blurred += cv2.remap(planes, map_x, map_y, cv2.INTER_LINEAR).reshape(planes.shape)
+        blurred /= len(c) + 1
+        return blurred
+
+    return from_float(_filter_batch(x, zoom_planes), out)
+
+
+def contrast(x, severity=1, rng=None, out=None):
+    c = [0.4, .3, .2, .1, .05][severity - 1]
+
+    x = to_float(x)
+    means = np.mean(x, axis=(1, 2), keepdims=True)
+    x -= means
+    x *= c
+    x += means
+    return from_float(x, out)
+
+
+def brightness(x, severity=1, rng=None, out=None):
+    c = [.1, .2, .3, .4, .5][severity - 1]
+
+    x = sk.color.rgb2hsv(to_float(x))
+    x[..., 2] = np.clip(x[..., 2] + c, 0, 1)
+    x = sk.color.hsv2rgb(x)
+
+    return from_float(x, out)
+
+
+def saturate(x, severity=1, rng=None, out=None):
+    c = [(0.3, 0), (0.1, 0), (2, 0), (5, 0.1), (20, 0.2)][severity - 1]
+
+    x = sk.color.rgb2hsv(to_float(x))
+    x[..., 1] = np.clip(x[..., 1] * c[0] + c[1], 0, 1)
+    x = sk.color.hsv2rgb(x)
+
+    return from_float(x, out)
+
+
+# /////////////// End Batch Corruptions ///////////////
+
+batch_corruption_dict = {corr_func.__name__: corr_func for corr_func in (
+    gaussian_noise, shot_noise, impulse_noise, speckle_noise, gaussian_blur, defocus_blur,
+    motion_blur, zoom_blur, contrast, brightness, saturate)}
@@ -2,34 +2,129 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from PIL import Image
 
 # /////////////// Corruption Helpers ///////////////
 
-import skimage as sk
-from skimage.filters import gaussian
+# the backends are only imported by the first corruption using them
+from .lazy import LazyModule
+sk = LazyModule('skimage')
+cv2 = LazyModule('cv2')
+ndimage = LazyModule('scipy.ndimage')
+Image = PILImage = LazyModule('PIL.Image')
+
 from io import BytesIO
-from wand.image import Image as WandImage
-from wand.api import library as wandlibrary
-import wand.color as WandColor
-import ctypes
-from PIL import Image as PILImage
-import cv2
-from scipy.ndimage import zoom as scizoom
-from scipy.ndimage.interpolation import map_coordinates
+from functools import lru_cache
 import warnings
 import os
-from pkg_resources import resource_filename
+import tempfile
 
 warnings.simplefilter("ignore", UserWarning)
 
 
+def to_float(x):
+    # uint8 image (array or PIL image) to a new float32 array in [0, 1], in a single pass
+    return np.divide(np.asarray(x), np.float32(255), dtype=np.float32)
+
+
+def to_uint8(x, out=None):
+    # float image in [0, 255] to uint8, clipping 'x' in place and truncating like np.uint8, into 'out' if given
+    np.clip(x, 0, 255, out=x)
+    if out is None:
+        out = np.empty(x.shape, dtype=np.uint8)
+    np.copyto(out, x, casting='unsafe')
+    return out
+
+
+def from_float(x, out=None):
+    # float image in [0, 1] to uint8, i.e. to_uint8(np.clip(x, 0, 1) * 255) without the temporaries
+    np.clip(x, 0, 1, out=x)
+    x *= 255
+    if out is None:
+        out = np.empty(x.shape, dtype=np.uint8)
+    np.copyto(out, x, casting='unsafe')
+    return out
+
+
+def write_out(x, out=None):
+    # uint8 image 'x', copied into 'out' if given
+    if out is None:
+        return x
+    np.copyto(out, x)
+    return out
+
+
+def salt_and_pepper(x, amount, rng):
+    # skimage.util.random_noise(mode='s&p') in place on float 'x' in [0, 1]: a fraction 'amount'
+    # of the values replaced, half by 1 (salt) and half by 0 (pepper)
+    flipped = rng.random(size=x.shape, dtype=np.float32) < amount
+    salted = rng.random(size=x.shape, dtype=np.float32) < 0.5
+    x[flipped & salted] = 1
+    x[flipped & ~salted] = 0
+    return x
+
+
+def default_rng(rng=None):
+    # every corruption draws from the `numpy.random.Generator` it is given, never from the global state,
+    # so that seeding one (image, corruption, severity) task doesn't depend on what else runs in the process
+    return np.random.default_rng() if rng is None else rng
+
+
+# kernels (and other constants of a corruption) are built once per process, i.e. once per worker,
+# keyed by (corruption, severity, image size); the size is None when the kernel doesn't depend on it
+kernel_registry = {}
+
+
+def registered_kernel(corruption, severity, size, build):
+    """
+    Returns the kernel registered under (corruption, severity, size), calling
+    build() to create it on first use. Returned arrays are read-only.
+    """
+    key = (corruption, severity, size)
+    kernel = kernel_registry.get(key)
+    if kernel is None:
+        kernel = build()
+        if isinstance(kernel, np.ndarray):
+            kernel.setflags(write=False)
+        kernel_registry[key] = kernel
+    return kernel
+
+
+def pixel_scale(shape):
+    # the pixel constants of the severities (sigmas, radii, offsets) were tuned on 224x224 images:
+    # their factor for images of 'shape' (h, w), 1 at 224x224
+    return min(shape[:2]) / 224.
+
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    # the kernel of scipy.ndimage.gaussian_filter (and so of skimage.filters.gaussian)
+    radius = int(truncate * float(sigma) + 0.5)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / float(sigma)) ** 2)
+    return kernel / kernel.sum()
+
+
+def separable_blur(x, kernel, border=None):
+    """
+    Filters all channels of 'x' (HxW or HxWxC) at once with the separable 'kernel'.
+    The default border (replicate) matches skimage.filters.gaussian's mode='nearest'.
+    """
+    border = cv2.BORDER_REPLICATE if border is None else border
+    return cv2.sepFilter2D(x, -1, kernel, kernel, borderType=border).reshape(x.shape)
+
+
+def pixel_grid(shape):
+    # the float32 (x, y) coordinates of every pixel of an image of 'shape' (h, w)
+    grid_x, grid_y = np.meshgrid(np.arange(shape[1], dtype=np.float32), np.arange(shape[0], dtype=np.float32))
+    grid_x.setflags(write=False)
+    grid_y.setflags(write=False)
+    return grid_x, grid_y
+
+
 def disk(radius, alias_blur=0.1, dtype=np.float32):
     if radius <= 8:
         L = np.arange(-8, 8 + 1)
         ksize = (3, 3)
     else:
-        L = np.arange(-radius, radius + 1)
+        L = np.arange(-int(np.ceil(radius)), int(np.ceil(radius)) + 1)
         ksize = (5, 5)
     X, Y = np.meshgrid(L, L)
     aliased_disk = np.array((X ** 2 + Y ** 2) <= radius ** 2, dtype=dtype)
@@ -39,34 +134,88 @@ def disk(radius, alias_blur=0.1, dtype=np.float32):
     return cv2.GaussianBlur(aliased_disk, ksize=ksize, sigmaX=alias_blur)
 
 
-# Tell Python about the C method
-wandlibrary.MagickMotionBlurImage.argtypes = (ctypes.c_void_p,  # wand
-                                              ctypes.c_double,  # radius
-                                              ctypes.c_double,  # sigma
-                                              ctypes.c_double)  # angle
+def motion_blur_offsets(radius, angle):
+    """
+    The (dx, dy) pixel offsets of the taps of ImageMagick's MotionBlurImage:
+    2 * ceil(radius) + 1 taps along 'angle' (degrees), rounded as MagickCore does.
+    The angle only matters through these rounded offsets, so they are the
+    (lossless) quantization of the angle the kernel cache is keyed by.
+    """
+    width = int(2 * np.ceil(radius) + 1)
+    theta = np.pi * angle / 180.
+    point_x, point_y = width * np.sin(theta), width * np.cos(theta)
+    i = np.arange(width)
+    dx = np.ceil(i * point_y / np.hypot(point_x, point_y) - 0.5).astype(np.int64)
+    dy = np.ceil(i * point_x / np.hypot(point_x, point_y) - 0.5).astype(np.int64)
+    return tuple(dx.tolist()), tuple(dy.tolist())
+
+
+@lru_cache(maxsize=8192)
+def motion_blur_kernel(sigma, dx, dy):
+    """
+    Dense cv2.filter2D kernel and anchor of a motion blur: tap i, at offset
+    (dx[i], dy[i]) from the output pixel, weighs exp(-i^2 / (2 sigma^2)),
+    normalized, i.e. a one-sided Gaussian trailing along the motion.
+    """
+    weights = np.exp(-np.arange(len(dx)) ** 2 / (2. * sigma ** 2))
+    weights /= weights.sum()
+
+    dx, dy = np.array(dx), np.array(dy)
+    kernel = np.zeros((dy.max() - dy.min() + 1, dx.max() - dx.min() + 1), dtype=np.float32)
+    np.add.at(kernel, (dy - dy.min(), dx - dx.min()), weights)
+    kernel.setflags(write=False)
+    return kernel, (int(-dx.min()), int(-dy.min()))
+
+
+def wand_motion_blur(x, radius, sigma, angle):
+    """
+    The original motion blur through ImageMagick (PNG round trip included),
+    which requires Wand and is only imported when used.
+    """
+    import ctypes
+    from wand.image import Image as WandImage
+    from wand.api import library as wandlibrary
+
+    # Tell Python about the C method
+    wandlibrary.MagickMotionBlurImage.argtypes = (ctypes.c_void_p,  # wand
+                                                  ctypes.c_double,  # radius
+                                                  ctypes.c_double,  # sigma
+                                                  ctypes.c_double)  # angle
 
+    output = BytesIO()
+    PILImage.fromarray(np.uint8(x)).save(output, format='PNG')
+    with WandImage(blob=output.getvalue()) as image:
+        wandlibrary.MagickMotionBlurImage(image.wand, radius, sigma, angle)
+        x = cv2.imdecode(np.frombuffer(image.make_blob(), np.uint8), cv2.IMREAD_UNCHANGED)
 
-# Extend wand.image.Image class to include method signature
-class MotionImage(WandImage):
-    def motion_blur(self, radius=0.0, sigma=0.0, angle=0.0):
-        wandlibrary.MagickMotionBlurImage(self.wand, radius, sigma, angle)
+    if x.ndim == 3:
+        return x[..., [2, 1, 0]]  # BGR to RGB
+    return np.array([x, x, x]).transpose((1, 2, 0))  # greyscale to RGB
 
 
 # modification of https://github.com/FLHerne/mapgen/blob/master/diamondsquare.py
-def plasma_fractal(mapsize=256, wibbledecay=3):
+def plasma_fractal(mapsize=256, wibbledecay=3, rng=None):
     """
     Generate a heightmap using diamond-square algorithm.
-    Return square 2d array, side length 'mapsize', of floats in range 0-255.
-    'mapsize' must be a power of two.
+    Return square 2d float32 array, side length 'mapsize', of floats in range 0-1.
+    'mapsize' must be a power of two. Every step fills all the squares (or
+    diamonds) of a level at once.
     """
+    rng = default_rng(rng)
     assert (mapsize & (mapsize - 1) == 0)
-    maparray = np.empty((mapsize, mapsize), dtype=np.float_)
+    maparray = np.empty((mapsize, mapsize), dtype=np.float32)
     maparray[0, 0] = 0
     stepsize = mapsize
-    wibble = 100
+    wibble = np.float32(100)
 
     def wibbledmean(array):
-        return array / 4 + wibble * np.random.uniform(-wibble, wibble, array.shape)
+        # wibble * uniform(-wibble, wibble), drawn in float32
+        noise = rng.random(array.shape, dtype=np.float32)
+        noise *= 2 * wibble * wibble
+        noise -= wibble * wibble
+        array *= np.float32(0.25)
+        array += noise
+        return array
 
     def fillsquares():
         """For each square of points stepsize apart,
@@ -96,23 +245,160 @@ def plasma_fractal(mapsize=256, wibbledecay=3):
         fillsquares()
         filldiamonds()
         stepsize //= 2
-        wibble /= wibbledecay
+        wibble /= np.float32(wibbledecay)
 
     maparray -= maparray.min()
-    return maparray / maparray.max()
+    maparray /= maparray.max()
+    return maparray
+
+
+def next_power_of_2(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+# fog's wibble decays: the bank holds maps for every one of them
+plasma_wibbledecays = (2., 1.7, 1.5, 1.4)
+
+# bump whenever the maps of the bank change for the same parameters
+plasma_bank_version = 1
+
+
+def build_plasma_bank(path, num_maps=64, mapsize=256, seed=0):
+    """
+    Writes a (len(plasma_wibbledecays), num_maps, mapsize, mapsize) float32 .npy
+    bank of plasma fractals to 'path', atomically. Every map is drawn from its
+    own child of SeedSequence(seed), so the bank only depends on the parameters.
+    """
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(plasma_wibbledecays) * num_maps))
+    bank_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(bank_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=bank_dir, suffix='.npy.tmp')
+    os.close(fd)
+    try:
+        bank = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                         shape=(len(plasma_wibbledecays), num_maps, mapsize, mapsize))
+        for maps, wibbledecay in zip(bank, plasma_wibbledecays):
+            for idx in range(num_maps):
+                maps[idx] = plasma_fractal(mapsize, wibbledecay, rng=np.random.default_rng(next(seeds)))
+        bank.flush()
+        del bank
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def default_plasma_bank_path(num_maps=64, mapsize=256, seed=0):
+    return os.path.join(os.path.expanduser('~'), '.cache', 'decordface',
+                        f'plasma-v{plasma_bank_version}-{mapsize}-{num_maps}-{seed}.npy')
+
+
+@lru_cache(maxsize=None)
+def load_plasma_bank(path=None, num_maps=64, mapsize=256, seed=0):
+    """
+    The plasma fractal bank at 'path' (default: under ~/.cache/decordface),
+    built first if missing. It is memory-mapped read-only, once per process, so
+    all the workers share the same pages through the page cache.
+    """
+    if path is None:
+        path = default_plasma_bank_path(num_maps=num_maps, mapsize=mapsize, seed=seed)
+    if not os.path.exists(path):
+        build_plasma_bank(path, num_maps=num_maps, mapsize=mapsize, seed=seed)
+    return np.load(path, mmap_mode='r')
+
+
+# the bank 'fog' reads its maps from, see use_plasma_bank
+plasma_bank_path = None
+
+
+def use_plasma_bank(path=None):
+    """
+    Makes 'fog' read its maps from the bank at 'path' (default: under
+    ~/.cache/decordface), building it first if missing, and returns the path.
+    A run calls it once before starting its workers, so that the bank is built
+    only once, and every worker then calls it with the returned path.
+    """
+    global plasma_bank_path
+    plasma_bank_path = path or default_plasma_bank_path()
+    load_plasma_bank(plasma_bank_path)
+    return plasma_bank_path
+
+
+# the frost textures of ImageNet-C (https://github.com/hendrycks/robustness, Apache-2.0, see frost/LICENSE)
+frost_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frost')
+frost_filenames = ('frost1.png', 'frost2.png', 'frost3.png', 'frost4.jpg', 'frost5.jpg', 'frost6.jpg')
+
+
+@lru_cache(maxsize=None)
+def frost_texture(idx):
+    """
+    The RGB frost texture 'idx', read once per process.
+    """
+    path = os.path.join(frost_dir, frost_filenames[idx])
+    texture = cv2.imread(path)
+    if texture is None:
+        raise FileNotFoundError(f"frost texture not found at {path}: the frost corruption needs the "
+                                "frost images of ImageNet-C (imagenet_c/frost) in the 'frost' folder of this package")
+    texture = np.ascontiguousarray(texture[..., [2, 1, 0]])
+    texture.setflags(write=False)
+    return texture
+
+
+@lru_cache(maxsize=64)
+def rescaled_frost_texture(idx, shape):
+    """
+    The frost texture 'idx', scaled up (with a 10% margin to crop from) when
+    smaller than 'shape' (h, w).
+    """
+    texture = frost_texture(idx)
+    scaling_factor = max(shape[0] / texture.shape[0], shape[1] / texture.shape[1])
+    if scaling_factor <= 1:
+        return texture
+
+    scaling_factor *= 1.1
+    texture = cv2.resize(texture, (int(np.ceil(texture.shape[1] * scaling_factor)),
+                                   int(np.ceil(texture.shape[0] * scaling_factor))), interpolation=cv2.INTER_CUBIC)
+    texture.setflags(write=False)
+    return texture
 
 
 def clipped_zoom(img, zoom_factor):
-    h = img.shape[0]
-    # ceil crop height(= crop width)
+    h, w = img.shape[:2]
+    # ceil crop height and width
     ch = int(np.ceil(h / float(zoom_factor)))
+    cw = int(np.ceil(w / float(zoom_factor)))
 
     top = (h - ch) // 2
-    img = scizoom(img[top:top + ch, top:top + ch], (zoom_factor, zoom_factor, 1), order=1)
+    left = (w - cw) // 2
+    img = ndimage.zoom(img[top:top + ch, left:left + cw], (zoom_factor, zoom_factor, 1), order=1)
     # trim off any extra pixels
     trim_top = (img.shape[0] - h) // 2
+    trim_left = (img.shape[1] - w) // 2
 
-    return img[trim_top:trim_top + h, trim_top:trim_top + h]
+    return img[trim_top:trim_top + h, trim_left:trim_left + w]
+
+
+def clipped_zoom_maps(shape, zoom_factors):
+    """
+    cv2.remap maps (float32 x and y maps) reproducing clipped_zoom on images
+    of 'shape' (h, w) for every zoom factor: scipy's linear zoom maps output
+    pixel i of a crop of n pixels zoomed to m to input pixel
+    i * (n - 1) / (m - 1), before the centre crop and trim offsets. The float
+    maps keep zoom_blur within 1 of clipped_zoom on every pixel, where the
+    1/32 pixel coordinates of fixed-point maps (cv2.convertMaps) reach 2.
+    """
+    maps = []
+    for zoom_factor in zoom_factors:
+        coords = []
+        for size in shape:
+            crop = int(np.ceil(size / float(zoom_factor)))
+            zoomed = int(round(crop * zoom_factor))
+            start, trim = (size - crop) // 2, (zoomed - size) // 2
+            coords.append(start + (np.arange(size) + trim) * ((crop - 1) / max(zoomed - 1, 1)))
+        map_y, map_x = np.meshgrid(*coords, indexing='ij')
+        maps.append((map_x.astype(np.float32), map_y.astype(np.float32)))
+    return maps
 
 
 # /////////////// End Corruption Helpers ///////////////
@@ -120,32 +406,39 @@ def clipped_zoom(img, zoom_factor):
 
 # /////////////// Corruptions ///////////////
 
-def gaussian_noise(x, severity=1):
+def gaussian_noise(x, severity=1, rng=None, out=None):
     c = [.08, .12, 0.18, 0.26, 0.38][severity - 1]
 
-    x = np.array(x) / 255.
-    return np.clip(x + np.random.normal(size=x.shape, scale=c), 0, 1) * 255
+    x = to_float(x)
+    noise = default_rng(rng).standard_normal(size=x.shape, dtype=np.float32)
+    noise *= c
+    x += noise
+    return from_float(x, out)
 
 
-def shot_noise(x, severity=1):
+def shot_noise(x, severity=1, rng=None, out=None):
     c = [60, 25, 12, 5, 3][severity - 1]
 
-    x = np.array(x) / 255.
-    return np.clip(np.random.poisson(x * c) / float(c), 0, 1) * 255
+    x = to_float(x)
+    x *= c
+    return from_float(np.divide(default_rng(rng).poisson(x), np.float32(c), dtype=np.float32), out)
 
 
-def impulse_noise(x, severity=1):
+def impulse_noise(x, severity=1, rng=None, out=None):
     c = [.03, .06, .09, 0.17, 0.27][severity - 1]
 
-    x = sk.util.random_noise(np.array(x) / 255., mode='s&p', amount=c)
-    return np.clip(x, 0, 1) * 255
+    return from_float(salt_and_pepper(to_float(x), c, default_rng(rng)), out)
 
 
-def speckle_noise(x, severity=1):
+def speckle_noise(x, severity=1, rng=None, out=None):
     c = [.15, .2, 0.35, 0.45, 0.6][severity - 1]
 
-    x = np.array(x) / 255.
-    return np.clip(x + x * np.random.normal(size=x.shape, scale=c), 0, 1) * 255
+    x = to_float(x)
+    noise = default_rng(rng).standard_normal(size=x.shape, dtype=np.float32)
+    noise *= c
+    noise *= x
+    x += noise
+    return from_float(x, out)
 
 
 def fgsm(x, source_net, severity=1):
@@ -160,89 +453,233 @@ def fgsm(x, source_net, severity=1):
     return standardize(torch.clamp(unstandardize(x.data) + c / 255. * unstandardize(torch.sign(x.grad.data)), 0, 1))
 
 
-def gaussian_blur(x, severity=1):
+def gaussian_blur(x, severity=1, rng=None, out=None):
     c = [1, 2, 3, 4, 6][severity - 1]
 
-    x = gaussian(np.array(x) / 255., sigma=c, channel_axis=2)
-    return np.clip(x, 0, 1) * 255
+    x = to_float(x)
+    sigma = c * pixel_scale(x.shape)
+    kernel = registered_kernel('gaussian_blur', severity, x.shape[:2], lambda: gaussian_kernel1d(sigma))
+    return from_float(separable_blur(x, kernel), out)
 
 
-def glass_blur(x, severity=1):
+def glass_shuffle_indices(height, width, max_delta, offsets, faithful=True):
+    """
+    Flat gather indices reproducing one pass of the glass_blur local pixel shuffle.
+    'offsets' holds one (dx, dy) row per interior pixel, in the order the original
+    loop visits them (rows bottom-up, columns right-to-left).
+
+    The original loop "swaps" with a numpy tuple assignment of two views, which
+    really copies x[h', w'] into x[h, w] and leaves the neighbour untouched. With
+    'faithful' the sequential semantics are kept exactly: a pixel that reads from a
+    neighbour already visited in this pass picks up that neighbour's new value.
+    The chains are resolved by pointer jumping instead of a per-pixel loop.
+    Without 'faithful' every pixel reads the untouched neighbour (a plain
+    displacement field), which is cheaper but not byte-identical.
+    """
+    hs = np.arange(height - max_delta, max_delta, -1)
+    ws = np.arange(width - max_delta, max_delta, -1)
+    index = np.arange(height * width)
+    if len(hs) == 0 or len(ws) == 0:
+        return index
+
+    h, w = np.meshgrid(hs, ws, indexing='ij')
+    h, w = h.ravel(), w.ravel()
+    h_prime, w_prime = h + offsets[:, 1], w + offsets[:, 0]
+    dst = h * width + w
+    src = h_prime * width + w_prime
+    index[dst] = src
+
+    if not faithful:
+        return index
+
+    # a source was already visited iff it is interior and comes later in row-major order
+    interior = (h_prime > max_delta) & (h_prime <= height - max_delta) & \
+               (w_prime > max_delta) & (w_prime <= width - max_delta)
+    pending = np.zeros(height * width, dtype=bool)
+    pending[dst] = interior & (src > dst)
+
+    todo = np.flatnonzero(pending)
+    while len(todo):
+        nxt = index[todo]
+        index[todo] = index[nxt]
+        pending[todo] = pending[nxt]
+        todo = todo[pending[todo]]
+
+    return index
+
+
+def glass_blur(x, severity=1, rng=None, faithful=True, out=None):
     # sigma, max_delta, iterations
     c = [(0.7, 1, 2), (0.9, 2, 1), (1, 2, 3), (1.1, 3, 2), (1.5, 4, 2)][severity - 1]
 
-    x = np.uint8(gaussian(np.array(x) / 255., sigma=c[0], channel_axis=2) * 255)
+    rng = default_rng(rng)
+    height, width = np.shape(x)[:2]
+    sigma = c[0] * pixel_scale((height, width))
+    max_delta = max(1, int(round(c[1] * pixel_scale((height, width)))))
+
+    kernel = registered_kernel('glass_blur', severity, (height, width), lambda: gaussian_kernel1d(sigma))
+    x = from_float(separable_blur(to_float(x), kernel))
+    num_pixels = max(height - 2 * max_delta, 0) * max(width - 2 * max_delta, 0)
 
-    # locally shuffle pixels
+    # locally shuffle pixels, drawing all offsets of a pass in one go
     for i in range(c[2]):
-        for h in range(224 - c[1], c[1], -1):
-            for w in range(224 - c[1], c[1], -1):
-                dx, dy = np.random.randint(-c[1], c[1], size=(2,))
-                h_prime, w_prime = h + dy, w + dx
-                # swap
-                x[h, w], x[h_prime, w_prime] = x[h_prime, w_prime], x[h, w]
+        offsets = rng.integers(-max_delta, max_delta, size=(num_pixels, 2))
+        index = glass_shuffle_indices(height, width, max_delta, offsets, faithful=faithful)
+        x = x.reshape(height * width, -1)[index].reshape(x.shape)
 
-    return np.clip(gaussian(x / 255., sigma=c[0], channel_axis=2), 0, 1) * 255
+    return from_float(separable_blur(to_float(x), kernel), out)
 
 
-def defocus_blur(x, severity=1):
+def defocus_blur(x, severity=1, rng=None, out=None):
     c = [(3, 0.1), (4, 0.5), (6, 0.5), (8, 0.5), (10, 0.5)][severity - 1]
 
-    x = np.array(x) / 255.
-    kernel = disk(radius=c[0], alias_blur=c[1])
+    x = to_float(x)
+    scale = pixel_scale(x.shape)
+    kernel = registered_kernel('defocus_blur', severity, x.shape[:2],
+                               lambda: disk(radius=c[0] * scale, alias_blur=c[1] * scale))
 
-    channels = []
-    for d in range(3):
-        channels.append(cv2.filter2D(x[:, :, d], -1, kernel))
-    channels = np.array(channels).transpose((1, 2, 0))  # 3x224x224 -> 224x224x3
+    # all channels in one call
+    x = cv2.filter2D(x, -1, kernel).reshape(x.shape)
 
-    return np.clip(channels, 0, 1) * 255
+    return from_float(x, out)
 
 
-def motion_blur(x, severity=1):
+def motion_blur(x, severity=1, rng=None, strict=False, out=None):
     c = [(10, 3), (15, 5), (15, 8), (15, 12), (20, 15)][severity - 1]
 
-    output = BytesIO()
-    x.save(output, format='PNG')
-    x = MotionImage(blob=output.getvalue())
+    angle = default_rng(rng).uniform(-45, 45)
+    radius, sigma = c[0] * pixel_scale(np.shape(x)), c[1] * pixel_scale(np.shape(x))
+    if strict:
+        x = wand_motion_blur(np.asarray(x), radius=radius, sigma=sigma, angle=angle)
+        return write_out(x, out)
 
-    x.motion_blur(radius=c[0], sigma=c[1], angle=np.random.uniform(-45, 45))
+    # ImageMagick's kernel, replicating the edges like its default virtual pixels
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 2:  # greyscale to RGB
+        x = np.array([x, x, x]).transpose((1, 2, 0))
+    kernel, anchor = motion_blur_kernel(sigma, *motion_blur_offsets(radius, angle))
+    x = cv2.filter2D(x, -1, kernel, anchor=anchor, borderType=cv2.BORDER_REPLICATE)
 
-    x = cv2.imdecode(np.fromstring(x.make_blob(), np.uint8),
-                     cv2.IMREAD_UNCHANGED)
+    return to_uint8(np.rint(x, out=x), out)  # rounded to 8 bits as by the PNG round trip
 
-    if x.shape != (224, 224):
-        return np.clip(x[..., [2, 1, 0]], 0, 255)  # BGR to RGB
-    else:  # greyscale to RGB
-        return np.clip(np.array([x, x, x]).transpose((1, 2, 0)), 0, 255)
 
-
-def zoom_blur(x, severity=1):
+def zoom_blur(x, severity=1, rng=None, out=None):
     c = [np.arange(1, 1.11, 0.01),
          np.arange(1, 1.16, 0.01),
          np.arange(1, 1.21, 0.02),
          np.arange(1, 1.26, 0.02),
          np.arange(1, 1.31, 0.03)][severity - 1]
 
-    x = (np.array(x) / 255.).astype(np.float32)
-    out = np.zeros_like(x)
-    for zoom_factor in c:
-        out += clipped_zoom(x, zoom_factor)
-
-    x = (x + out) / (len(c) + 1)
-    return np.clip(x, 0, 1) * 255
-
-def spatter(x, severity=1):
+    x = to_float(x)
+    maps = registered_kernel('zoom_blur', severity, x.shape[:2], lambda: clipped_zoom_maps(x.shape[:2], c))
+
+    # one remap of all channels per zoom factor
+    blurred = x.copy()
+    for map_x, map_y in maps:
+        blurred += cv2.remap(x, map_x, map_y, cv2.INTER_LINEAR).reshape(x.shape)
+
+    blurred /= len(c) + 1
+    return from_float(blurred, out)
+
+
+def snow(x, severity=1, rng=None, out=None):
+    c = [(0.1, 0.3, 3, 0.5, 10, 4, 0.8),
+         (0.2, 0.3, 2, 0.5, 12, 4, 0.7),
+         (0.55, 0.3, 4, 0.9, 12, 8, 0.7),
+         (0.55, 0.3, 4.5, 0.85, 12, 8, 0.65),
+         (0.55, 0.3, 2.5, 0.85, 12, 12, 0.55)][severity - 1]
+
+    rng = default_rng(rng)
+    x = to_float(x)
+    shape = x.shape[:2]
+    snow_layer = rng.standard_normal(size=shape, dtype=np.float32)
+    snow_layer *= c[1]
+    snow_layer += c[0]
+
+    # clipped_zoom through a cached remap grid, as in zoom_blur
+    (map_x, map_y), = registered_kernel('snow', severity, shape, lambda: clipped_zoom_maps(shape, [c[2]]))
+    snow_layer = cv2.remap(snow_layer, map_x, map_y, cv2.INTER_LINEAR)
+    snow_layer[snow_layer < c[3]] = 0
+
+    # motion blur of the 8-bit layer, with the kernel of ImageMagick as in motion_blur
+    snow_layer = (np.clip(snow_layer, 0, 1) * 255).astype(np.uint8).astype(np.float32)
+    kernel, anchor = motion_blur_kernel(c[5], *motion_blur_offsets(c[4], rng.uniform(-135, -45)))
+    snow_layer = cv2.filter2D(snow_layer, -1, kernel, anchor=anchor, borderType=cv2.BORDER_REPLICATE)
+    snow_layer = np.rint(snow_layer) / np.float32(255)
+
+    if x.ndim == 3:
+        snow_layer = snow_layer[..., np.newaxis]
+        gray = cv2.cvtColor(x, cv2.COLOR_RGB2GRAY)[..., np.newaxis]
+    else:  # greyscale
+        gray = x
+    x = c[6] * x + (1 - c[6]) * np.maximum(x, gray * 1.5 + 0.5)
+    x += snow_layer
+    x += np.rot90(snow_layer, k=2)
+    return from_float(x, out)
+
+
+def frost(x, severity=1, rng=None, out=None):
+    c = [(1, 0.4),
+         (0.8, 0.6),
+         (0.7, 0.7),
+         (0.65, 0.7),
+         (0.6, 0.75)][severity - 1]
+
+    rng = default_rng(rng)
+    x = np.asarray(x)
+    height, width = x.shape[:2]
+
+    # as in ImageNet-C, one of the first five textures
+    texture = rescaled_frost_texture(int(rng.integers(5)), (height, width))
+
+    # randomly crop
+    top, left = rng.integers(texture.shape[0] - height + 1), rng.integers(texture.shape[1] - width + 1)
+    texture = texture[top:top + height, left:left + width]
+    if x.ndim == 2:  # greyscale
+        texture = cv2.cvtColor(texture, cv2.COLOR_RGB2GRAY)
+
+    x = np.multiply(x, np.float32(c[0]), dtype=np.float32)
+    x += np.float32(c[1]) * texture
+    return to_uint8(x, out)
+
+
+def fog(x, severity=1, rng=None, out=None):
+    c = [(1.5, 2), (2., 2), (2.5, 1.7), (2.5, 1.5), (3., 1.4)][severity - 1]
+
+    rng = default_rng(rng)
+    x = to_float(x)
+    height, width = x.shape[:2]
+    max_val = x.max()
+
+    bank = load_plasma_bank(plasma_bank_path)
+    if max(height, width) <= bank.shape[-1]:
+        # a random map of the bank, cropped at a random offset
+        maps = bank[plasma_wibbledecays.index(c[1])]
+        top, left = rng.integers(bank.shape[-2] - height + 1), rng.integers(bank.shape[-1] - width + 1)
+        fractal = maps[rng.integers(len(maps)), top:top + height, left:left + width]
+    else:  # larger than the maps of the bank
+        fractal = plasma_fractal(mapsize=next_power_of_2(max(height, width)), wibbledecay=c[1], rng=rng)
+        fractal = fractal[:height, :width]
+
+    x += np.float32(c[0]) * (fractal[..., np.newaxis] if x.ndim == 3 else fractal)
+    x *= max_val / (max_val + c[0])
+    return from_float(x, out)
+
+
+def spatter(x, severity=1, rng=None, out=None):
     c = [(0.65, 0.3, 4, 0.69, 0.6, 0),
          (0.65, 0.3, 3, 0.68, 0.6, 0),
          (0.65, 0.3, 2, 0.68, 0.5, 0),
          (0.65, 0.3, 1, 0.65, 1.5, 1),
          (0.67, 0.4, 1, 0.65, 1.5, 1)][severity - 1]
-    x = np.array(x, dtype=np.float32) / 255.
+    x = to_float(x)
 
-    liquid_layer = np.random.normal(size=x.shape[:2], loc=c[0], scale=c[1])
+    liquid_layer = default_rng(rng).standard_normal(size=x.shape[:2], dtype=np.float32)
+    liquid_layer *= c[1]
+    liquid_layer += c[0]
 
-    liquid_layer = gaussian(liquid_layer, sigma=c[2])
+    liquid_layer = separable_blur(liquid_layer, registered_kernel(
+        'spatter', severity, None, lambda: gaussian_kernel1d(c[2])))
     liquid_layer[liquid_layer < c[3]] = 0
     if c[5] == 0:
         liquid_layer = (liquid_layer * 255).astype(np.uint8)
@@ -267,83 +704,89 @@ def spatter(x, severity=1):
         color = cv2.cvtColor(color, cv2.COLOR_BGR2BGRA)
         x = cv2.cvtColor(x, cv2.COLOR_BGR2BGRA)
 
-        return cv2.cvtColor(np.clip(x + m * color, 0, 1), cv2.COLOR_BGRA2BGR) * 255
+        m *= color
+        x += m
+        return from_float(cv2.cvtColor(x, cv2.COLOR_BGRA2BGR), out)
     else:
-        m = np.where(liquid_layer > c[3], 1, 0)
-        m = gaussian(m.astype(np.float32), sigma=c[4])
+        m = (liquid_layer > c[3]).astype(np.float32)
+        m = separable_blur(m, registered_kernel(
+            'spatter_mud', severity, None, lambda: gaussian_kernel1d(c[4])))
         m[m < 0.8] = 0
 
         # mud brown
-        color = np.concatenate((63 / 255. * np.ones_like(x[..., :1]),
-                                42 / 255. * np.ones_like(x[..., :1]),
-                                20 / 255. * np.ones_like(x[..., :1])), axis=2)
+        color = np.float32([63 / 255., 42 / 255., 20 / 255.]) * m[..., np.newaxis]
 
-        color *= m[..., np.newaxis]
         x *= (1 - m[..., np.newaxis])
-
-        return np.clip(x + color, 0, 1) * 255
+        x += color
+        return from_float(x, out)
 
 
-def contrast(x, severity=1):
+def contrast(x, severity=1, rng=None, out=None):
     c = [0.4, .3, .2, .1, .05][severity - 1]
 
-    x = np.array(x) / 255.
+    x = to_float(x)
     means = np.mean(x, axis=(0, 1), keepdims=True)
-    return np.clip((x - means) * c + means, 0, 1) * 255
+    x -= means
+    x *= c
+    x += means
+    return from_float(x, out)
 
 
-def brightness(x, severity=1):
+def brightness(x, severity=1, rng=None, out=None):
     c = [.1, .2, .3, .4, .5][severity - 1]
 
-    x = np.array(x) / 255.
-    x = sk.color.rgb2hsv(x)
+    x = sk.color.rgb2hsv(to_float(x))
     x[:, :, 2] = np.clip(x[:, :, 2] + c, 0, 1)
     x = sk.color.hsv2rgb(x)
 
-    return np.clip(x, 0, 1) * 255
+    return from_float(x, out)
 
 
-def saturate(x, severity=1):
+def saturate(x, severity=1, rng=None, out=None):
     c = [(0.3, 0), (0.1, 0), (2, 0), (5, 0.1), (20, 0.2)][severity - 1]
 
-    x = np.array(x) / 255.
-    x = sk.color.rgb2hsv(x)
+    x = sk.color.rgb2hsv(to_float(x))
     x[:, :, 1] = np.clip(x[:, :, 1] * c[0] + c[1], 0, 1)
     x = sk.color.hsv2rgb(x)
 
-    return np.clip(x, 0, 1) * 255
+    return from_float(x, out)
 
 
-def jpeg_compression(x, severity=1):
+def jpeg_compression(x, severity=1, rng=None, out=None):
     c = [25, 18, 15, 10, 7][severity - 1]
 
     output = BytesIO()
-    x.save(output, 'JPEG', quality=c)
-    x = PILImage.open(output)
+    PILImage.fromarray(np.asarray(x)).save(output, 'JPEG', quality=c)
+    x = np.asarray(PILImage.open(output))
 
-    return x
+    return write_out(x, out)
 
 
-def pixelate(x, severity=1):
+def pixelate(x, severity=1, rng=None, out=None):
     c = [0.6, 0.5, 0.4, 0.3, 0.25][severity - 1]
 
-    x = x.resize((int(224 * c), int(224 * c)), PILImage.BOX)
-    x = x.resize((224, 224), PILImage.BOX)
+    x = PILImage.fromarray(np.asarray(x))
+    width, height = x.size
+    x = x.resize((int(width * c), int(height * c)), PILImage.BOX)
+    x = np.asarray(x.resize((width, height), PILImage.BOX))
 
-    return x
+    return write_out(x, out)
 
 
 # mod of https://gist.github.com/erniejunior/601cdf56d2b424757de5
-def elastic_transform(image, severity=1):
-    c = [(224 * 0.05, 224 * 0.01, 224 * 0.02),
-         (224 * 0.065, 224 * 0.01, 224 * 0.02),
-         (224 * 0.085, 224 * 0.01, 224 * 0.02),
-         (224 * 0.1, 224 * 0.01, 224 * 0.02),
-         (224 * 0.12, 224 * 0.01, 224 * 0.02)][severity - 1]
-
-    image = np.array(image, dtype=np.float32) / 255.
+def elastic_transform(image, severity=1, rng=None, out=None):
+    # fractions of the image size (the constants were tuned as multiples of 224)
+    c = [(0.05, 0.01, 0.02),
+         (0.065, 0.01, 0.02),
+         (0.085, 0.01, 0.02),
+         (0.1, 0.01, 0.02),
+         (0.12, 0.01, 0.02)][severity - 1]
+
+    rng = default_rng(rng)
+    image = to_float(image)
     shape = image.shape
     shape_size = shape[:2]
+    c = [min(shape_size) * frac for frac in c]
 
     # random affine
     center_square = np.float32(shape_size) // 2
@@ -351,19 +794,25 @@ def elastic_transform(image, severity=1):
     pts1 = np.float32([center_square + square_size,
                        [center_square[0] + square_size, center_square[1] - square_size],
                        center_square - square_size])
-    pts2 = pts1 + np.random.uniform(-c[2], c[2], size=pts1.shape).astype(np.float32)
+    pts2 = pts1 + rng.uniform(-c[2], c[2], size=pts1.shape).astype(np.float32)
     M = cv2.getAffineTransform(pts1, pts2)
     image = cv2.warpAffine(image, M, shape_size[::-1], borderMode=cv2.BORDER_REFLECT_101)
 
-    dx = (gaussian(np.random.uniform(-1, 1, size=shape[:2]),
-                   c[1], mode='reflect', truncate=3) * c[0]).astype(np.float32)
-    dy = (gaussian(np.random.uniform(-1, 1, size=shape[:2]),
-                   c[1], mode='reflect', truncate=3) * c[0]).astype(np.float32)
-    dx, dy = dx[..., np.newaxis], dy[..., np.newaxis]
-
-    x, y, z = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]), np.arange(shape[2]))
-    indices = np.reshape(y + dy, (-1, 1)), np.reshape(x + dx, (-1, 1)), np.reshape(z, (-1, 1))
-    return np.clip(map_coordinates(image, indices, order=1, mode='reflect').reshape(shape), 0, 1) * 255
+    # smooth random displacement fields, in float32 throughout
+    kernel = registered_kernel('elastic_transform', severity, shape_size,
+                               lambda: gaussian_kernel1d(c[1], truncate=3).astype(np.float32))
+    dx = separable_blur(rng.uniform(-1, 1, size=shape_size).astype(np.float32), kernel,
+                        border=cv2.BORDER_REFLECT) * np.float32(c[0])
+    dy = separable_blur(rng.uniform(-1, 1, size=shape_size).astype(np.float32), kernel,
+                        border=cv2.BORDER_REFLECT) * np.float32(c[0])
+
+    # displace the cached pixel grid and resample all channels in one remap;
+    # BORDER_REFLECT is map_coordinates' mode='reflect'
+    grid_x, grid_y = registered_kernel('elastic_transform_grid', None, shape_size, lambda: pixel_grid(shape_size))
+    dx += grid_x
+    dy += grid_y
+    image = cv2.remap(image, dx, dy, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT).reshape(shape)
+    return from_float(image, out)
 
 
 # /////////////// End Corruptions ///////////////
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# deferred imports of the image processing backends, so that importing `imagenet_c` stays cheap
+# (every spawned worker pays it) and a corruption only imports the backends it uses
+
+import importlib
+
+
+class LazyModule:
+    """
+    Stands for the module 'name', imported on the first attribute access,
+    e.g. `cv2 = LazyModule('cv2')` and then `cv2.filter2D(...)` as usual.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # only called for the attributes of the module, not for `_name` and `_module`
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported yet'
+        return f'<lazy module {self._name!r} ({state})>'
@@ -0,0 +1,66 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import argparse
+from collections import Counter
+
+# data handling
+from data_handling.dataset import FRDataset
+
+# scheduling
+from pipeline.scheduler import build_tasks, task_shards
+from pipeline.manifest import Manifest, shard_manifest_path, merge_manifests
+
+# corruption names (we do not consider the weather related corruptions)
+from pipeline.task import benchmark_corruption_names as corruption_names
+
+if __name__ == '__main__':
+
+  # ---------------------------------------------- Parsing Command Line Arguments
+
+  # command line argument parser
+  parser = argparse.ArgumentParser(description='Merge the manifests of a sharded corruption run and check it is complete')
+  parser.add_argument('--indir_path', default='./datasets/data',
+    help='The directory containing the images the run corrupted, as passed to `corrupt-image-v3.py`')
+  parser.add_argument('--outdir_path', default='./datasets/corrupt-data',
+    help='The directory the shards saved the corrupted images and their manifests to')
+  parser.add_argument('--num-shards', required=True, type=int,
+    help='the number of shards the run was split into')
+  parser.add_argument('--manifest_path', default=None,
+    help='''the merged manifest, which `corrupt-image-v3.py --resume` accepts like the one of an unsharded run
+    (default: `manifest.jsonl` in `outdir_path`)''')
+  parser.add_argument('--index_path', default=None,
+    help='where the index of `indir_path` is cached, as passed to `corrupt-image-v3.py`')
+  args = parser.parse_args()
+
+  # ---------------------------------------------- Merge
+
+  shard_paths = [shard_manifest_path(args.outdir_path, shard_index, args.num_shards)
+                 for shard_index in range(args.num_shards)]
+  missing_shards = [shard_index for shard_index, path in enumerate(shard_paths) if not os.path.exists(path)]
+  if missing_shards:
+    print(f'No manifest for the shards... {missing_shards}')
+
+  manifest_path = args.manifest_path or os.path.join(args.outdir_path, 'manifest.jsonl')
+  num_records = merge_manifests([path for path in shard_paths if os.path.exists(path)], manifest_path)
+  print(f'Merged {num_records} records of {args.num_shards - len(missing_shards)} shards into... {manifest_path}')
+
+  # ---------------------------------------------- Completeness Check
+
+  # the tasks of the whole run, as every shard cut them
+  dataset = FRDataset(args.indir_path, enable_rebase=True, index_path=args.index_path)
+  tasks = build_tasks(len(dataset), corruption_names)
+  shards = dict(zip(tasks, task_shards(tasks, args.num_shards, dataset.save_image_paths)))
+
+  # the tasks no shard finished, or finished on a source image that changed since
+  manifest = Manifest(manifest_path, resume=True)
+  pending = manifest.pending_tasks(tasks, dataset)
+  manifest.close()
+
+  print(f'Finished... {len(tasks) - len(pending)} of {len(tasks)} corruptions')
+  if pending:
+    for shard_index, num_pending in sorted(Counter(shards[task] for task in pending).items()):
+      print(f'  shard {shard_index}: {num_pending} corruptions missing, rerun it with --resume')
+    sys.exit(1)
@@ -0,0 +1,230 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import json
+import hashlib
+
+# ---------------------------------------------- Helper Utils
+
+def file_digest(path, block_size=1 << 20):
+    '''
+    returns the sha1 hex digest of the content of the file at `path`
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_record(path, save_target_path):
+    '''
+    returns the manifest fields identifying the current content of a source image
+    :path: where the source image is read from
+    :save_target_path: the path of the image relative to the `{severity}/{corruption name}` folders,
+        which is what the manifest is keyed on
+    '''
+    stat = os.stat(path)
+    return {
+        'path': save_target_path,
+        'sha1': file_digest(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+
+def shard_manifest_path(outdir_path, shard_index, num_shards):
+    '''
+    returns the default manifest path of shard `shard_index` out of `num_shards` of a run, see `merge_manifests`
+    '''
+    return os.path.join(outdir_path, f'manifest-{shard_index:05d}-of-{num_shards:05d}.jsonl')
+
+def merge_manifests(manifest_paths, merged_path):
+    '''
+    concatenates the complete lines of the manifests (e.g. of the shards of a run) into `merged_path`,
+    written under a temporary name and renamed, and returns the number of records merged
+    '''
+    num_records = 0
+    with open(merged_path + '.tmp', 'wb') as merged:
+        for manifest_path in manifest_paths:
+            with open(manifest_path, 'rb') as f:
+                for line in f:
+                    # a line cut short by a killed run
+                    if not line.endswith(b'\n'):
+                        break
+                    merged.write(line)
+                    num_records += 1
+        merged.flush()
+        os.fsync(merged.fileno())
+    os.replace(merged_path + '.tmp', merged_path)
+    return num_records
+
+def manifest_records(manifest_path):
+    '''
+    yields the complete records of a manifest, in the order they were appended
+    '''
+    with open(manifest_path, 'rb') as f:
+        for line in f:
+            # a line cut short by a killed run
+            if not line.endswith(b'\n'):
+                break
+            yield json.loads(line)
+
+def recorded_shards(manifest_path):
+    '''
+    returns the names of the tar shards the records of a manifest refer to, none if it doesn't exist
+    '''
+    if not os.path.exists(manifest_path):
+        return set()
+    return {record['shard'] for record in manifest_records(manifest_path) if record.get('shard')}
+
+# ---------------------------------------------- Manifest
+
+class Manifest:
+    """
+    Append-only record of the finished (source path, corruption, severity, content hash) tasks of a run.
+
+    Every line is a JSON object describing one source image and a list of the (corruption name, severity)
+    tasks finished for it. A line is appended with a single `os.write` once all its corrupted images are
+    saved, so a killed run leaves at most a truncated last line behind, which is ignored when loading.
+    """
+    def __init__(self, manifest_path, resume=False):
+        '''
+        :manifest_path: the manifest file, created if it doesn't exist
+        :resume: if True, loads the finished tasks from the existing manifest; otherwise starts a new one
+        '''
+        self.manifest_path = manifest_path
+
+        # path -> source fields of the latest record and the set of finished (corruption name, severity)
+        self.sources = dict()
+        self.finished = dict()
+
+        # length of the manifest up to its last complete line
+        valid_length = 0
+
+        if resume and os.path.exists(manifest_path):
+            with open(manifest_path, 'rb') as f:
+                for line in f:
+                    # a line cut short by a killed run
+                    if not line.endswith(b'\n'):
+                        break
+                    self._add(json.loads(line))
+                    valid_length += len(line)
+
+        self.fd = os.open(manifest_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+        # drop a truncated last line (or the whole previous manifest when not resuming)
+        os.ftruncate(self.fd, valid_length)
+
+    def _add(self, record):
+        tasks = {(corruption_name, sev) for corruption_name, sev in record['tasks']}
+        source = {key: record[key] for key in ('sha1', 'size', 'mtime_ns')}
+
+        # a source whose content changed invalidates everything recorded for it before
+        if self.sources.get(record['path'], source)['sha1'] != source['sha1']:
+            self.finished[record['path']] = set()
+
+        self.sources[record['path']] = source
+        self.finished.setdefault(record['path'], set()).update(tasks)
+
+    def pending(self, path, save_target_path, jobs):
+        '''
+        returns the (corruption name, severity) `jobs` of a source image not finished yet
+        :path: where the source image is read from
+        :save_target_path: the key of the source image in the manifest
+        :jobs: List[Tuple(corruption name, severity)]
+        '''
+        finished = self.finished.get(save_target_path)
+        if not finished:
+            return list(jobs)
+
+        # cheap check first: unchanged size and modification time means unchanged content
+        source = self.sources[save_target_path]
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime_ns']):
+            if file_digest(path) != source['sha1']:
+                return list(jobs)
+
+        return [job for job in jobs if job not in finished]
+
+    def pending_tasks(self, tasks, dataset):
+        '''
+        returns the (image index, corruption name, severity) tasks not finished yet
+        :tasks: List[Tuple(image index, corruption name, severity)]
+        :dataset: the `FRDataset` (with `enable_rebase=True`) the image indices refer to
+        '''
+        image_jobs = dict()
+        for idx, corruption_name, sev in tasks:
+            image_jobs.setdefault(idx, []).append((corruption_name, sev))
+
+        pending = []
+        for idx, jobs in image_jobs.items():
+            jobs = self.pending(dataset.image_paths[idx], dataset.save_image_paths[idx], jobs)
+            pending.extend((idx, corruption_name, sev) for corruption_name, sev in jobs)
+        return pending
+
+    def record(self, record):
+        '''
+        appends a record of finished tasks, see `source_record`
+        :record: dict with the `source_record` fields and `tasks`, a list of (corruption name, severity)
+        '''
+        self._add(record)
+        os.write(self.fd, (json.dumps(record) + '\n').encode())
+
+    def num_finished(self):
+        '''
+        returns the number of finished tasks
+        '''
+        return sum(len(tasks) for tasks in self.finished.values())
+
+    def close(self):
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+class SampleShards:
+    """
+    The tar shard holding the current version of every finished sample of a run, read from its manifests.
+
+    A sample can be in several shards: the one of the run recording it, and older ones when its source
+    changed and was corrupted again, or when a run was killed between writing a shard and recording its
+    tasks. The latest record finishing a task tells which shard is current, as in `Manifest`.
+    """
+    def __init__(self, manifest_paths):
+        '''
+        :manifest_paths: the manifests of the run, e.g. the merged `manifest.jsonl` of a sharded run
+        '''
+        # path -> sha1 of the source and the (shard, finished tasks) of its records, the latest last
+        self.sources = dict()
+        self.records = dict()
+        # the task sets shared by the records, most records finishing the same tasks
+        self.task_sets = dict()
+
+        for manifest_path in manifest_paths:
+            for record in manifest_records(manifest_path):
+                self._add(record)
+
+    def _add(self, record):
+        tasks = frozenset((corruption_name, sev) for corruption_name, sev in record['tasks'])
+        tasks = self.task_sets.setdefault(tasks, tasks)
+
+        # a source whose content changed invalidates everything recorded for it before
+        if self.sources.get(record['path'], record['sha1']) != record['sha1']:
+            self.records[record['path']] = []
+
+        self.sources[record['path']] = record['sha1']
+        # records written before the shards were recorded match any shard
+        self.records.setdefault(record['path'], []).append((record.get('shard'), tasks))
+
+    def shards(self):
+        '''
+        returns the names of the shards holding current samples, None among them if some records don't tell
+        '''
+        return {shard for records in self.records.values() for shard, _ in records}
+
+    def is_current(self, shard, save_target_path, corruption_name, severity):
+        '''
+        returns True if the sample in the shard named `shard` is the current version of a finished task
+        '''
+        for recorded_shard, tasks in reversed(self.records.get(save_target_path, ())):
+            if (corruption_name, severity) in tasks:
+                return recorded_shard is None or recorded_shard == shard
+        return False
@@ -0,0 +1,207 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import json
+import time
+
+# ---------------------------------------------- Helper Utils
+
+def task_key(corruption_name, severity):
+    '''
+    returns the key the counters of a (corruption name, severity) are reported under: `{corruption name}/{severity}`
+    '''
+    return f'{corruption_name}/{severity}'
+
+def merge_counters(total, counters):
+    '''
+    adds the (nested) `counters` to `total` in place and returns it; `threads` counts are maxed, not added
+    '''
+    for name, value in counters.items():
+        if isinstance(value, dict):
+            merge_counters(total.setdefault(name, {}), value)
+        elif name == 'threads':
+            total[name] = max(total.get(name, 0), value)
+        else:
+            total[name] = total.get(name, 0) + value
+    return total
+
+# ---------------------------------------------- Chunk Profile
+
+class ChunkProfile:
+    """
+    Counters of one chunk of work, filled by a worker: the time spent loading, resizing, corrupting
+    and handing the images to the writer, per (corruption, severity) where it applies.
+    `as_dict` is what the worker sends back to the parent, see `RunProfile.add`.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.counters = {'images': 0, 'load_s': 0., 'resize_s': 0., 'tasks': {}}
+
+    def add_task(self, corruption_name, severity, corrupt_s, resize_s, write_s):
+        '''
+        counts one corrupted image and the seconds its corruption, resize back and write took
+        '''
+        task = self.counters['tasks'].setdefault(task_key(corruption_name, severity),
+                                                 {'count': 0, 'corrupt_s': 0., 'resize_s': 0., 'write_s': 0.})
+        task['count'] += 1
+        task['corrupt_s'] += corrupt_s
+        task['resize_s'] += resize_s
+        task['write_s'] += write_s
+
+    def as_dict(self, writer_stats):
+        '''
+        returns the counters, with the chunk's wall time (`compute_s`), the worker's pid
+        and the `writer_stats` (see `pipeline.writers.Writer.stats`)
+        '''
+        return dict(self.counters, compute_s=time.perf_counter() - self.start, pid=os.getpid(), writer=writer_stats)
+
+# ---------------------------------------------- Run Profile
+
+class RunProfile:
+    """
+    Merges the `ChunkProfile`s of a run as its chunks complete. Every `interval` seconds (see `tick`, called by
+    `pipeline.scheduler.run_tasks` while waiting for the chunks) it appends a JSON line to `log_path` describing
+    the window since the previous line, even if no chunk completed in it: throughput,
+    bytes written, worker utilisation, writer backpressure and queue depths, and per (corruption, severity)
+    counters. `close` appends the totals of the whole run, which `summary` formats.
+    """
+    def __init__(self, num_workers, log_path=None, interval=30.):
+        '''
+        :num_workers: number of processes corrupting the images (0 counts as the one main process)
+        :log_path: JSON lines file the reports are appended to, None to only keep the totals
+        :interval: seconds between two reports at least
+        '''
+        self.num_workers = max(1, num_workers)
+        # number of chunks of the run, set by `pipeline.scheduler.run_tasks` to report how many are queued
+        self.num_chunks = 0
+        self.interval = interval
+        self.log = open(log_path, 'a') if log_path else None
+
+        self.start = self.window_start = time.perf_counter()
+        self.num_done = 0
+        self.totals, self.window = {}, {}
+        self.worker_busy_s = {}
+
+    def add(self, chunk_profile):
+        '''
+        merges the `ChunkProfile.as_dict` of a completed chunk, reporting if the interval elapsed
+        '''
+        chunk_profile = dict(chunk_profile)
+        pid = chunk_profile.pop('pid')
+        self.worker_busy_s[pid] = self.worker_busy_s.get(pid, 0.) + chunk_profile['compute_s']
+
+        self.num_done += 1
+        merge_counters(self.totals, chunk_profile)
+        merge_counters(self.window, chunk_profile)
+        self.tick()
+
+    def next_report_s(self):
+        '''
+        returns the seconds left until the next report is due (None if there is no log)
+        '''
+        if self.log is None:
+            return None
+        return max(self.window_start + self.interval - time.perf_counter(), 0.)
+
+    def tick(self):
+        '''
+        reports the window if the interval elapsed
+        '''
+        if self.log is not None and time.perf_counter() - self.window_start >= self.interval:
+            self.report(self.window, self.window_start)
+            self.window, self.window_start = {}, time.perf_counter()
+
+    def describe(self, counters, start):
+        '''
+        returns the report of the `counters` gathered since `start`
+        '''
+        elapsed_s = max(time.perf_counter() - start, 1e-9)
+        writer = counters.get('writer', {})
+        num_images = writer.get('images', 0)
+
+        tasks = {}
+        for key, task in sorted(counters.get('tasks', {}).items()):
+            # images/s of one worker doing only this (corruption, severity), resize and write included
+            task_s = task['corrupt_s'] + task['resize_s'] + task['write_s']
+            tasks[key] = dict(task,
+                              ms_per_image=1e3 * task['corrupt_s'] / task['count'],
+                              images_per_s=task['count'] / max(task_s, 1e-9),
+                              bytes=writer.get('task_bytes', {}).get(key, 0))
+
+        return {
+            'time': time.time(),
+            'elapsed_s': elapsed_s,
+            'chunks_done': self.num_done,
+            'chunks_queued': self.num_chunks - self.num_done,
+            'source_images': counters.get('images', 0),
+            'images': num_images,
+            'images_per_s': num_images / elapsed_s,
+            'bytes': writer.get('bytes', 0),
+            'bytes_per_s': writer.get('bytes', 0) / elapsed_s,
+            # share of the workers' time spent on chunks, attributed when the chunks complete
+            'worker_utilisation': counters.get('compute_s', 0.) / (elapsed_s * self.num_workers),
+            'load_s': counters.get('load_s', 0.),
+            'resize_s': counters.get('resize_s', 0.),
+            'writer_stall_s': writer.get('stall_s', 0.),
+            'writer_busy_s': writer.get('busy_s', 0.),
+            'writer_idle_s': writer.get('idle_s', 0.),
+            'writer_queue_depth': writer.get('queue_depth', 0) / max(num_images, 1),
+            'tasks': tasks,
+        }
+
+    def report(self, counters, start, **fields):
+        '''
+        appends the report of the `counters` gathered since `start` (and `fields`) to the log
+        '''
+        self.log.write(json.dumps(dict(self.describe(counters, start), **fields)) + '\n')
+        self.log.flush()
+
+    def close(self):
+        '''
+        appends the last window and the totals of the run (marked `"summary": true`) to the log
+        '''
+        if self.log is None:
+            return
+        if self.window:
+            self.report(self.window, self.window_start)
+        self.report(self.totals, self.start, summary=True,
+                    worker_busy_s={str(pid): busy_s for pid, busy_s in self.worker_busy_s.items()})
+        self.log.close()
+        self.log = None
+
+    def summary(self, top=10):
+        '''
+        returns a table of the run's totals per corruption (all severities) and for the `top` most expensive
+        (corruption, severity), the most expensive first, along with the loading and resizing of the sources
+        '''
+        report = self.describe(self.totals, self.start)
+        total_corrupt_s = max(sum(task['corrupt_s'] for task in report['tasks'].values()), 1e-9)
+
+        # the severities of every corruption added up
+        corruptions = {}
+        for key, task in report['tasks'].items():
+            merge_counters(corruptions.setdefault(key.rsplit('/', 1)[0], {}),
+                           {name: task[name] for name in ('count', 'corrupt_s', 'resize_s', 'write_s', 'bytes')})
+
+        def rows(title, tasks):
+            lines = [f'{title:>22} {"images":>7} {"ms/image":>9} {"share":>7} {"resize ms":>10} {"write ms":>9} {"MB":>8}']
+            for key, task in sorted(tasks.items(), key=lambda key_task: -key_task[1]['corrupt_s']):
+                lines.append(f'{key:>22} {task["count"]:>7} {1e3 * task["corrupt_s"] / task["count"]:>9.2f} '
+                             f'{100 * task["corrupt_s"] / total_corrupt_s:>6.1f}% '
+                             f'{1e3 * task["resize_s"] / task["count"]:>10.2f} '
+                             f'{1e3 * task["write_s"] / task["count"]:>9.2f} {task["bytes"] / 2 ** 20:>8.2f}')
+            return lines
+
+        top_tasks = dict(sorted(report['tasks'].items(), key=lambda key_task: -key_task[1]['corrupt_s'])[:top])
+
+        lines = [f'Corrupted {report["images"]} images in {report["elapsed_s"]:.1f} s... '
+                 f'{report["images_per_s"]:.1f} images/s, {report["bytes_per_s"] / 2 ** 20:.2f} MB/s, '
+                 f'worker utilisation {100 * report["worker_utilisation"]:.0f} %']
+        lines += rows('corruption', corruptions)
+        lines += rows('corruption/severity', top_tasks)
+        lines.append(f'{"loading sources":>22} {report["source_images"]:>7} '
+                     f'{1e3 * report["load_s"] / max(report["source_images"], 1):>9.2f}')
+        lines.append(f'{"resizing sources":>22} {report["source_images"]:>7} '
+                     f'{1e3 * report["resize_s"] / max(report["source_images"], 1):>9.2f}')
+        return '\n'.join(lines)
@@ -0,0 +1,313 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import time
+import hashlib
+from collections import OrderedDict
+
+# matrix manipulation
+import numpy as np
+
+# multiprocessing
+import multiprocessing
+from multiprocessing.util import Finalize
+
+# corruption
+from pipeline.task import to_corruption_size, from_corruption_size, corrupt_task
+from imagenet_c import use_plasma_bank
+
+# bookkeeping
+from pipeline.manifest import source_record
+from pipeline.writers import make_writer
+from pipeline.profiling import ChunkProfile
+
+# ---------------------------------------------- Task Costs
+
+# rough per-image cost (ms on a 224 x 224 face, averaged over the severities) of every corruption,
+# used to balance the work across the processes. Corruptions not listed get `default_cost`
+corruption_costs = {
+    'brightness': 29.0,
+    'saturate': 27.0,
+    'shot_noise': 16.0,
+    'glass_blur': 10.0,
+    'zoom_blur': 8.5,
+    'spatter': 6.5,
+    'speckle_noise': 6.5,
+    'gaussian_noise': 5.5,
+    'snow': 4.5,
+    'impulse_noise': 4.0,
+    'motion_blur': 3.0,
+    'contrast': 3.0,
+    'elastic_transform': 2.7,
+    'gaussian_blur': 2.5,
+    'defocus_blur': 2.5,
+    'jpeg_compression': 2.0,
+    'pixelate': 1.0,
+    'fog': 1.0,
+    'frost': 1.0,
+}
+default_cost = 10.0
+
+# ---------------------------------------------- Task Creation
+
+def build_tasks(num_images, corruption_names, severities=range(1, 6)):
+    '''
+    returns the list of all (image index, corruption name, severity) tasks
+    :num_images: number of images in the dataset
+    :corruption_names: the corruptions to apply to every image
+    :severities: the severities to apply every corruption at
+    '''
+    return [(idx, corruption_name, sev)
+            for idx in range(num_images)
+            for sev in severities
+            for corruption_name in corruption_names]
+
+def task_cost(task):
+    '''
+    returns the estimated cost of a (image index, corruption name, severity) task
+    '''
+    return corruption_costs.get(task[1], default_cost)
+
+# ---------------------------------------------- Sharding
+
+def image_shard(image_key, num_shards):
+    '''
+    returns the shard (in [0, num_shards)) of the image with the relative path `image_key`, from a hash of the path
+    '''
+    digest = hashlib.sha1(image_key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little') % num_shards
+
+def task_shards(tasks, num_shards, image_keys):
+    '''
+    returns the shard (in [0, num_shards)) of every task: all the tasks of an image go to the shard a hash of its
+    relative path picks, see `image_shard`. The shard of an image only depends on its own path, so every node computes
+    the same partition without any coordination, and adding or removing images (e.g. before a `--resume`) never
+    moves the other images to another shard. Every image gets the same tasks, so the shards have balanced estimated
+    costs on datasets of more than a few hundred images per shard, and every image is only loaded by one shard.
+    :tasks: List[Tuple(image index, corruption name, severity)]
+    :num_shards: number of shards, e.g. of nodes sharing the run
+    :image_keys: the relative path of every image index, e.g. the `save_image_paths` of an `FRDataset`
+        with `enable_rebase=True`
+    '''
+    shards = {}
+    for idx, _, _ in tasks:
+        if idx not in shards:
+            shards[idx] = image_shard(image_keys[idx], num_shards)
+    return np.array([shards[idx] for idx, _, _ in tasks], dtype=np.int64)
+
+def shard_tasks(tasks, shard_index, num_shards, image_keys):
+    '''
+    returns the tasks of shard `shard_index` out of `num_shards`, see `task_shards`
+    '''
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f'The shard index must be in [0, {num_shards}), got {shard_index}')
+    shards = task_shards(tasks, num_shards, image_keys)
+    return [task for task, shard in zip(tasks, shards) if shard == shard_index]
+
+# ---------------------------------------------- Chunking
+
+def make_chunks(tasks, num_workers, chunks_per_worker=8, max_images_per_chunk=32):
+    '''
+    groups the tasks into chunks of roughly equal estimated cost, most expensive first.
+    All the tasks of an image end up in the same chunk so that every image is loaded only once.
+    :tasks: List[Tuple(image index, corruption name, severity)]
+    :num_workers: number of processes the chunks will be spread over
+    :chunks_per_worker: the least number of chunks to aim for per process; more chunks balance better
+        at the price of more inter-process communication
+    :max_images_per_chunk: keeps the chunks small enough on large datasets for a smooth progress report
+    :returns: List[List[Tuple(image index, List[Tuple(corruption name, severity)])]]
+    '''
+    # group the tasks of every image, keeping the order of the images
+    image_tasks = OrderedDict()
+    for idx, corruption_name, sev in tasks:
+        image_tasks.setdefault(idx, []).append((corruption_name, sev))
+
+    image_costs = {idx: sum(task_cost((idx, c, s)) for c, s in jobs) for idx, jobs in image_tasks.items()}
+    num_chunks = max(1, num_workers * chunks_per_worker, len(image_tasks) // max_images_per_chunk)
+    target_cost = sum(image_costs.values()) / num_chunks
+
+    # pack consecutive images until a chunk reaches the target cost
+    chunks, chunk, chunk_cost = [], [], 0.0
+    for idx, jobs in image_tasks.items():
+        chunk.append((idx, jobs))
+        chunk_cost += image_costs[idx]
+        if chunk_cost >= target_cost:
+            chunks.append((chunk_cost, chunk))
+            chunk, chunk_cost = [], 0.0
+    if chunk:
+        chunks.append((chunk_cost, chunk))
+
+    # longest chunks first, so that the cheap ones fill the gaps at the end of the run
+    chunks.sort(key=lambda cost_chunk: -cost_chunk[0])
+    return [chunk for _, chunk in chunks]
+
+# ---------------------------------------------- Worker
+
+# state of a worker process, set once by `init_worker`
+worker_state = {}
+
+def init_worker(dataset, outdir_path, native_resolution=False, verbose=False, output_format='files', seed=0,
+                writer_options=None, plasma_bank_path=None):
+    '''
+    stores the state shared by all the chunks a process works on
+    :dataset: the `FRDataset` (with `enable_rebase=True`) to load the images from
+    :outdir_path: what path to append in front of the corrupted image's save target paths
+    :native_resolution: corrupt the images at their own resolution instead of the 224 x 224 round-trip
+    :verbose: print saving details
+    :output_format: how the corrupted images are stored, see `pipeline.writers.make_writer`
+    :seed: seed of the whole run, see `pipeline.task.task_seed_sequence`
+    :writer_options: the `encoder`, `num_threads` and `queue_size` of the writer, see `make_writer`
+    :plasma_bank_path: the plasma fractal bank `fog` reads its maps from, built by `run_tasks` (None without fog)
+    '''
+    if plasma_bank_path is not None:
+        use_plasma_bank(plasma_bank_path)
+
+    writer = make_writer(output_format, outdir_path, **(writer_options or {}))
+    worker_state.update(
+        dataset=dataset,
+        writer=writer,
+        # closes the writer once: called by `run_tasks` when running in-process, on exit by the pool's workers
+        close_writer=Finalize(writer, writer.close, exitpriority=10),
+        native_resolution=native_resolution,
+        verbose=verbose,
+        seed=seed
+    )
+
+def corrupt_and_save(image, save_target_path, jobs, profile):
+    '''
+    applies all the (corruption name, severity) `jobs` to one image and saves the results
+    :image: the image to corrupt
+    :save_target_path: the path of the image relative to the `{severity}/{corruption name}` folders
+    :jobs: List[Tuple(corruption name, severity)]
+    :profile: the `ChunkProfile` timing every step is added to
+    :returns: the number of corrupted images saved
+    '''
+    writer = worker_state['writer']
+    native_resolution = worker_state['native_resolution']
+
+    # keeping track of original image shape
+    ori_image_shape = image.shape[:-1]
+
+    # resizing image to 224 x 224, the size the severities were tuned for (the released benchmark setting)
+    start = time.perf_counter()
+    image = to_corruption_size(image, native_resolution)
+    profile.counters['resize_s'] += time.perf_counter() - start
+
+    # every job of the image is corrupted into the same buffer, unless the writer still holds the previous one
+    corrupt_buffer = None if writer.asynchronous else np.empty_like(image)
+
+    for corruption_name, sev in jobs:
+
+        # corrupt image, seeded by the task so that any scheduling gives the same result
+        start = time.perf_counter()
+        corrupt_image = corrupt_task(image, save_target_path, corruption_name, sev, worker_state['seed'],
+                                     out=corrupt_buffer)
+        corrupted = time.perf_counter()
+
+        # resizing `corrupt_image` back to original size
+        corrupt_image = from_corruption_size(corrupt_image, ori_image_shape, native_resolution)
+        resized = time.perf_counter()
+
+        # save the corrupted image
+        corr_save_target_path = writer.write(corrupt_image, save_target_path, corruption_name, sev)
+        profile.add_task(corruption_name, sev, corrupted - start, resized - corrupted, time.perf_counter() - resized)
+
+        if worker_state['verbose']:
+            print('Saved Image at...', corr_save_target_path)
+
+    return len(jobs)
+
+def process_chunk(chunk):
+    '''
+    corrupts all the images of a chunk created by `make_chunks`
+    :returns: List[dict], a `Manifest` record of the finished tasks for every image,
+        and the chunk's profile (see `pipeline.profiling.ChunkProfile.as_dict`)
+    '''
+    dataset = worker_state['dataset']
+    profile = ChunkProfile()
+
+    records = []
+    for idx, jobs in chunk:
+        start = time.perf_counter()
+        image, save_target_path = dataset[idx]
+        record = source_record(dataset.image_paths[idx], save_target_path)
+        profile.counters['load_s'] += time.perf_counter() - start
+        profile.counters['images'] += 1
+
+        corrupt_and_save(image, save_target_path, jobs, profile)
+        record['tasks'] = jobs
+        records.append(record)
+
+    # the tasks only count as finished once their images are durably written
+    shard = worker_state['writer'].commit()
+
+    # the tar shard holding the images, so that readers skip the older versions of the samples in other shards
+    if shard is not None:
+        for record in records:
+            record['shard'] = shard
+
+    return records, profile.as_dict(worker_state['writer'].stats())
+
+# ---------------------------------------------- Scheduling
+
+def run_tasks(dataset, tasks, outdir_path, num_workers, native_resolution=False, verbose=False, chunks_per_worker=8,
+              output_format='files', seed=0, writer_options=None, profile=None, plasma_bank_path=None):
+    '''
+    runs the tasks on a pool of `num_workers` processes (in this process if `num_workers` is 0)
+    and yields a `Manifest` record for every image as soon as its chunk completes
+    :dataset: the `FRDataset` (with `enable_rebase=True`) to load the images from
+    :tasks: List[Tuple(image index, corruption name, severity)], see `build_tasks`
+    :outdir_path: what path to append in front of the corrupted image's save target paths
+    :num_workers: number of processes to run in parallel
+    :native_resolution: corrupt the images at their own resolution instead of the 224 x 224 round-trip
+    :verbose: print saving details
+    :chunks_per_worker: see `make_chunks`
+    :output_format: how the corrupted images are stored, see `pipeline.writers.make_writer`
+    :seed: seed of the whole run, see `pipeline.task.task_seed_sequence`
+    :writer_options: the `encoder`, `num_threads` and `queue_size` of the writers, see `make_writer`
+    :profile: `pipeline.profiling.RunProfile` the profiles of the chunks are added to as they complete; it reports
+        on time while waiting for the pool, and between two chunks when `num_workers` is 0
+    :plasma_bank_path: where the plasma fractal bank of `fog` is read from, built here first if missing
+        (default: under `~/.cache/decordface`, see `imagenet_c.corruptions.use_plasma_bank`); unused without fog
+    '''
+    # the bank is built once, before the workers start, rather than by the first worker running fog
+    if any(corruption_name == 'fog' for _, corruption_name, _ in tasks):
+        plasma_bank_path = use_plasma_bank(plasma_bank_path)
+    else:
+        plasma_bank_path = None
+
+    chunks = make_chunks(tasks, max(1, num_workers), chunks_per_worker)
+    initargs = (dataset, outdir_path, native_resolution, verbose, output_format, seed, writer_options, plasma_bank_path)
+    if profile is not None:
+        profile.num_chunks = len(chunks)
+
+    if num_workers == 0:
+        init_worker(*initargs)
+        for chunk in chunks:
+            records, chunk_profile = process_chunk(chunk)
+            if profile is not None:
+                profile.add(chunk_profile)
+            yield from records
+        worker_state['close_writer']()
+        return
+
+    with multiprocessing.Pool(num_workers, initializer=init_worker, initargs=initargs) as pool:
+        results = pool.imap_unordered(process_chunk, chunks)
+        while True:
+            # wakes up when a report is due, so that the profile keeps reporting while long chunks run
+            timeout = None if profile is None else profile.next_report_s()
+            try:
+                records, chunk_profile = results.next(timeout=timeout)
+            except multiprocessing.TimeoutError:
+                profile.tick()
+                continue
+            except StopIteration:
+                break
+
+            if profile is not None:
+                profile.add(chunk_profile)
+            yield from records
+
+        # lets the workers exit on their own, which runs their `close_writer` (leaving the block terminates them)
+        pool.close()
+        pool.join()
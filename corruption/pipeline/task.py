@@ -0,0 +1,74 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import hashlib
+
+# matrix manipulation
+import numpy as np
+
+# image processing
+from skimage.util import img_as_ubyte
+from skimage.transform import resize
+
+# corruption
+from imagenet_c import corrupt, corruption_dict
+
+# ---------------------------------------------- Corruption Task
+# one (image, corruption, severity) task is applied the same way by `corrupt-image-v3.py`
+# and by `CorruptedFRDataset`, so that on-the-fly samples match the materialized benchmark
+
+# the size the severities were tuned for (the released benchmark setting)
+corruption_size = (224, 224)
+
+# the corruptions of the benchmark: the weather related corruptions are not considered
+benchmark_corruption_names = [name for name in corruption_dict if name not in ('snow', 'frost', 'fog')]
+
+# the severities of the benchmark
+benchmark_severities = (1, 2, 3, 4, 5)
+
+def key_entropy(key):
+    '''
+    returns a 128-bit integer derived from the string `key`, stable across processes and Python versions
+    (unlike `hash`, which is salted per process)
+    '''
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:16], 'little')
+
+def task_seed_sequence(save_target_path, corruption_name, severity, base_seed=0):
+    '''
+    returns the `numpy.random.SeedSequence` of a (image, corruption, severity) task: a child of the run
+    seed keyed by the severity, the corruption and the image path relative to the dataset root, so that
+    it doesn't depend on where the dataset is mounted nor on which worker runs the task
+    :base_seed: seed of the whole run, varying it gives an independent draw of the benchmark
+    '''
+    return np.random.SeedSequence(base_seed, spawn_key=(severity, key_entropy(corruption_name),
+                                                        key_entropy(save_target_path)))
+
+def task_rng(save_target_path, corruption_name, severity, base_seed=0):
+    '''
+    returns a fresh `numpy.random.Generator` seeded with `task_seed_sequence`
+    '''
+    return np.random.default_rng(task_seed_sequence(save_target_path, corruption_name, severity, base_seed))
+
+def to_corruption_size(image, native_resolution=False):
+    '''
+    returns the image resized to `corruption_size`, unchanged with `native_resolution`
+    '''
+    if native_resolution:
+        return image
+    return img_as_ubyte(resize(image, corruption_size, anti_aliasing=True))
+
+def from_corruption_size(image, shape, native_resolution=False):
+    '''
+    returns the corrupted image resized back to the (height, width) `shape` of the original image
+    '''
+    if native_resolution:
+        return image
+    return img_as_ubyte(resize(image, shape, anti_aliasing=True))
+
+def corrupt_task(image, save_target_path, corruption_name, severity, base_seed=0, out=None):
+    '''
+    corrupts an image already passed through `to_corruption_size` with the generator of its task
+    :out: uint8 array of the image's shape the corrupted image is written into, see `imagenet_c.corrupt`
+    '''
+    rng = task_rng(save_target_path, corruption_name, severity, base_seed)
+    return corrupt(image, corruption_name=corruption_name, severity=severity, rng=rng, out=out)
@@ -0,0 +1,419 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import io as pyio
+import time
+import uuid
+import queue
+import tarfile
+import threading
+
+# image processing
+from PIL import Image
+
+# data handling
+from data_handling.sharded import sample_key
+
+# instrumentation
+from pipeline.profiling import task_key
+
+# ---------------------------------------------- Helper Utils
+
+# the output formats `make_writer` supports
+output_formats = ('files', 'tar', 'lmdb')
+
+# the codecs `ImageEncoder` supports
+image_codecs = ('source', 'png', 'webp')
+
+# PIL format names of the image extensions, the others are looked up by PIL itself
+pil_formats = {'jpg': 'JPEG', 'jpe': 'JPEG', 'jpeg': 'JPEG', 'tif': 'TIFF', 'tiff': 'TIFF'}
+
+def encode_image(image, save_target_path, **options):
+    '''
+    returns the bytes of `image` encoded in the format given by the extension of `save_target_path`
+    (PIL's default settings, i.e. what `skimage.io.imsave` produces, updated with the PIL save `options`)
+    '''
+    extension = os.path.splitext(save_target_path)[1][1:].lower()
+    image_format = pil_formats.get(extension) or Image.registered_extensions().get(f'.{extension}', 'PNG')
+
+    buffer = pyio.BytesIO()
+    Image.fromarray(image).save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+class ImageEncoder:
+    """
+    Encodes the corrupted images with `codec` (one of `image_codecs`): `source` keeps the format of the
+    source image (its extension), `png` and `webp` (lossless) re-encode every image and change its extension.
+    `png_compression` is the zlib level (0-9, PIL's default 6) of the PNG files, whatever the codec.
+    """
+    def __init__(self, codec='source', png_compression=None):
+        if codec not in image_codecs:
+            raise ValueError(f'Unknown image codec {codec}, must be one of {image_codecs}')
+        self.codec = codec
+        self.png_compression = png_compression
+
+    def target_path(self, save_target_path):
+        '''
+        returns `save_target_path` with the extension of the codec
+        '''
+        if self.codec == 'source':
+            return save_target_path
+        return os.path.splitext(save_target_path)[0] + f'.{self.codec}'
+
+    def encode(self, image, save_target_path):
+        '''
+        returns the bytes of `image` encoded for `save_target_path`
+        '''
+        target_path = self.target_path(save_target_path)
+        extension = os.path.splitext(target_path)[1][1:].lower()
+
+        options = {}
+        if extension == 'webp':
+            options['lossless'] = True
+        elif extension == 'png' and self.png_compression is not None:
+            options['compress_level'] = self.png_compression
+        return encode_image(image, target_path, **options)
+
+def empty_writer_stats():
+    '''
+    returns the counters of a writer, see `Writer.stats`
+    '''
+    return {'images': 0, 'bytes': 0, 'stall_s': 0., 'busy_s': 0., 'idle_s': 0., 'queue_depth': 0, 'threads': 0,
+            'task_bytes': {}}
+
+def count_task_bytes(counters, corruption_name, severity, num_bytes):
+    '''
+    adds the size of one encoded image to the bytes written for its (corruption, severity)
+    '''
+    key = task_key(corruption_name, severity)
+    counters['task_bytes'][key] = counters['task_bytes'].get(key, 0) + num_bytes
+
+def format_writer_stats(stats, compute_s):
+    '''
+    returns a report of the writer backpressure of a run from the merged `stats` of its writers
+    :compute_s: wall time the compute workers ran for, summed over the workers
+    '''
+    lines = [f'Writer... {stats["images"]} images, {stats["bytes"] / 2 ** 20:.1f} MB encoded']
+    lines.append(f'  compute workers stalled on the writer {stats["stall_s"]:.1f} s '
+                 f'({100 * stats["stall_s"] / max(compute_s, 1e-9):.1f} % of their time)')
+    if stats['threads']:
+        busy = stats['busy_s'] / max(stats['busy_s'] + stats['idle_s'], 1e-9)
+        lines.append(f'  writer threads busy {100 * busy:.1f} % of their time, '
+                     f'mean queue depth {stats["queue_depth"] / max(stats["images"], 1):.1f}')
+        if stats['stall_s'] > 0.05 * compute_s:
+            lines.append('  the writer is the bottleneck: raise --writer_threads (or lower --png_compression)')
+        elif busy < 0.5:
+            lines.append('  the writer threads are mostly idle: --writer_threads could be lowered')
+    return '\n'.join(lines)
+
+def fsync_path(path, flags):
+    '''
+    flushes the file or folder at `path` to disk
+    '''
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# ---------------------------------------------- Writers
+
+class Writer:
+    """
+    Base of the writers: encodes every corrupted image with `encoder` (an `ImageEncoder`) and stores it
+    under its `sample_key`. The subclasses implement `store`, `commit` and `close`; `commit` returns the name
+    of the container file the images went to when every commit makes a new one (`TarShardWriter`), None otherwise.
+    """
+    asynchronous = False
+
+    def __init__(self, encoder=None):
+        self.encoder = encoder or ImageEncoder()
+        self.counters = empty_writer_stats()
+
+    def key(self, save_target_path, corruption_name, severity):
+        '''
+        returns the key the corrupted image is stored under
+        '''
+        return sample_key(self.encoder.target_path(save_target_path), corruption_name, severity)
+
+    def location(self, key):
+        '''
+        returns where the image stored under `key` is saved
+        '''
+        return key
+
+    def write(self, image, save_target_path, corruption_name, severity):
+        '''
+        encodes and stores one corrupted image and returns where it was saved
+        '''
+        start = time.perf_counter()
+        key = self.key(save_target_path, corruption_name, severity)
+        data = self.encoder.encode(image, save_target_path)
+        self.store(key, data)
+
+        elapsed = time.perf_counter() - start
+        self.counters['images'] += 1
+        self.counters['bytes'] += len(data)
+        self.counters['stall_s'] += elapsed
+        self.counters['busy_s'] += elapsed
+        count_task_bytes(self.counters, corruption_name, severity, len(data))
+        return self.location(key)
+
+    def stats(self):
+        '''
+        returns the counters since the previous call: the images and bytes written (also per
+        `{corruption name}/{severity}` in `task_bytes`), the time the caller spent in `write` (`stall_s`),
+        the time spent encoding and storing (`busy_s`) and, for `AsyncWriter`, the time its threads waited
+        for images (`idle_s`) and the queue depth summed over the writes
+        '''
+        stats, self.counters = self.counters, empty_writer_stats()
+        return stats
+
+class FileWriter(Writer):
+    """
+    Saves every corrupted image as a file at `{outdir_path}/{severity}/{corruption name}/{save target path}`.
+    The folders must exist already, see `FRDataset.create_directory_structure`.
+    """
+    def __init__(self, outdir_path, encoder=None):
+        super().__init__(encoder)
+        self.outdir_path = outdir_path
+        # the files saved since the last commit
+        self.uncommitted = []
+
+    def location(self, key):
+        return os.path.join(self.outdir_path, key)
+
+    def store(self, key, data):
+        '''
+        saves the encoded image `data` at the location of `key`
+        '''
+        path = self.location(key)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.uncommitted.append(path)
+
+    def commit(self):
+        '''
+        makes everything written so far durable: fsyncs the files saved since the last commit, then
+        their folders (so that their entries survive a crash too); called at the end of every chunk of work
+        '''
+        folders = []
+        for path in self.uncommitted:
+            fsync_path(path, os.O_WRONLY)
+            folder = os.path.dirname(path)
+            if folder not in folders:
+                folders.append(folder)
+        for folder in folders:
+            fsync_path(folder, os.O_RDONLY)
+        self.uncommitted = []
+
+    def close(self):
+        self.commit()
+
+class TarShardWriter(Writer):
+    """
+    Writes the corrupted images into WebDataset-style tar shards `{outdir_path}/shard-{writer id}-{n}.tar`,
+    one shard per committed chunk of work, with members named by `sample_key`.
+    A shard is written under a temporary name and renamed on commit, so shards are always complete.
+    """
+    def __init__(self, outdir_path, encoder=None):
+        super().__init__(encoder)
+        self.outdir_path = outdir_path
+        os.makedirs(outdir_path, exist_ok=True)
+
+        # unique across processes and runs, so that resumed runs never overwrite existing shards
+        self.writer_id = uuid.uuid4().hex[:12]
+        self.num_shards = 0
+        self.tar = None
+
+    def shard_path(self):
+        return os.path.join(self.outdir_path, f'shard-{self.writer_id}-{self.num_shards:06d}.tar')
+
+    def store(self, key, data):
+        '''
+        adds the encoded image `data` to the current shard as the member `key`
+        '''
+        if self.tar is None:
+            self.tar = tarfile.open(self.shard_path() + '.tmp', 'w')
+
+        member = tarfile.TarInfo(key)
+        member.size = len(data)
+        member.mtime = int(time.time())
+        self.tar.addfile(member, pyio.BytesIO(data))
+
+    def commit(self):
+        '''
+        closes the current shard, moves it to its final name and returns that name (None without images)
+        '''
+        if self.tar is None:
+            return None
+        self.tar.close()
+        shard_path = self.shard_path()
+        os.replace(shard_path + '.tmp', shard_path)
+        self.tar = None
+        self.num_shards += 1
+        return os.path.basename(shard_path)
+
+    def close(self):
+        self.commit()
+
+class LMDBWriter(Writer):
+    """
+    Writes the corrupted images into the LMDB environment at `outdir_path`, keyed by `sample_key`.
+    The images of a chunk of work are buffered and put in one transaction on commit, so that the
+    (environment wide) write lock is only held briefly by every process. Requires the `lmdb` package.
+    """
+    def __init__(self, outdir_path, encoder=None, map_size=1 << 40):
+        super().__init__(encoder)
+        try:
+            import lmdb
+        except ImportError:
+            raise ImportError('the `lmdb` output format requires the `lmdb` package: pip install lmdb')
+
+        # the map is only reserved address space; the file grows with the data
+        self.env = lmdb.open(outdir_path, map_size=map_size)
+        self.pending = []
+
+    def store(self, key, data):
+        '''
+        buffers the encoded image `data` until the next commit
+        '''
+        self.pending.append((key.encode('utf-8'), data))
+
+    def commit(self):
+        '''
+        puts the buffered images in one transaction
+        '''
+        if not self.pending:
+            return
+        with self.env.begin(write=True) as txn:
+            for key, data in self.pending:
+                txn.put(key, data)
+        self.pending = []
+
+    def close(self):
+        self.commit()
+        self.env.close()
+
+class AsyncWriter:
+    """
+    Encodes and stores the images of `writer` on `num_threads` threads fed by a queue of at most
+    `queue_size` images, so that the encoding and the I/O overlap with the corruption of the next images
+    (PIL releases the GIL while encoding). `write` only blocks while the queue is full: that time is the
+    backpressure reported by `stats`. The images are referenced until encoded, so they must not be
+    modified after `write`. `commit` waits for the queued images before committing `writer`.
+    """
+    asynchronous = True
+
+    def __init__(self, writer, num_threads=1, queue_size=None):
+        self.writer = writer
+        self.queue = queue.Queue(queue_size or 4 * num_threads)
+        self.store_lock = threading.Lock()
+        self.error = None
+
+        self.counters = empty_writer_stats()
+        self.counters['threads'] = num_threads
+
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        '''
+        encodes and stores the queued images until it dequeues None
+        '''
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            dequeued = time.perf_counter()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            try:
+                image, save_target_path, key, corruption_name, severity = item
+                data = self.writer.encoder.encode(image, save_target_path)
+                # the containers are not thread safe, only the encoding runs in parallel
+                with self.store_lock:
+                    self.writer.store(key, data)
+                    self.counters['images'] += 1
+                    self.counters['bytes'] += len(data)
+                    self.counters['busy_s'] += time.perf_counter() - dequeued
+                    self.counters['idle_s'] += dequeued - start
+                    count_task_bytes(self.counters, corruption_name, severity, len(data))
+            except BaseException as e:
+                self.error = self.error or e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        '''
+        raises the first error of the writer threads, in the thread of the caller
+        '''
+        if self.error is not None:
+            raise RuntimeError('writing a corrupted image failed') from self.error
+
+    def write(self, image, save_target_path, corruption_name, severity):
+        '''
+        queues one corrupted image and returns where it will be saved
+        '''
+        self.raise_error()
+        key = self.writer.key(save_target_path, corruption_name, severity)
+
+        item = (image, save_target_path, key, corruption_name, severity)
+        self.counters['queue_depth'] += self.queue.qsize()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # backpressure: the threads can't keep up, wait for a free slot
+            start = time.perf_counter()
+            self.queue.put(item)
+            self.counters['stall_s'] += time.perf_counter() - start
+        return self.writer.location(key)
+
+    def stats(self):
+        '''
+        returns the counters since the previous call, see `Writer.stats`
+        '''
+        with self.store_lock:
+            stats, self.counters = self.counters, empty_writer_stats()
+            self.counters['threads'] = stats['threads']
+        return stats
+
+    def commit(self):
+        '''
+        waits for the queued images to be stored, then commits them, see `Writer`
+        '''
+        self.queue.join()
+        self.raise_error()
+        return self.writer.commit()
+
+    def close(self):
+        self.commit()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.writer.close()
+
+def make_writer(output_format, outdir_path, encoder=None, num_threads=0, queue_size=None):
+    '''
+    returns the writer for `output_format` (one of `output_formats`) saving under `outdir_path`
+    :encoder: the `ImageEncoder` of the images, the format of their source by default
+    :num_threads: number of threads encoding and storing the images in the background (see `AsyncWriter`),
+        0 writes them synchronously
+    :queue_size: number of images waiting for the threads at most (default: 4 per thread)
+    '''
+    if output_format == 'files':
+        writer = FileWriter(outdir_path, encoder)
+    elif output_format == 'tar':
+        writer = TarShardWriter(outdir_path, encoder)
+    elif output_format == 'lmdb':
+        writer = LMDBWriter(outdir_path, encoder)
+    else:
+        raise ValueError(f'Unknown output format {output_format}, must be one of {output_formats}')
+
+    if num_threads > 0:
+        return AsyncWriter(writer, num_threads, queue_size)
+    return writer
@@ -0,0 +1,129 @@
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import sys
+import time
+import argparse
+
+# matrix manipulation
+import numpy as np
+
+# metrics (run from the `evaluation_metric` folder, like the modules import each other)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eval_metric import get_mVCE, get_mCEI, tabulate, severity_groups
+
+# ---------------------------------------------- Reference Implementation
+
+def legacy_get_mVCE(result_model_names, result_corr_names, result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5, num_corruptions=16, severity='overall'):
+    '''
+    the original `get_mVCE`, one mean over the tabulated lists per model
+    '''
+    error_corr_0 = np.array([round(100-(result_corr_0[i][0]*100), 4) for i in range(len(result_corr_0))])
+    error_corr_1 = np.array([round(100-(result_corr_1[i][0]*100), 4) for i in range(len(result_corr_1))])
+    error_corr_2 = np.array([round(100-(result_corr_2[i][0]*100), 4) for i in range(len(result_corr_2))])
+    error_corr_3 = np.array([round(100-(result_corr_3[i][0]*100), 4) for i in range(len(result_corr_3))])
+    error_corr_4 = np.array([round(100-(result_corr_4[i][0]*100), 4) for i in range(len(result_corr_4))])
+    error_corr_5 = np.array([round(100-(result_corr_5[i][0]*100), 4) for i in range(len(result_corr_5))])
+
+    num_models = len(result_model_names)//num_corruptions
+    mVCE = np.zeros(num_models)
+    RmVCE = np.zeros(num_models)
+    backbone_names = []
+
+    for i in range(num_models):
+        start = int(i*num_corruptions)
+        end = int((i+1)*num_corruptions)
+
+        backbone_names.append(result_model_names[start][0])
+        if severity == 'overall':
+            mVCE[i] = np.mean([error_corr_1[start:end], error_corr_2[start:end], error_corr_3[start:end], error_corr_4[start:end], error_corr_5[start:end]])
+            RmVCE[i] = np.mean([error_corr_1[start:end]-error_corr_0[start:end], error_corr_2[start:end]-error_corr_0[start:end], error_corr_3[start:end]-error_corr_0[start:end], error_corr_4[start:end]-error_corr_0[start:end], error_corr_5[start:end]-error_corr_0[start:end]])
+        elif severity == 'low':
+            mVCE[i] = np.mean([error_corr_1[start:end], error_corr_2[start:end], error_corr_3[start:end]])
+            RmVCE[i] = np.mean([error_corr_1[start:end]-error_corr_0[start:end], error_corr_2[start:end]-error_corr_0[start:end], error_corr_3[start:end]-error_corr_0[start:end]])
+        elif severity == 'high':
+            mVCE[i] = np.mean([error_corr_4[start:end], error_corr_5[start:end]])
+            RmVCE[i] = np.mean([error_corr_4[start:end]-error_corr_0[start:end], error_corr_5[start:end]-error_corr_0[start:end]])
+
+        mVCE[i] = round(mVCE[i], 2)
+        RmVCE[i] = round(RmVCE[i], 2)
+
+    return backbone_names, mVCE, RmVCE
+
+def legacy_get_mCEI(result_model_names, result_corr_names, result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5, num_corruptions=16, severity='overall'):
+    '''
+    the original `get_mCEI`, one mean over the tabulated lists per model
+    '''
+    num_models = len(result_model_names)//num_corruptions
+    mCEI = np.zeros(num_models)
+    backbone_names = []
+
+    for i in range(num_models):
+        start = int(i*num_corruptions)
+        end = int((i+1)*num_corruptions)
+
+        backbone_names.append(result_model_names[start][0])
+        if severity == 'overall':
+            mCEI[i] = np.mean([result_corr_1[start:end], result_corr_2[start:end], result_corr_3[start:end], result_corr_4[start:end], result_corr_5[start:end]]) * 100
+        elif severity == 'low':
+            mCEI[i] = np.mean([result_corr_1[start:end], result_corr_2[start:end], result_corr_3[start:end]]) * 100
+        elif severity == 'high':
+            mCEI[i] = np.mean([result_corr_4[start:end], result_corr_5[start:end]]) * 100
+
+        mCEI[i] = round(mCEI[i], 2)
+
+    return backbone_names, mCEI
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+
+    # ---------------------------------------------- Parsing Command Line Arguments
+
+    parser = argparse.ArgumentParser(description='get_mVCE/get_mCEI regression check against the per-model loop')
+    parser.add_argument('--num_models', type=int, default=300,
+        help='number of random models of every table')
+    parser.add_argument('--num_corruptions', type=int, default=20,
+        help='number of corruptions of every model')
+    parser.add_argument('--num_tables', type=int, default=5,
+        help='number of random tables checked')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the random tables')
+    args = parser.parse_args()
+
+    # ---------------------------------------------- Regression Check
+
+    rng = np.random.default_rng(args.seed)
+    model_names = [f'model_{i}' for i in range(args.num_models)]
+    corruption_names = [f'corruption_{i}' for i in range(args.num_corruptions)]
+
+    identical = True
+    print(f'{"table":>5} {"metric":>6} {"severity":>8} {"loop ms":>8} {"wrapper ms":>11} {"speedup":>8} {"identical":>10}')
+    for table in range(args.num_tables):
+        # 4-decimal TPR@FPR and similarities, like the tabulated results, the clean severity above the corrupted ones
+        tpr = np.round(np.sort(rng.uniform(0, 1, (args.num_models, args.num_corruptions, 6)), axis=-1)[..., ::-1], 4)
+        similarity = np.round(rng.uniform(0, 1, (args.num_models, args.num_corruptions, 6)), 4)
+        similarity[..., 0] = 1
+        tpr_lists = tabulate(tpr, model_names, corruption_names)
+        similarity_lists = tabulate(similarity, model_names, corruption_names)
+
+        for severity in severity_groups:
+            checks = [('mVCE', legacy_get_mVCE, get_mVCE, tpr_lists), ('mCEI', legacy_get_mCEI, get_mCEI, similarity_lists)]
+            for metric, legacy, wrapper, lists in checks:
+                expected, legacy_time = timed(legacy, *lists, num_corruptions=args.num_corruptions, severity=severity)
+                result, wrapper_time = timed(wrapper, *lists, num_corruptions=args.num_corruptions, severity=severity)
+
+                # the backbone names and every metric array, compared bit for bit
+                same = expected[0] == result[0] and all(np.array_equal(e, r) and e.dtype == r.dtype
+                                                        for e, r in zip(expected[1:], result[1:]))
+                identical &= same
+
+                print(f'{table:>5} {metric:>6} {severity:>8} {legacy_time * 1e3:>8.2f} {wrapper_time * 1e3:>11.2f} '
+                      f'{legacy_time / wrapper_time:>7.1f}x {str(same):>10}')
+
+    print(f'Identical to the per-model loop... {identical}')
+    sys.exit(0 if identical else 1)
@@ -0,0 +1,219 @@
+'''
+This file provides bootstrap confidence intervals and pairwise significance for the mVCE and mCEI metrics.
+
+Replicates are drawn with the Poisson bootstrap: in every replicate, every resampled unit (a pair, an image or an
+identity) is counted a Poisson(1) number of times. The weight is a hash of (seed, replicate, unit), so no index draws
+are stored and every model, corruption and severity sees the same weight for the same unit. The replicates of all
+the cells are thus paired, which is what the metrics (and the differences between models) are computed over.
+Only the largest impostor scores and the genuine scores are reweighted, a batch of replicates at a time, so a
+thousand replicates of IJB-C-scale scores take a few seconds per cell.
+
+Refer to the functions and the associated function description for the details about the arguments and the function outputs
+'''
+
+# ---------------------------------------------- import necessary libraries
+
+# general
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+# matrix manipulation
+import numpy as np
+
+# scores and similarities
+from verification import default_fprs, tail_size
+from embedding_store import cosine_similarities
+
+# CDF of the Poisson(1) distribution the weights are drawn from by inversion (the tail beyond 20 is below 1e-19)
+poisson_cdf = np.cumsum([math.exp(-1) / math.factorial(k) for k in range(20)])
+
+# ---------------------------------------------- Helper Utils
+
+def mix64(x):
+    '''
+    It returns the splitmix64 finalizer of the uint64 array `x`, a bijection scattering every bit of the input.
+    '''
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def poisson_weights(units, replicates, seed=0):
+    '''
+    It returns the (replicates, units) array of the Poisson(1) weight of every unit in every replicate,
+    a function of (seed, replicate, unit) only.
+    :units: The integer ids of the units, eg- pair indices or identity labels.
+    :replicates: The indices of the replicates.
+    :seed: The seed of the bootstrap.
+    '''
+    seed_key = np.uint64((seed * 0x9E3779B97F4A7C15 + 1) % 2**64)
+    replicate_keys = mix64(np.asarray(replicates, dtype=np.uint64) * np.uint64(0xD1B54A32D192ED03) + seed_key)
+    units = mix64(np.asarray(units).astype(np.uint64))
+    uniform = (mix64(replicate_keys[:, None] ^ units[None, :]) >> np.uint64(11)) * 2.0**-53
+    return np.searchsorted(poisson_cdf, uniform, side='right').astype(np.float32)
+
+def replicate_batches(num_replicates, batch_size):
+    for start in range(0, num_replicates, batch_size):
+        yield np.arange(start, min(start + batch_size, num_replicates))
+
+# ---------------------------------------------- Verification Replicates
+
+def bootstrap_tpr(genuine, impostor, fprs=default_fprs, num_replicates=1000, genuine_units=None, impostor_units=None,
+                  seed=0, tail_factor=4, batch_size=32):
+    '''
+    It returns the (replicates, fprs) array of the TPR at every FPR (see `verification.tpr_at_fpr`) in every bootstrap
+    replicate of the genuine and impostor pairs.
+    :genuine: The scores of the genuine pairs.
+    :impostor: The scores of the impostor pairs.
+    :fprs: The FPRs the TPRs are computed at. Defaults to `verification.default_fprs`.
+    :num_replicates: The number of bootstrap replicates.
+    :genuine_units: The unit every genuine pair is resampled with, eg- its identity. Defaults to the pair itself.
+    :impostor_units: The unit every impostor pair is resampled with. Defaults to the pair itself, in which case the
+                     impostor total is kept at the number of impostor pairs (it varies by 1/sqrt(num_impostors) only).
+    :seed: The seed of the bootstrap, the same for all the models to compare.
+    :tail_factor: How many times more impostor scores than `tpr_at_fpr` needs are reweighted, so that the thresholds
+                  of every replicate are in them.
+    :batch_size: The number of replicates computed at once.
+    '''
+    genuine, impostor = np.asarray(genuine), np.asarray(impostor)
+    fprs = np.asarray(fprs, dtype=np.float64)
+    num_genuine, num_impostors = len(genuine), len(impostor)
+
+    # the genuine pairs by increasing score, the largest impostor scores by decreasing score
+    genuine_order = np.argsort(genuine)
+    sorted_genuine = genuine[genuine_order]
+    genuine_units = genuine_order if genuine_units is None else np.asarray(genuine_units)[genuine_order]
+
+    num_tail = min(num_impostors, tail_factor * tail_size(num_impostors, fprs))
+    tail_index = np.argpartition(impostor, num_impostors - num_tail)[num_impostors - num_tail:]
+    tail_index = tail_index[np.argsort(impostor[tail_index])[::-1]]
+    tail = impostor[tail_index]
+    # distinct from the genuine pairs by default
+    tail_units = num_genuine + tail_index if impostor_units is None else np.asarray(impostor_units)[tail_index]
+    if impostor_units is not None:
+        total_units, total_counts = np.unique(impostor_units, return_counts=True)
+
+    tpr = np.empty((num_replicates, len(fprs)))
+    for replicates in replicate_batches(num_replicates, batch_size):
+        # impostors counted above every position of the tail, and the positions within the FPR of each replicate
+        tail_weights = poisson_weights(tail_units, replicates, seed)
+        above = np.cumsum(tail_weights, axis=1, dtype=np.float64) - tail_weights
+        if impostor_units is None:
+            impostor_total = np.full(len(replicates), float(num_impostors))
+        else:
+            impostor_total = poisson_weights(total_units, replicates, seed) @ total_counts.astype(np.float32)
+        allowed = fprs[None, :] * impostor_total[:, None] * (1 + 1e-9)
+        position = (above[:, None, :] <= allowed[:, :, None]).sum(axis=2) - 1
+
+        all_accepted = (above[:, -1] + tail_weights[:, -1])[:, None] <= allowed
+        if num_tail < num_impostors and np.any(position == num_tail - 1):
+            raise ValueError(f'the threshold of a replicate is beyond the {num_tail} largest impostor scores, '
+                             'increase `tail_factor`')
+        thresholds = np.where(all_accepted & (num_tail == num_impostors), -np.inf, tail[position])
+
+        # genuine weight at and above every position, taken at the first genuine score above every threshold
+        genuine_weights = poisson_weights(genuine_units, replicates, seed)
+        genuine_above = np.zeros((len(replicates), num_genuine + 1))
+        genuine_above[:, :-1] = np.cumsum(genuine_weights[:, ::-1], axis=1, dtype=np.float64)[:, ::-1]
+        accepted = np.take_along_axis(genuine_above, np.searchsorted(sorted_genuine, thresholds, side='right'), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tpr[replicates] = accepted / genuine_above[:, :1]
+    return tpr
+
+def bootstrap_tpr_array(scores, model_names, corruption_names, severities=range(6), fprs=default_fprs,
+                        num_replicates=1000, genuine_units=None, impostor_units=None, seed=0, num_threads=1, **options):
+    '''
+    It returns the (replicates, models, corruptions, severities, fprs) array of the TPR of every cell in every bootstrap
+    replicate. `eval_metric.compute_mVCE(tpr[..., f], decimals=None)` turns it into the (replicates, models, groups)
+    replicates of mVCE and RmVCE.
+    :scores: A function of (model name, corruption name, severity) returning the (genuine, impostor) scores of
+             the cell, with the pairs in the same order for every cell (see `verification.tpr_array`).
+    :model_names: The models, in the order of the second axis.
+    :corruption_names: The corruptions, in the order of the third axis.
+    :severities: The severities, in the order of the fourth axis. Defaults to `0, 1, ... 5`.
+    :fprs: The FPRs the TPRs are computed at, in the order of the last axis.
+    :num_replicates: The number of bootstrap replicates.
+    :genuine_units, impostor_units: The units the pairs are resampled with, the same for every cell, see `bootstrap_tpr`.
+    :seed: The seed of the bootstrap.
+    :num_threads: The number of cells computed at once (numpy releases the GIL on the large arrays).
+    :options: The `tail_factor` and `batch_size` of `bootstrap_tpr`.
+    '''
+    severities = list(severities)
+    cells = [(m, c, s) for m in range(len(model_names)) for c in range(len(corruption_names)) for s in range(len(severities))]
+    tpr = np.empty((num_replicates, len(model_names), len(corruption_names), len(severities), len(fprs)))
+
+    def compute(cell):
+        m, c, s = cell
+        genuine, impostor = scores(model_names[m], corruption_names[c], severities[s])
+        tpr[:, m, c, s] = bootstrap_tpr(genuine, impostor, fprs, num_replicates, genuine_units, impostor_units, seed, **options)
+
+    with ThreadPoolExecutor(num_threads) as executor:
+        list(executor.map(compute, cells))
+    return tpr
+
+# ---------------------------------------------- Similarity Replicates
+
+def bootstrap_similarity_array(store, model_names, corruption_names, severities=range(6), num_replicates=1000,
+                               units=None, seed=0, batch_size=32, chunk_size=2**16):
+    '''
+    It returns the (replicates, models, corruptions, severities) array of the average cosine similarity between the
+    clean and corrupted embeddings of every cell (see `embedding_store.similarity_array`) in every bootstrap replicate
+    of the images. `eval_metric.compute_mCEI(similarity, decimals=None)` turns it into the (replicates, models, groups)
+    replicates of mCEI.
+    :store: The `EmbeddingStore` of the embeddings.
+    :model_names: The models, in the order of the second axis.
+    :corruption_names: The corruptions, in the order of the third axis.
+    :severities: The severities, in the order of the last axis. Defaults to `0, 1, ... 5`.
+    :num_replicates: The number of bootstrap replicates.
+    :units: The unit every image of the store is resampled with, eg- its identity. Defaults to the image itself.
+    :seed: The seed of the bootstrap, the same as the one of `bootstrap_tpr_array` to pair the two.
+    :batch_size: The number of replicates computed at once.
+    :chunk_size: The number of embeddings read at a time.
+    '''
+    severities = list(severities)
+    units = np.arange(store.num_images) if units is None else np.asarray(units)
+    unit_ids, unit_index, unit_counts = np.unique(units, return_inverse=True, return_counts=True)
+
+    similarity = np.empty((num_replicates, len(model_names), len(corruption_names), len(severities)))
+    for m, model_name in enumerate(model_names):
+        clean = store.open(model_name)
+        for c, corruption_name in enumerate(corruption_names):
+            # the severities of one (model, corruption), severity 0 only once per model as it's the same for all
+            cells = [s for s, severity in enumerate(severities) if severity != 0 or c == 0]
+
+            # their similarities summed per unit, the replicates are then weighted sums of them
+            unit_sums = np.empty((len(cells), len(unit_ids)), dtype=np.float32)
+            for row, s in enumerate(cells):
+                corrupted = clean if severities[s] == 0 else store.open(model_name, corruption_name, severities[s])
+                unit_sums[row] = np.bincount(unit_index, cosine_similarities(clean, corrupted, chunk_size),
+                                             minlength=len(unit_ids))
+
+            for replicates in replicate_batches(num_replicates, batch_size):
+                weights = poisson_weights(unit_ids, replicates, seed)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    similarity[replicates[:, None], m, c, cells] = (weights @ unit_sums.T /
+                                                                    (weights @ unit_counts.astype(np.float32))[:, None])
+
+        for s, severity in enumerate(severities):
+            if severity == 0:
+                similarity[:, m, 1:, s] = similarity[:, m, :1, s]
+    return similarity
+
+# ---------------------------------------------- Intervals and Significance
+
+def confidence_interval(replicates, level=0.95):
+    '''
+    It returns the (low, high) percentile bootstrap confidence interval of the metric replicated along the first axis,
+    eg- of the (replicates, models, groups) mVCE replicates.
+    :level: The confidence level of the interval. Defaults to `0.95`.
+    '''
+    return tuple(np.nanpercentile(replicates, [50 * (1 - level), 50 * (1 + level)], axis=0))
+
+def pairwise_significance(replicates):
+    '''
+    It returns the (models, models, ...) array of the two-sided bootstrap p-value of the difference between every two
+    models, from the paired (replicates, models, ...) replicates of a metric, eg- of mVCE. Small values mean that
+    the two models differ beyond the resampling noise.
+    '''
+    differences = replicates[:, :, None] - replicates[:, None, :]
+    p_value = 2 * np.minimum(np.mean(differences <= 0, axis=0), np.mean(differences >= 0, axis=0))
+    return np.minimum(p_value, 1)
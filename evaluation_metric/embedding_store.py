@@ -0,0 +1,217 @@
+'''
+This file provides an on-disk store of the embeddings the mCEI metric is computed from, and the reducer computing
+the average cosine similarity between the clean and corrupted embeddings with bounded memory.
+
+The store holds one memory-mapped .npy block of embeddings per (model, corruption, severity), at
+`{root}/{model}/{severity}/{corruption}.npy`, the clean embeddings at `{root}/{model}/clean.npy`. The rows of every
+block follow the index order of the `FRDataset` of the images, which the store records a fingerprint of
+in `{root}/store.json`.
+
+Refer to the functions and the associated function description for the details about the arguments and the function outputs
+'''
+
+# ---------------------------------------------- import necessary libraries
+
+# general
+import os
+import json
+import hashlib
+import tempfile
+
+# matrix manipulation
+import numpy as np
+
+# bump whenever the layout of the store changes
+store_version = 1
+
+# ---------------------------------------------- Helper Utils
+
+def dataset_fingerprint(dataset):
+    '''
+    It returns the digest of the image order of a dataset, the same for every dataset listing the same images
+    in the same order, whatever folder it is read from.
+    :dataset: An `FRDataset`, or the list of the image paths relative to its `indir_path`.
+    '''
+    paths = dataset.index.files if hasattr(dataset, 'image_paths') else dataset
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(path.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+def row_norms(embeddings):
+    return np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))
+
+# ---------------------------------------------- Embedding Store
+
+class EmbeddingWriter:
+    """
+    Writes the block of embeddings of one (model, corruption, severity), sequentially or at given image
+    indices, to a temporary memory-mapped file moved into place by `close` once every row is written.
+    """
+    def __init__(self, path, num_images, dim, dtype):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy.tmp')
+        os.close(fd)
+        self.block = np.lib.format.open_memmap(self.tmp_path, mode='w+', dtype=dtype, shape=(num_images, dim))
+        self.written = np.zeros(num_images, dtype=bool)
+        self.position = 0
+
+    def write(self, embeddings, indices=None):
+        '''
+        writes the (batch size, dim) `embeddings` of the images at `indices` of the dataset,
+        of the images following the last written ones by default
+        '''
+        if indices is None:
+            indices = slice(self.position, self.position + len(embeddings))
+            self.position += len(embeddings)
+        self.block[indices] = embeddings
+        self.written[indices] = True
+
+    def close(self):
+        '''
+        moves the block into place, raising if some images have no embedding
+        '''
+        if not self.written.all():
+            self.abort()
+            raise ValueError(f'{np.sum(~self.written)} images have no embedding in... {self.path}')
+        self.block.flush()
+        del self.block
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        del self.block
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class EmbeddingStore:
+    """
+    The embeddings of the images of one dataset, clean and corrupted, for every model. Blocks are written with
+    `writer` and read back memory-mapped with `open`, so that neither needs more memory than a batch.
+    """
+    def __init__(self, root, dataset=None, dtype=np.float16):
+        '''
+        :root: the folder of the store
+        :dataset: the `FRDataset` (or its relative image paths) whose index order the rows follow. It is recorded
+            when the store is created and checked against the recorded one otherwise. None skips the check.
+        :dtype: the dtype new blocks are written in (float16 halves the size of float32)
+        '''
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        info_path = os.path.join(root, 'store.json')
+
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                self.info = json.load(f)
+            if self.info['version'] != store_version:
+                raise ValueError(f'the store at {root} has version {self.info["version"]}, expected {store_version}')
+            if dataset is not None and dataset_fingerprint(dataset) != self.info['fingerprint']:
+                raise ValueError(f'the store at {root} was written for other images, or in another order')
+        elif dataset is not None:
+            self.info = {'version': store_version, 'num_images': len(dataset), 'fingerprint': dataset_fingerprint(dataset)}
+            os.makedirs(root, exist_ok=True)
+            with open(info_path, 'w') as f:
+                json.dump(self.info, f)
+        else:
+            raise ValueError(f'no store at {root}, pass the `dataset` to create it')
+
+    @property
+    def num_images(self):
+        return self.info['num_images']
+
+    def path(self, model_name, corruption_name=None, severity=0):
+        '''
+        returns the path of the block of a (model, corruption, severity), of the clean embeddings for severity 0
+        '''
+        if severity == 0:
+            return os.path.join(self.root, model_name, 'clean.npy')
+        return os.path.join(self.root, model_name, str(severity), f'{corruption_name}.npy')
+
+    def writer(self, model_name, corruption_name=None, severity=0, dim=512):
+        '''
+        returns the `EmbeddingWriter` of the block of a (model, corruption, severity), see `path`
+        '''
+        return EmbeddingWriter(self.path(model_name, corruption_name, severity), self.num_images, dim, self.dtype)
+
+    def open(self, model_name, corruption_name=None, severity=0):
+        '''
+        returns the block of a (model, corruption, severity), memory-mapped read-only
+        '''
+        block = np.load(self.path(model_name, corruption_name, severity), mmap_mode='r')
+        if len(block) != self.num_images:
+            raise ValueError(f'{len(block)} embeddings for {self.num_images} images in... '
+                             f'{self.path(model_name, corruption_name, severity)}')
+        return block
+
+    def has(self, model_name, corruption_name=None, severity=0):
+        return os.path.exists(self.path(model_name, corruption_name, severity))
+
+# ---------------------------------------------- Similarity Reducer
+
+def chunk_similarities(clean, corrupted, chunk_size=2**16):
+    '''
+    It yields the start row and the cosine similarities of every chunk of `chunk_size` rows of `clean` and `corrupted`,
+    read (and computed) in float32.
+    '''
+    if len(clean) != len(corrupted):
+        raise ValueError(f'{len(clean)} clean embeddings for {len(corrupted)} corrupted ones')
+
+    for start in range(0, len(clean), chunk_size):
+        x = np.asarray(clean[start:start + chunk_size], dtype=np.float32)
+        y = np.asarray(corrupted[start:start + chunk_size], dtype=np.float32)
+        norms = np.maximum(row_norms(x) * row_norms(y), np.finfo(np.float32).tiny)
+        yield start, np.einsum('ij,ij->i', x, y) / norms
+
+def cosine_similarities(clean, corrupted, chunk_size=2**16):
+    '''
+    It returns the cosine similarity between every row of `clean` and `corrupted` (in float64), reading `chunk_size`
+    rows of each at a time (in float32).
+    :clean: The (num_images, dim) clean embeddings, eg- `EmbeddingStore.open(model_name)`.
+    :corrupted: The (num_images, dim) corrupted embeddings of the same images, in the same order.
+    '''
+    similarities = np.empty(len(clean))
+    for start, chunk in chunk_similarities(clean, corrupted, chunk_size):
+        similarities[start:start + len(chunk)] = chunk
+    return similarities
+
+def mean_cosine_similarity(clean, corrupted, chunk_size=2**16):
+    '''
+    It returns the average cosine similarity between the rows of `clean` and `corrupted`, see `cosine_similarities`,
+    summing the chunks as they are read so that no more than a chunk of similarities is held.
+    '''
+    total = 0.0
+    for _, chunk in chunk_similarities(clean, corrupted, chunk_size):
+        total += chunk.sum(dtype=np.float64)
+    return total / len(clean) if len(clean) else np.nan
+
+def similarity_array(store, model_names, corruption_names, severities=range(6), chunk_size=2**16):
+    '''
+    It returns the (models, corruptions, severities) array of the average cosine similarity between the clean and
+    corrupted embeddings of every cell, which `eval_metric.compute_mCEI` takes as is (and `eval_metric.tabulate` turns
+    into the arguments of `get_mCEI`). Severity 0 compares the clean embeddings to themselves.
+    :store: The `EmbeddingStore` of the embeddings.
+    :model_names: The models, in the order of the first axis.
+    :corruption_names: The corruptions, in the order of the second axis.
+    :severities: The severities, in the order of the third axis. Defaults to `0, 1, ... 5`.
+    :chunk_size: The number of rows read at a time.
+    '''
+    severities = list(severities)
+    similarity = np.empty((len(model_names), len(corruption_names), len(severities)))
+    for m, model_name in enumerate(model_names):
+        clean = store.open(model_name)
+        for s, severity in enumerate(severities):
+            if severity == 0:
+                # the same for every corruption
+                similarity[m, :, s] = mean_cosine_similarity(clean, clean, chunk_size)
+                continue
+            for c, corruption_name in enumerate(corruption_names):
+                similarity[m, c, s] = mean_cosine_similarity(clean, store.open(model_name, corruption_name, severity), chunk_size)
+    return similarity
@@ -3,6 +3,11 @@ This file provides all the functions required for computing the corruption evalu
 - mVCE
 - mCEI
 
+`compute_mVCE` and `compute_mCEI` compute them for every model and every severity protocol at once, from a
+(models, corruptions, severities) array of TPR@FPR or average cosine similarity values. `metric_array` builds
+such an array from a long-format DataFrame, and `metric_table` returns all the metrics of one as a DataFrame.
+`get_mVCE` and `get_mCEI` compute one protocol from the tabulated lists described below.
+
 Refer to the functions and the associated function description for the details about the arguments and the function outputs
 '''
 
@@ -11,6 +16,121 @@ Refer to the functions and the associated function description for the details a
 # matrix manipulation
 import numpy as np
 
+# the severities averaged by every protocol, in the order their metrics are returned
+severity_groups = {'overall': (1, 2, 3, 4, 5), 'low': (1, 2, 3), 'high': (4, 5)}
+
+# ---------------------------------------------- Helper Utils
+
+def group_means(values, severities, groups):
+    '''
+    It returns the mean of the (..., corruptions, severities) `values` over the corruptions and the severities of
+    every group, as an array of shape (..., groups).
+    :severities: The severity level of every entry of the last axis of `values`, in order.
+    :groups: A dict of group name -> the severity levels averaged by the group.
+    '''
+    severities = list(severities)
+    means = np.empty(values.shape[:-2] + (len(groups),))
+    for g, (name, group) in enumerate(groups.items()):
+        missing = sorted(set(group) - set(severities))
+        if missing:
+            raise ValueError(f'the severities {missing} of the group `{name}` are not in the results {severities}')
+        # one contiguous (..., severities of the group, corruptions) block, averaged in the order of the tabulated lists
+        block = np.ascontiguousarray(np.swapaxes(values[..., [severities.index(severity) for severity in group]], -1, -2))
+        means[..., g] = block.mean(axis=(-2, -1))
+    return means
+
+def round_metric(metric, decimals):
+    return metric if decimals is None else np.round(metric, decimals)
+
+def tabulated_array(result_model_names, result_corr_names, result_corrs, num_corruptions, severity):
+    '''
+    It returns the backbone names and the (models, corruptions, severities) array of the tabulated lists
+    `get_mVCE` and `get_mCEI` take, see their description.
+    '''
+    # basic check whether the input lists are of equal length and are divisible by the number of corruptions.
+    assert len(result_model_names)%num_corruptions == 0
+    assert len(result_corr_names)%num_corruptions == 0
+    for result_corr in result_corrs:
+        assert len(result_corr)%num_corruptions == 0
+    if severity not in severity_groups:
+        raise ValueError(f'unknown severity `{severity}`, valid choices are {tuple(severity_groups)}')
+
+    num_models = len(result_model_names)//num_corruptions
+    backbone_names = [result_model_names[i*num_corruptions][0] for i in range(num_models)]
+    array = np.array(result_corrs, dtype=np.float64).reshape(len(result_corrs), num_models, num_corruptions)
+    return backbone_names, np.moveaxis(array, 0, -1)
+
+def tabulate(values, model_names, corruption_names):
+    '''
+    It returns the (models, corruptions, 6 severities) array `values` as the tabulated lists `get_mVCE` and `get_mCEI`
+    take, in their order: get_mVCE(*tabulate(tpr, model_names, corruption_names), num_corruptions=len(corruption_names))
+    '''
+    values = np.asarray(values)
+    result_model_names = [[model_name] for model_name in model_names for _ in corruption_names]
+    result_corr_names = [[corruption_name] for _ in model_names for corruption_name in corruption_names]
+    result_corrs = [values[..., s].reshape(-1, 1).tolist() for s in range(values.shape[-1])]
+    return [result_model_names, result_corr_names, *result_corrs]
+
+# ---------------------------------------------- Long-format Results
+
+def metric_array(results, value, model='backbone_name', corruption='corruption_name', severity='severity_level'):
+    '''
+    It returns a long-format DataFrame of results as the (models, corruptions, severities) array the `compute_*`
+    functions take, along with the model names, the corruption names and the severity levels of its axes.
+    Models and corruptions are kept in the order they first appear in, severity levels are sorted.
+    :results: A pandas DataFrame with one row per (model, corruption, severity), eg- the rows of `df` below
+              with the TPR@FPR of every severity in a column `tpr` and its severity level in `severity_level`.
+    :value: The column of the values, eg- `tpr`.
+    :model: The column (or list of columns, eg- `['backbone_name', 'dataset']`) identifying a model;
+            the model names are tuples for a list of columns.
+    :corruption: The column of the corruption names.
+    :severity: The column of the severity levels.
+    '''
+    # pandas is only needed for DataFrames
+    import pandas as pd
+
+    model_columns = list(model) if isinstance(model, (list, tuple)) else [model]
+    model_codes = results.groupby(model_columns, sort=False).ngroup().to_numpy()
+    model_names = list(results[model_columns].drop_duplicates().itertuples(index=False, name=None))
+    if not isinstance(model, (list, tuple)):
+        model_names = [name[0] for name in model_names]
+    corruption_codes, corruption_names = pd.factorize(results[corruption])
+    severities, severity_codes = np.unique(results[severity].to_numpy(), return_inverse=True)
+
+    array = np.full((len(model_names), len(corruption_names), len(severities)), np.nan)
+    array[model_codes, corruption_codes, severity_codes] = results[value].to_numpy(dtype=np.float64)
+    if np.isnan(array).any():
+        missing = np.argwhere(np.isnan(array))[0]
+        raise ValueError(f'no `{value}` for the model {model_names[missing[0]]}, corruption '
+                         f'{corruption_names[missing[1]]} and severity {severities[missing[2]]} '
+                         f'(and {np.isnan(array).sum() - 1} more)')
+    return array, model_names, list(corruption_names), severities.tolist()
+
+def metric_table(results, tpr='tpr', similarity='similarity', groups=None, **columns):
+    '''
+    It returns the mVCE, RmVCE and mCEI of every model and severity group of a long-format DataFrame of results,
+    as a DataFrame indexed by model with a column per (metric, group).
+    :results: A pandas DataFrame with one row per (model, corruption, severity), see `metric_array`.
+    :tpr: The column of the TPR@FPR values, None to skip mVCE and RmVCE.
+    :similarity: The column of the average cosine similarities, None to skip mCEI.
+    :groups: A dict of group name -> the severity levels averaged by the group. Defaults to `severity_groups`.
+    :columns: The `model`, `corruption` and `severity` columns, see `metric_array`.
+    '''
+    import pandas as pd
+
+    groups = severity_groups if groups is None else groups
+    metrics = {}
+    if tpr is not None:
+        array, model_names, _, severities = metric_array(results, tpr, **columns)
+        metrics['mVCE'], metrics['RmVCE'] = compute_mVCE(array, severities, groups)
+    if similarity is not None:
+        array, model_names, _, severities = metric_array(results, similarity, **columns)
+        metrics['mCEI'] = compute_mCEI(array, severities, groups)
+
+    index = pd.MultiIndex.from_tuples(model_names) if model_names and isinstance(model_names[0], tuple) else model_names
+    return pd.DataFrame({(metric, name): values[:, g] for metric, values in metrics.items()
+                         for g, name in enumerate(groups)}, index=index)
+
 # ---------------------------------------------- mVCE metric
 
 '''
@@ -65,6 +185,34 @@ Let's refer the data above as `df` in the rest of the code.
 '''
 
 
+# Function for calculating mVCE and RmVCE metric over every model and severity group
+def compute_mVCE(tpr, severities=None, groups=None, decimals=2):
+    '''
+    It returns the computed mVCE and RmVCE metric of every model for every severity group, as two arrays of shape
+    (models, groups) with the groups in the order of `groups`.
+    :tpr: The (models, corruptions, severities) array of TPR values in range 0-1, eg- for `df` the (1, 16, 6)
+          array `df.iloc[:, 2:8].values.reshape(-1, 16, 6)`. Any leading axes are kept, eg- (checkpoints, datasets,
+          corruptions, severities) gives (checkpoints, datasets, groups) arrays.
+    :severities: The severity level of every entry of the last axis of `tpr`. Defaults to `0, 1, ... `.
+                 It must contain the clean severity 0 for RmVCE.
+    :groups: A dict of group name -> the severity levels averaged by the group. Defaults to `severity_groups`.
+    :decimals: The number of decimals the metrics are rounded to, None to not round them. Defaults to `2`.
+    '''
+    tpr = np.asarray(tpr, dtype=np.float64)
+    severities = list(range(tpr.shape[-1])) if severities is None else list(severities)
+    groups = severity_groups if groups is None else groups
+    if 0 not in severities:
+        raise ValueError(f'RmVCE needs the clean severity 0 in the results, got the severities {severities}')
+
+    # verification accuracy values are in range 0-1, the errors are rounded like the tabulated values
+    errors = np.round(100 - tpr * 100, 4)
+    # mean error over the corruptions and the severities of every group, for all the models at once
+    mVCE = group_means(errors, severities, groups)
+    clean = severities.index(0)
+    RmVCE = group_means(errors - errors[..., clean:clean + 1], severities, groups)
+
+    return round_metric(mVCE, decimals), round_metric(RmVCE, decimals)
+
 # Function for calculating mVCE metric
 def get_mVCE(result_model_names, result_corr_names, result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5, num_corruptions=16, severity='overall'):
     '''
@@ -84,52 +232,13 @@ def get_mVCE(result_model_names, result_corr_names, result_corr_0, result_corr_1
     :num_corruptions: The number of corruptions to be used for calculating the metric. Defaults to `16`.
     :severity: The particular variant of mVCE that should be returned. Defaults to `overall`. Valid choices are (`low`, `high`, `overall`)
     '''
-
-    # basic check whether the input lists are of equal length and are divisible by the number of corruptions.
-    assert len(result_model_names)%num_corruptions == 0
-    assert len(result_corr_names)%num_corruptions == 0
-    assert len(result_corr_0)%num_corruptions == 0
-    assert len(result_corr_1)%num_corruptions == 0
-    assert len(result_corr_2)%num_corruptions == 0
-    assert len(result_corr_3)%num_corruptions == 0
-    assert len(result_corr_4)%num_corruptions == 0
-    assert len(result_corr_5)%num_corruptions == 0
-    
-    # verification accuracy values are in range 0-1
-    error_corr_0 = np.array([round(100-(result_corr_0[i][0]*100), 4) for i in range(len(result_corr_0))])   
-    error_corr_1 = np.array([round(100-(result_corr_1[i][0]*100), 4) for i in range(len(result_corr_1))])
-    error_corr_2 = np.array([round(100-(result_corr_2[i][0]*100), 4) for i in range(len(result_corr_2))])
-    error_corr_3 = np.array([round(100-(result_corr_3[i][0]*100), 4) for i in range(len(result_corr_3))])
-    error_corr_4 = np.array([round(100-(result_corr_4[i][0]*100), 4) for i in range(len(result_corr_4))])
-    error_corr_5 = np.array([round(100-(result_corr_5[i][0]*100), 4) for i in range(len(result_corr_5))])
-    
-    # stores the computed mVCE and 
-    num_models = len(result_model_names)//num_corruptions
-    mVCE = np.zeros(num_models)
-    RmVCE = np.zeros(num_models)
-    backbone_names = []
+    backbone_names, tpr = tabulated_array(result_model_names, result_corr_names, [result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5], num_corruptions, severity)
 
     # compute the mVCE and RmVCE metric
-    for i in range(num_models):
-        start = int(i*num_corruptions)
-        end = int((i+1)*num_corruptions)
-
-        backbone_names.append(result_model_names[start][0])
-        if severity == 'overall':
-            mVCE[i] = np.mean([error_corr_1[start:end], error_corr_2[start:end], error_corr_3[start:end], error_corr_4[start:end], error_corr_5[start:end]])
-            RmVCE[i] = np.mean([error_corr_1[start:end]-error_corr_0[start:end], error_corr_2[start:end]-error_corr_0[start:end], error_corr_3[start:end]-error_corr_0[start:end], error_corr_4[start:end]-error_corr_0[start:end], error_corr_5[start:end]-error_corr_0[start:end]])
-        elif severity == 'low':
-            mVCE[i] = np.mean([error_corr_1[start:end], error_corr_2[start:end], error_corr_3[start:end]])
-            RmVCE[i] = np.mean([error_corr_1[start:end]-error_corr_0[start:end], error_corr_2[start:end]-error_corr_0[start:end], error_corr_3[start:end]-error_corr_0[start:end]])
-        elif severity == 'high':
-            mVCE[i] = np.mean([error_corr_4[start:end], error_corr_5[start:end]])
-            RmVCE[i] = np.mean([error_corr_4[start:end]-error_corr_0[start:end], error_corr_5[start:end]-error_corr_0[start:end]])
-
-        mVCE[i] = round(mVCE[i], 2)
-        RmVCE[i] = round(RmVCE[i], 2)
+    mVCE, RmVCE = compute_mVCE(tpr, groups={severity: severity_groups[severity]})
 
     # return the metric
-    return backbone_names, mVCE, RmVCE
+    return backbone_names, mVCE[:, 0], RmVCE[:, 0]
 
 # ---------------------------------------------- mCEI metric
 '''
@@ -180,7 +289,25 @@ An example for the same is shown below for ArcFace R100 Backbone's performance o
 The first 3 rows are just headers and won't be required in the function. We will refer to this dataset while explaining the arguments of `get_mCEI` function.
 Let's refer the data above as `dfsim` in the rest of the code.
 '''
-# # Function for calculating mCEI metric
+# Function for calculating mCEI metric over every model and severity group
+def compute_mCEI(similarity, severities=None, groups=None, decimals=2):
+    '''
+    It returns the computed mCEI metric of every model for every severity group, as an array of shape (models, groups)
+    with the groups in the order of `groups`.
+    :similarity: The (models, corruptions, severities) array of average cosine similarities, eg- for `dfsim` the (1, 16, 6)
+                 array `dfsim.iloc[:, 2:8].values.reshape(-1, 16, 6)`. Any leading axes are kept, like for `compute_mVCE`.
+    :severities: The severity level of every entry of the last axis of `similarity`. Defaults to `0, 1, ... `.
+    :groups: A dict of group name -> the severity levels averaged by the group. Defaults to `severity_groups`.
+    :decimals: The number of decimals the metric is rounded to, None to not round it. Defaults to `2`.
+    '''
+    similarity = np.asarray(similarity, dtype=np.float64)
+    severities = list(range(similarity.shape[-1])) if severities is None else list(severities)
+    groups = severity_groups if groups is None else groups
+
+    mCEI = group_means(similarity, severities, groups) * 100
+    return round_metric(mCEI, decimals)
+
+# Function for calculating mCEI metric
 def get_mCEI(result_model_names, result_corr_names, result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5, num_corruptions=16, severity='overall'):
     '''
     It returns the model name and the computed mCEI metric.
@@ -199,31 +326,8 @@ def get_mCEI(result_model_names, result_corr_names, result_corr_0, result_corr_1
     :num_corruptions: The number of corruptions to be used for calculating the metric. Defaults to `16`.
     :severity: The particular variant of mCEI that should be returned. Defaults to `overall`. Valid choices are (`low`, `high`, `overall`)
     '''
-    assert len(result_model_names)%num_corruptions == 0
-    assert len(result_corr_names)%num_corruptions == 0
-    assert len(result_corr_0)%num_corruptions == 0
-    assert len(result_corr_1)%num_corruptions == 0
-    assert len(result_corr_2)%num_corruptions == 0
-    assert len(result_corr_3)%num_corruptions == 0
-    assert len(result_corr_4)%num_corruptions == 0
-    assert len(result_corr_5)%num_corruptions == 0
-    
-    num_models = len(result_model_names)//num_corruptions
-    mCEI = np.zeros(num_models)
-    backbone_names = []
-
-    for i in range(num_models):
-        start = int(i*num_corruptions)
-        end = int((i+1)*num_corruptions)
-
-        backbone_names.append(result_model_names[start][0])
-        if severity == 'overall':
-            mCEI[i] = np.mean([result_corr_1[start:end], result_corr_2[start:end], result_corr_3[start:end], result_corr_4[start:end], result_corr_5[start:end]]) * 100
-        elif severity == 'low':
-            mCEI[i] = np.mean([result_corr_1[start:end], result_corr_2[start:end], result_corr_3[start:end]]) * 100
-        elif severity == 'high':
-            mCEI[i] = np.mean([result_corr_4[start:end], result_corr_5[start:end]]) * 100
+    backbone_names, similarity = tabulated_array(result_model_names, result_corr_names, [result_corr_0, result_corr_1, result_corr_2, result_corr_3, result_corr_4, result_corr_5], num_corruptions, severity)
 
-        mCEI[i] = round(mCEI[i], 2)
+    mCEI = compute_mCEI(similarity, groups={severity: severity_groups[severity]})
 
-    return backbone_names, mCEI
\ No newline at end of file
+    return backbone_names, mCEI[:, 0]
@@ -0,0 +1,258 @@
+'''
+This file provides a results database the mVCE and mCEI leaderboards are built from:
+- the TPR of every (model, dataset, corruption, severity, FPR) and the average cosine similarity of every
+  (model, dataset, corruption, severity), in an SQLite file
+- the metrics of every (model, dataset) for every severity protocol, recomputed only for the models and datasets
+  whose values were added or changed since
+- the leaderboards as markdown tables, like the ones of the README
+
+Refer to the functions and the associated function description for the details about the arguments and the function outputs
+'''
+
+# ---------------------------------------------- import necessary libraries
+
+# general
+import json
+import sqlite3
+from itertools import groupby
+
+# matrix manipulation
+import numpy as np
+
+# metrics
+from eval_metric import compute_mVCE, compute_mCEI, severity_groups
+
+# bump whenever the tables change
+store_version = 1
+
+schema = '''
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tpr (model TEXT, dataset TEXT, corruption TEXT, severity INTEGER, fpr REAL, value REAL,
+                                PRIMARY KEY (model, dataset, corruption, severity, fpr));
+CREATE TABLE IF NOT EXISTS similarity (model TEXT, dataset TEXT, corruption TEXT, severity INTEGER, value REAL,
+                                       PRIMARY KEY (model, dataset, corruption, severity));
+CREATE TABLE IF NOT EXISTS mvce (model TEXT, dataset TEXT, fpr REAL, protocol TEXT, mVCE REAL, RmVCE REAL,
+                                 num_corruptions INTEGER, PRIMARY KEY (model, dataset, fpr, protocol));
+CREATE TABLE IF NOT EXISTS mcei (model TEXT, dataset TEXT, protocol TEXT, mCEI REAL,
+                                 num_corruptions INTEGER, PRIMARY KEY (model, dataset, protocol));
+
+-- the (model, dataset) whose metrics are out of date, kept by the triggers below
+CREATE TABLE IF NOT EXISTS stale (source TEXT, model TEXT, dataset TEXT, PRIMARY KEY (source, model, dataset));
+'''
+
+# the triggers marking the (model, dataset) of every added, changed or removed value of a table as stale
+# (without `INSERT OR IGNORE`, which the conflict clause of an upsert firing them would override)
+mark_stale = '''
+    INSERT INTO stale SELECT '{table}', {row}.model, {row}.dataset WHERE NOT EXISTS
+        (SELECT 1 FROM stale WHERE source = '{table}' AND model = {row}.model AND dataset = {row}.dataset);'''
+trigger_schema = '''
+CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {table} BEGIN {mark_new}
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE ON {table} WHEN OLD.value IS NOT NEW.value BEGIN {mark_old} {mark_new}
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {table} BEGIN {mark_old}
+END;
+'''
+
+def triggers(table):
+    return trigger_schema.format(table=table, mark_new=mark_stale.format(table=table, row='NEW'),
+                                 mark_old=mark_stale.format(table=table, row='OLD'))
+
+# ---------------------------------------------- Helper Utils
+
+def cell_arrays(rows):
+    '''
+    It returns the (corruptions, severities) array of every group of `rows`, as a list of (group key, corruption
+    names, severity levels, array), skipping the groups missing a (corruption, severity) cell.
+    :rows: The (group key, corruption, severity, value) rows, sorted by group key.
+    '''
+    arrays = []
+    for key, group in groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        corruption_names = sorted({row[1] for row in group})
+        severities = sorted({row[2] for row in group})
+        if len(group) != len(corruption_names) * len(severities):
+            continue
+
+        array = np.empty((len(corruption_names), len(severities)))
+        corruption_index = {name: c for c, name in enumerate(corruption_names)}
+        severity_index = {severity: s for s, severity in enumerate(severities)}
+        for _, corruption_name, severity, value in group:
+            array[corruption_index[corruption_name], severity_index[severity]] = value
+        arrays.append((key, corruption_names, severities, array))
+    return arrays
+
+def batched_metric(arrays, compute, required):
+    '''
+    It yields the (group key, number of corruptions, metrics) of the `arrays` of `cell_arrays`, calling `compute`
+    once per shape and severity levels on all the groups of that shape stacked. Groups missing a `required`
+    severity level are skipped.
+    '''
+    arrays = [array for array in arrays if set(required) <= set(array[2])]
+    by_shape = lambda array: (array[3].shape, tuple(array[2]))
+    for (shape, severities), batch in groupby(sorted(arrays, key=by_shape), key=by_shape):
+        batch = list(batch)
+        metrics = compute(np.stack([array[3] for array in batch]), list(severities))
+        for i, (key, corruption_names, _, _) in enumerate(batch):
+            yield key, len(corruption_names), [metric[i] for metric in metrics]
+
+def format_fpr(fpr):
+    return f'{fpr:.0e}'.replace('e-0', 'e-')
+
+# ---------------------------------------------- Results Store
+
+class ResultsStore:
+    """
+    The TPR and similarity values of every model, dataset, corruption and severity, and the mVCE, RmVCE and mCEI
+    metrics computed from them. Adding values marks their (model, dataset) stale, and `update` recomputes the metrics
+    of the stale ones only, so adding a model never recomputes the others.
+    """
+    def __init__(self, path, groups=None):
+        '''
+        :path: the SQLite file of the store, created if missing (':memory:' for a temporary store)
+        :groups: a dict of protocol name -> the severity levels it averages (default: `severity_groups`).
+            Opening a store with other groups than the last time recomputes all its metrics.
+        '''
+        self.groups = severity_groups if groups is None else groups
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript(schema + triggers('tpr') + triggers('similarity'))
+            settings = dict(self.connection.execute('SELECT name, value FROM settings'))
+            if settings.get('version', str(store_version)) != str(store_version):
+                raise ValueError(f'the results store {path} has version {settings["version"]}, expected {store_version}')
+
+            groups_json = json.dumps({name: list(group) for name, group in self.groups.items()})
+            if settings.get('groups') != groups_json:
+                self.connection.execute("INSERT OR IGNORE INTO stale SELECT DISTINCT 'tpr', model, dataset FROM tpr")
+                self.connection.execute("INSERT OR IGNORE INTO stale SELECT DISTINCT 'similarity', model, dataset FROM similarity")
+            self.connection.executemany('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                                        [('version', str(store_version)), ('groups', groups_json)])
+
+    # ---------------------------------------------- Adding Results
+
+    def add_tpr_rows(self, rows):
+        '''
+        adds the (model, dataset, corruption, severity, fpr, tpr) `rows`, replacing the values already stored
+        '''
+        with self.connection:
+            self.connection.executemany('''INSERT INTO tpr VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT DO UPDATE SET value = excluded.value WHERE value IS NOT excluded.value''',
+                ((model, dataset, corruption, int(severity), float(fpr), float(value))
+                 for model, dataset, corruption, severity, fpr, value in rows))
+
+    def add_similarity_rows(self, rows):
+        '''
+        adds the (model, dataset, corruption, severity, similarity) `rows`, replacing the values already stored
+        '''
+        with self.connection:
+            self.connection.executemany('''INSERT INTO similarity VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT DO UPDATE SET value = excluded.value WHERE value IS NOT excluded.value''',
+                ((model, dataset, corruption, int(severity), float(value))
+                 for model, dataset, corruption, severity, value in rows))
+
+    def add_tpr(self, model_name, dataset, tpr, corruption_names, severities=range(6), fprs=None):
+        '''
+        adds the (corruptions, severities, fprs) array `tpr` of a model on a dataset, eg- one model of
+        `verification.tpr_array`, with the FPRs of its last axis (default: `verification.default_fprs`)
+        '''
+        if fprs is None:
+            from verification import default_fprs as fprs
+        self.add_tpr_rows((model_name, dataset, corruption_name, severity, fpr, tpr[c, s, f])
+                          for c, corruption_name in enumerate(corruption_names)
+                          for s, severity in enumerate(severities) for f, fpr in enumerate(fprs))
+
+    def add_similarity(self, model_name, dataset, similarity, corruption_names, severities=range(6)):
+        '''
+        adds the (corruptions, severities) array `similarity` of a model on a dataset, eg- one model of
+        `embedding_store.similarity_array`
+        '''
+        self.add_similarity_rows((model_name, dataset, corruption_name, severity, similarity[c, s])
+                                 for c, corruption_name in enumerate(corruption_names)
+                                 for s, severity in enumerate(severities))
+
+    # ---------------------------------------------- Metrics
+
+    def update(self):
+        '''
+        recomputes the metrics of the stale (model, dataset), and returns how many were recomputed.
+        The metrics of a (model, dataset) missing some (corruption, severity) values are left out until they are added.
+        '''
+        protocols = list(self.groups)
+        num_updated = 0
+        with self.connection:
+            for source, table, columns in (('tpr', 'mvce', 'model, dataset, fpr'), ('similarity', 'mcei', 'model, dataset')):
+                stale = f"(model, dataset) IN (SELECT model, dataset FROM stale WHERE source = '{source}')"
+                rows = self.connection.execute(f'''SELECT {columns}, corruption, severity, value FROM {source}
+                    WHERE {stale} ORDER BY {columns}''')
+                arrays = cell_arrays(((row[:-3], *row[-3:]) for row in rows))
+
+                if source == 'tpr':
+                    metrics = batched_metric(arrays, lambda tpr, severities: compute_mVCE(tpr, severities, self.groups, decimals=None),
+                                             {0}.union(*self.groups.values()))
+                    records = [(*key, protocol, mVCE[g], RmVCE[g], num_corruptions)
+                               for key, num_corruptions, (mVCE, RmVCE) in metrics for g, protocol in enumerate(protocols)]
+                else:
+                    metrics = batched_metric(arrays, lambda similarity, severities: [compute_mCEI(similarity, severities, self.groups, decimals=None)],
+                                             set().union(*self.groups.values()))
+                    records = [(*key, protocol, mCEI[g], num_corruptions)
+                               for key, num_corruptions, (mCEI,) in metrics for g, protocol in enumerate(protocols)]
+
+                num_updated += self.connection.execute(f"SELECT COUNT(*) FROM stale WHERE source = '{source}'").fetchone()[0]
+                self.connection.execute(f'DELETE FROM {table} WHERE {stale}')
+                if records:
+                    self.connection.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(records[0]))})', records)
+                self.connection.execute(f"DELETE FROM stale WHERE source = '{source}'")
+        return num_updated
+
+    def metrics(self, metric='mVCE', protocol='overall', num_corruptions=None):
+        '''
+        returns the up to date (model, dataset, fpr, value) of a metric for a protocol (fpr is None for mCEI),
+        only of the (model, dataset) scored on `num_corruptions` corruptions if given
+        '''
+        self.update()
+        table, fpr = ('mcei', 'NULL') if metric == 'mCEI' else ('mvce', 'fpr')
+        if metric not in ('mVCE', 'RmVCE', 'mCEI'):
+            raise ValueError(f'unknown metric `{metric}`, valid choices are (`mVCE`, `RmVCE`, `mCEI`)')
+        query = f'SELECT model, dataset, {fpr}, {metric} FROM {table} WHERE protocol = ?'
+        if num_corruptions is None:
+            return self.connection.execute(query, (protocol,)).fetchall()
+        return self.connection.execute(query + ' AND num_corruptions = ?', (protocol, num_corruptions)).fetchall()
+
+    # ---------------------------------------------- Leaderboard
+
+    def leaderboard(self, metric='mVCE', protocol='overall', datasets=None, num_corruptions=16, order_by=None, decimals=2):
+        '''
+        returns the leaderboard of a metric for a protocol as a markdown table: a row per model and a column per
+        dataset (per dataset and FPR for the datasets with several FPRs, listed in a second header row)
+        :datasets: the datasets of the columns, in order (default: all of them, by name)
+        :num_corruptions: only scores the models evaluated on that many corruptions of a dataset, None for all
+        :order_by: the dataset (or (dataset, fpr) column) the models are ranked by, best first (default: by name)
+        '''
+        values = {}
+        for model_name, dataset, fpr, value in self.metrics(metric, protocol, num_corruptions):
+            values[model_name, dataset, fpr] = value
+
+        if datasets is None:
+            datasets = sorted({dataset for _, dataset, _ in values})
+        columns = [(dataset, fpr) for dataset in datasets
+                   for fpr in sorted({fpr for _, other, fpr in values if other == dataset}, key=lambda fpr: -(fpr or 0))]
+        models = sorted({model_name for model_name, _, _ in values})
+        if order_by is not None:
+            column = order_by if isinstance(order_by, tuple) else next(column for column in columns if column[0] == order_by)
+            # mCEI is higher for the better models, the errors lower
+            sign = -1 if metric == 'mCEI' else 1
+            models.sort(key=lambda model_name: sign * values.get((model_name, *column), sign * np.inf))
+
+        several_fprs = any(sum(other == dataset for other, _ in columns) > 1 for dataset in datasets)
+        lines = ['| Model | ' + ' | '.join(dataset for dataset, _ in columns) + ' |',
+                 '|-------|' + ''.join(':-----:|' for _ in columns)]
+        if several_fprs:
+            lines.append('|       | ' + ' | '.join('' if fpr is None else format_fpr(fpr) for _, fpr in columns) + ' |')
+        for model_name in models:
+            cells = [values.get((model_name, *column)) for column in columns]
+            lines.append(f'| {model_name} | ' + ' | '.join('-' if value is None else f'{np.round(value, decimals):.{decimals}f}'
+                                                            for value in cells) + ' |')
+        return '\n'.join(lines)
+
+    def close(self):
+        self.connection.close()
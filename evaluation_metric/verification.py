@@ -0,0 +1,168 @@
+'''
+This file provides the functions computing the TPR@FPR the mVCE metric is built on, from raw verification scores:
+- the cosine similarity scores of pairs of embeddings
+- TPR at several FPRs and the ROC curve from genuine and impostor scores
+
+Only the impostor scores above the largest FPR asked for (the top `max(fprs) * num_impostors`) set the thresholds.
+They are selected with a partition and kept while the scores stream in chunks, so the hundreds of millions of
+impostor pairs of IJB-C are never sorted, nor held in memory when they are computed from pairs of embeddings.
+
+Refer to the functions and the associated function description for the details about the arguments and the function outputs
+'''
+
+# ---------------------------------------------- import necessary libraries
+
+# matrix manipulation
+import numpy as np
+
+# the FPRs the TPRs are reported at (the IJB-C columns of the leaderboards)
+default_fprs = (1e-4, 1e-5, 1e-6)
+
+# ---------------------------------------------- Helper Utils
+
+def tail_size(num_impostors, fprs):
+    '''
+    It returns the number of largest impostor scores the thresholds of all the `fprs` are taken from.
+    '''
+    return min(num_impostors, int(np.floor(max(fprs) * num_impostors * (1 + 1e-9))) + 1)
+
+def top_scores(tail, scores, k):
+    '''
+    It returns the `k` largest of the `tail` and `scores`, unsorted.
+    '''
+    if len(tail) == k and k > 0:
+        # only the scores that may enter the tail
+        scores = scores[scores > tail.min()]
+    tail = np.concatenate([tail, scores])
+    if len(tail) > k:
+        # in place, `tail` is already a copy
+        tail.partition(len(tail) - k)
+        tail = tail[len(tail) - k:].copy()
+    return tail
+
+def fpr_thresholds(tail, num_impostors, fprs):
+    '''
+    It returns the threshold of every FPR: the largest score accepting at most `fpr * num_impostors` impostors
+    (accepting the scores strictly above it).
+    :tail: The `tail_size(num_impostors, fprs)` largest impostor scores, in any order.
+    '''
+    tail = np.sort(tail)[::-1]
+    num_accepted = np.floor(np.asarray(fprs, dtype=np.float64) * num_impostors * (1 + 1e-9)).astype(np.int64)
+    # no threshold rejects any impostor once all of them may be accepted
+    return np.where(num_accepted < num_impostors, tail[np.minimum(num_accepted, len(tail) - 1)], -np.inf)
+
+def genuine_tpr(sorted_genuine, thresholds):
+    '''
+    It returns the fraction of the (ascending) `sorted_genuine` scores strictly above each of the `thresholds`.
+    '''
+    return 1 - np.searchsorted(sorted_genuine, thresholds, side='right') / len(sorted_genuine)
+
+# ---------------------------------------------- Scores
+
+def iter_pair_scores(embeddings, pairs, chunk_size=2**20):
+    '''
+    It yields the cosine similarity scores of the `pairs` of `embeddings`, `chunk_size` pairs at a time.
+    :embeddings: The (num_images, dim) array of embeddings, eg- a `np.memmap` of the embeddings of a dataset.
+    :pairs: The (num_pairs, 2) array of the indices of the two embeddings of every pair.
+    :chunk_size: The number of pairs scored at a time, which bounds the memory used.
+    '''
+    # the norms once, chunk by chunk so that `embeddings` may be memory-mapped
+    norms = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        norms[start:start + chunk_size] = np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+    norms = np.maximum(norms, np.finfo(np.float32).tiny)
+
+    for start in range(0, len(pairs), chunk_size):
+        first, second = np.asarray(pairs[start:start + chunk_size]).T
+        scores = np.einsum('ij,ij->i', np.asarray(embeddings[first], dtype=np.float32),
+                           np.asarray(embeddings[second], dtype=np.float32))
+        yield scores / (norms[first] * norms[second])
+
+def pair_scores(embeddings, pairs, chunk_size=2**20):
+    '''
+    It returns the cosine similarity score of every pair of `embeddings`, see `iter_pair_scores`.
+    '''
+    scores = list(iter_pair_scores(embeddings, pairs, chunk_size))
+    return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+# ---------------------------------------------- TPR@FPR
+
+def tpr_at_fpr(genuine, impostor, fprs=default_fprs):
+    '''
+    It returns the TPR at every FPR and the score threshold it is reached at, as two arrays in the order of `fprs`.
+    The TPR at an FPR is the fraction of genuine scores above the largest threshold that accepts at most that
+    fraction of the impostor scores.
+    :genuine: The scores of the genuine pairs (same identity).
+    :impostor: The scores of the impostor pairs (different identities).
+    :fprs: The FPRs the TPRs are computed at. Defaults to `default_fprs`.
+    '''
+    impostor = np.asarray(impostor)
+    # one partition for all the FPRs instead of sorting the impostor scores
+    tail = top_scores(impostor[:0], impostor, tail_size(len(impostor), fprs))
+    thresholds = fpr_thresholds(tail, len(impostor), fprs)
+    return genuine_tpr(np.sort(genuine), thresholds), thresholds
+
+def pairs_tpr_at_fpr(embeddings, pairs, labels, fprs=default_fprs, chunk_size=2**20):
+    '''
+    It returns the TPR at every FPR and its threshold (see `tpr_at_fpr`) of the `pairs` of `embeddings`,
+    scoring the pairs chunk by chunk: only the genuine scores and the largest impostor scores are kept.
+    :embeddings: The (num_images, dim) array of embeddings, eg- a `np.memmap` of the embeddings of a dataset.
+    :pairs: The (num_pairs, 2) array of the indices of the two embeddings of every pair.
+    :labels: The (num_pairs,) array, true for the genuine pairs and false for the impostor pairs.
+    :fprs: The FPRs the TPRs are computed at. Defaults to `default_fprs`.
+    :chunk_size: The number of pairs scored at a time.
+    '''
+    labels = np.asarray(labels, dtype=bool)
+    num_impostors = int(len(labels) - labels.sum())
+    k = tail_size(num_impostors, fprs)
+
+    genuine, tail = [], np.empty(0, dtype=np.float32)
+    for start, scores in zip(range(0, len(pairs), chunk_size), iter_pair_scores(embeddings, pairs, chunk_size)):
+        is_genuine = labels[start:start + chunk_size]
+        genuine.append(scores[is_genuine])
+        tail = top_scores(tail, scores[~is_genuine], k)
+
+    thresholds = fpr_thresholds(tail, num_impostors, fprs)
+    return genuine_tpr(np.sort(np.concatenate(genuine)), thresholds), thresholds
+
+def roc_curve(genuine, impostor, max_fpr=1e-2):
+    '''
+    It returns the ROC curve as the (fpr, tpr, thresholds) arrays of every distinct impostor score taken as the
+    threshold (accepting the scores strictly above it), by increasing FPR up to `max_fpr`.
+    :genuine: The scores of the genuine pairs (same identity).
+    :impostor: The scores of the impostor pairs (different identities).
+    :max_fpr: The largest FPR of the curve, None for the whole curve. Defaults to `1e-2`, which only sorts the
+              largest 1% of the impostor scores.
+    '''
+    impostor = np.asarray(impostor)
+    k = len(impostor) if max_fpr is None else tail_size(len(impostor), [max_fpr])
+    thresholds, counts = np.unique(top_scores(impostor[:0], impostor, k), return_counts=True)
+    thresholds, counts = thresholds[::-1], counts[::-1]
+
+    # the impostors strictly above every threshold are the ones of the larger scores, all of them in the tail
+    fpr = (np.cumsum(counts) - counts) / len(impostor)
+    tpr = genuine_tpr(np.sort(genuine), thresholds)
+    return fpr, tpr, thresholds
+
+# ---------------------------------------------- mVCE Inputs
+
+def tpr_array(scores, model_names, corruption_names, severities=range(6), fprs=default_fprs):
+    '''
+    It returns the (models, corruptions, severities, fprs) array of the TPR of every cell, which
+    `eval_metric.compute_mVCE(tpr[..., f])` takes as is (and `eval_metric.tabulate` turns into the arguments of `get_mVCE`).
+    :scores: A function of (model name, corruption name, severity) returning the (genuine, impostor) scores of
+             the cell, eg- computed by `pair_scores`. Severity 0 is the clean dataset.
+    :model_names: The models, in the order of the first axis.
+    :corruption_names: The corruptions, in the order of the second axis.
+    :severities: The severities, in the order of the third axis. Defaults to `0, 1, ... 5`.
+    :fprs: The FPRs the TPRs are computed at, in the order of the last axis. Defaults to `default_fprs`.
+    '''
+    severities = list(severities)
+    tpr = np.empty((len(model_names), len(corruption_names), len(severities), len(fprs)))
+    for m, model_name in enumerate(model_names):
+        for c, corruption_name in enumerate(corruption_names):
+            for s, severity in enumerate(severities):
+                genuine, impostor = scores(model_name, corruption_name, severity)
+                tpr[m, c, s] = tpr_at_fpr(genuine, impostor, fprs)[0]
+    return tpr